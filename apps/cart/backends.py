@@ -0,0 +1,366 @@
+"""
+Cart storage backends.
+
+``settings.CART_BACKEND`` names the backend class and get_cart returns the
+current user's cart from it. Both backends hand out objects with the same API
+as the Cart model (add_item, set_quantity, remove_item, apply_changes, clear,
+get_item, get_line, lines, total_items, total_price, checkout), so views do
+not care where the cart lives:
+
+* DatabaseCartBackend (default) returns the Cart model itself.
+* RedisCartBackend keeps each cart in a Redis hash and only writes it to
+  PostgreSQL at checkout or when flush_carts persists the carts changed since
+  the last flush, so adding, updating and counting items makes no SQL
+  round-trips. A cart missing from Redis is loaded from PostgreSQL once.
+
+Every change to a Redis cart increments its version key. Persisting writes a
+snapshot of the hash and only takes the cart off the dirty set once that
+write has committed and the version is still the snapshot's, so a failed
+write or a change made meanwhile leaves the cart to the next flush.
+"""
+import threading
+from decimal import Decimal
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.utils.module_loading import import_string
+import logging
+
+from .models import Cart, CartItem
+from .counter import invalidate_cart_count
+from apps.products.models import Product
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BACKEND = 'apps.cart.backends.DatabaseCartBackend'
+
+
+class CartBackend:
+    """Base class for cart backends"""
+
+    def get_cart(self, user):
+        """Return ``user``'s cart, creating an empty one if needed"""
+        raise NotImplementedError
+
+    def count(self, user):
+        """Return the number of items in ``user``'s cart without creating one"""
+        raise NotImplementedError
+
+    def flush(self, limit=None):
+        """Persist carts changed since the last flush and return how many were written"""
+        return 0
+
+
+class DatabaseCartBackend(CartBackend):
+    """Carts stored as Cart/CartItem rows"""
+
+    def get_cart(self, user):
+        cart, created = Cart.objects.get_or_create(user=user)
+        return cart
+
+    def count(self, user):
+        return Cart.objects.filter(user=user).values_list('item_count', flat=True).first() or 0
+
+
+class RedisCart:
+    """
+    A cart held in the Redis hash ``cart:<user id>``.
+
+    Each line is stored as ``q:<product id>`` (quantity) and ``p:<product id>``
+    (unit price when the product was added), so totals are computed from the
+    hash alone. Redis carts have no CartItem rows; their line ids are the
+    product ids. ``cart:<user id>:version`` counts the changes.
+    """
+    LOADED = '_loaded'
+
+    def __init__(self, backend, user):
+        self.backend = backend
+        self.user = user
+        self.id = None
+        self.key = f'{backend.key_prefix}{user.pk}'
+        self.version_key = f'{self.key}:version'
+        self._data = None
+
+    @property
+    def client(self):
+        return self.backend.client
+
+    @staticmethod
+    def _decode(data):
+        return {key.decode(): value.decode() for key, value in data.items()}
+
+    def _read(self):
+        if self._data is None:
+            data = self._decode(self.client.hgetall(self.key))
+            if self.LOADED not in data:
+                data = self._load_from_database()
+            self._data = data
+        return self._data
+
+    def _load_from_database(self):
+        """Seed Redis from the PostgreSQL cart, if any, and return the hash"""
+        data = {self.LOADED: '1'}
+        for product_id, quantity, price in CartItem.objects.filter(cart__user=self.user).values_list('product_id', 'quantity', 'product__price'):
+            data[f'q:{product_id}'] = str(quantity)
+            data[f'p:{product_id}'] = str(price)
+        # HSETNX, so a change another request made meanwhile is not overwritten
+        pipe = self.client.pipeline()
+        for field, value in data.items():
+            pipe.hsetnx(self.key, field, value)
+        pipe.expire(self.key, self.backend.ttl)
+        pipe.hgetall(self.key)
+        return self._decode(pipe.execute()[-1])
+
+    def _write(self, pipe):
+        """Run the queued changes in one MULTI/EXEC and mark the cart for flushing"""
+        pipe.hset(self.key, self.LOADED, '1')
+        pipe.expire(self.key, self.backend.ttl)
+        pipe.incr(self.version_key)
+        pipe.expire(self.version_key, self.backend.ttl)
+        pipe.sadd(self.backend.dirty_key, self.user.pk)
+        self._data = None
+        results = pipe.execute()
+        invalidate_cart_count(self.user.pk)
+        return results
+
+    def _quantities(self):
+        return {
+            int(key[2:]): int(value)
+            for key, value in self._read().items() if key.startswith('q:')
+        }
+
+    def _line(self, product, quantity):
+        return CartItem(id=product.pk, product=product, quantity=quantity)
+
+    @property
+    def total_items(self):
+        return sum(self._quantities().values())
+
+    @property
+    def total_price(self):
+        data = self._read()
+        return sum(
+            (Decimal(data.get(f'p:{product_id}', '0')) * quantity for product_id, quantity in self._quantities().items()),
+            Decimal('0')
+        )
+
+    @property
+    def items(self):
+        return self.lines()
+
+    def lines(self):
+        """Return the cart's lines as unsaved CartItems with their products loaded"""
+        quantities = self._quantities()
+        products = Product.objects.in_bulk(list(quantities))
+        return [
+            self._line(products[product_id], quantity)
+            for product_id, quantity in sorted(quantities.items()) if product_id in products
+        ]
+
+    def get_item(self, product_id):
+        """Return the line for ``product_id`` or raise CartItem.DoesNotExist"""
+        try:
+            quantity = self._quantities().get(int(product_id))
+        except (TypeError, ValueError):
+            # A missing or malformed id, which matches no line either
+            raise CartItem.DoesNotExist
+        if quantity is None:
+            raise CartItem.DoesNotExist
+        try:
+            return self._line(Product.objects.get(pk=product_id), quantity)
+        except Product.DoesNotExist:
+            raise CartItem.DoesNotExist
+
+    def get_line(self, line_id):
+        return self.get_item(line_id)
+
+    def quantities(self, product_ids):
+        quantities = self._quantities()
+        return {product_id: quantities[product_id] for product_id in product_ids if product_id in quantities}
+
+    def add_item(self, product, quantity=1):
+        self._read()
+        pipe = self.client.pipeline()
+        pipe.hincrby(self.key, f'q:{product.pk}', quantity)
+        pipe.hset(self.key, f'p:{product.pk}', str(product.price))
+        new_quantity = self._write(pipe)[0]
+        return self._line(product, new_quantity)
+
+    def set_quantity(self, cart_item, quantity):
+        self._read()
+        pipe = self.client.pipeline()
+        if quantity > 0:
+            pipe.hset(self.key, mapping={f'q:{cart_item.product_id}': quantity, f'p:{cart_item.product_id}': str(cart_item.product.price)})
+        else:
+            pipe.hdel(self.key, f'q:{cart_item.product_id}', f'p:{cart_item.product_id}')
+        self._write(pipe)
+        cart_item.quantity = quantity
+        return cart_item
+
+    def remove_item(self, product):
+        self._read()
+        pipe = self.client.pipeline()
+        pipe.hdel(self.key, f'q:{product.pk}', f'p:{product.pk}')
+        self._write(pipe)
+
+    def apply_changes(self, adds, sets, removes):
+        self._read()
+        pipe = self.client.pipeline()
+        for product in removes:
+            pipe.hdel(self.key, f'q:{product.pk}', f'p:{product.pk}')
+        for product, quantity in sets.items():
+            pipe.hset(self.key, mapping={f'q:{product.pk}': quantity, f'p:{product.pk}': str(product.price)})
+        for product, quantity in adds.items():
+            pipe.hincrby(self.key, f'q:{product.pk}', quantity)
+            pipe.hset(self.key, f'p:{product.pk}', str(product.price))
+        self._write(pipe)
+
+    def clear(self):
+        pipe = self.client.pipeline()
+        pipe.delete(self.key)
+        self._write(pipe)
+
+    def _snapshot(self):
+        """Return the hash and its version as of one instant"""
+        self._data = None
+        self._read()
+        pipe = self.client.pipeline()
+        pipe.hgetall(self.key)
+        pipe.get(self.version_key)
+        data, version = pipe.execute()
+        self._data = self._decode(data)
+        return self._quantities(), version
+
+    def _mark_clean(self, version):
+        """Take the cart off the dirty set unless it changed since ``version``"""
+        from redis.exceptions import WatchError
+        with self.client.pipeline() as pipe:
+            try:
+                pipe.watch(self.version_key)
+                if pipe.get(self.version_key) != version:
+                    return
+                pipe.multi()
+                pipe.srem(self.backend.dirty_key, self.user.pk)
+                pipe.execute()
+            except WatchError:
+                pass
+
+    def persist(self):
+        """Write this cart to its Cart/CartItem rows and return the Cart"""
+        cart, quantities = self._persist()
+        return cart
+
+    def _persist(self):
+        """persist, also returning the quantities written"""
+        quantities, version = self._snapshot()
+        with transaction.atomic():
+            cart, created = Cart.objects.get_or_create(user=self.user)
+            cart.items.exclude(product_id__in=list(quantities)).delete()
+            existing = {item.product_id: item for item in cart.items.filter(product_id__in=list(quantities))}
+            new_items, updated = [], []
+            for product_id, quantity in quantities.items():
+                item = existing.get(product_id)
+                if item is None:
+                    new_items.append(CartItem(cart=cart, product_id=product_id, quantity=quantity))
+                elif item.quantity != quantity:
+                    item.quantity = quantity
+                    updated.append(item)
+            CartItem.objects.bulk_update(updated, ['quantity'])
+            # Skip products deleted since they were added
+            valid = set(Product.objects.filter(pk__in=[item.product_id for item in new_items]).values_list('id', flat=True))
+            CartItem.objects.bulk_create([item for item in new_items if item.product_id in valid])
+            Cart.objects.filter(pk=cart.pk).reconcile_totals()
+            cart.refresh_from_db()
+            transaction.on_commit(lambda: self._mark_clean(version))
+        return cart, quantities
+
+    def _subtract(self, quantities):
+        """Remove ``quantities`` from the cart, keeping anything added since"""
+        from redis.exceptions import WatchError
+        with self.client.pipeline() as pipe:
+            while True:
+                try:
+                    pipe.watch(self.key)
+                    current = self._decode(pipe.hgetall(self.key))
+                    pipe.multi()
+                    for product_id, quantity in quantities.items():
+                        remaining = int(current.get(f'q:{product_id}', 0)) - quantity
+                        if remaining > 0:
+                            pipe.hset(self.key, f'q:{product_id}', remaining)
+                        else:
+                            pipe.hdel(self.key, f'q:{product_id}', f'p:{product_id}')
+                    self._write(pipe)
+                    return
+                except WatchError:
+                    continue
+
+    def checkout(self):
+        """Persist the cart, create an order from it and take the ordered lines out of the cart"""
+        from apps.orders.models import Order
+        cart, quantities = self._persist()
+        order = Order.create_order_from_cart(cart)
+        self._subtract(quantities)
+        return order
+
+
+class RedisCartBackend(CartBackend):
+    """Carts stored in Redis and persisted to PostgreSQL lazily"""
+    key_prefix = 'cart:'
+    dirty_key = 'cart:dirty'
+
+    def __init__(self, url=None, ttl=None):
+        self.url = url or settings.REDIS_URL
+        self.ttl = ttl or getattr(settings, 'CART_REDIS_TTL', 60 * 60 * 24 * 30)
+        self._client = None
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    import redis
+                    self._client = redis.Redis.from_url(self.url)
+        return self._client
+
+    def get_cart(self, user):
+        return RedisCart(self, user)
+
+    def count(self, user):
+        return RedisCart(self, user).total_items
+
+    def flush(self, limit=None):
+        """Persist up to ``limit`` changed carts to PostgreSQL"""
+        user_ids = [int(user_id) for user_id in self.client.srandmember(self.dirty_key, limit or 1000)]
+        users = get_user_model().objects.in_bulk(user_ids)
+        flushed = 0
+        for user_id in user_ids:
+            user = users.get(user_id)
+            if user is None:
+                self.client.srem(self.dirty_key, user_id)
+                continue
+            try:
+                RedisCart(self, user).persist()
+                flushed += 1
+            except Exception as e:
+                logger.error(f"Failed to persist cart for user {user_id}: {e}")
+        return flushed
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_cart_backend():
+    """Return the process-wide backend configured by CART_BACKEND"""
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                _backend = import_string(getattr(settings, 'CART_BACKEND', DEFAULT_BACKEND))()
+    return _backend
+
+
+def get_cart(user):
+    """Return ``user``'s cart from the configured backend"""
+    return get_cart_backend().get_cart(user)
@@ -0,0 +1,38 @@
+"""
+Cart item counts for the navbar badge.
+
+The count is kept per user in the cache. Cart mutations drop it (see
+invalidate_cart_count) and the next read recomputes it from the cart backend
+without creating a cart, so polling the badge is a single cache read.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+
+def _key(user_id):
+    return f'cart:count:{user_id}'
+
+
+def get_cart_count(user):
+    """Return the number of items in ``user``'s cart"""
+    key = _key(user.pk)
+    count = cache.get(key)
+    if count is None:
+        from .backends import get_cart_backend
+        count = get_cart_backend().count(user)
+        cache.add(key, count, getattr(settings, 'CART_COUNT_TTL', 300))
+    return count
+
+
+def invalidate_cart_count(user_id):
+    """
+    Drop the cached count after a cart change.
+
+    The key is deleted right away and again once the surrounding transaction
+    commits, so a count read before the change was visible does not stick;
+    CART_COUNT_TTL bounds anything that still slips through.
+    """
+    key = _key(user_id)
+    cache.delete(key)
+    transaction.on_commit(lambda: cache.delete(key))
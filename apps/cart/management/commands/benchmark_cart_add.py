@@ -0,0 +1,83 @@
+import threading
+import time
+import uuid
+from decimal import Decimal
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection, connections
+from django.test.utils import CaptureQueriesContext
+from apps.cart.models import Cart
+from apps.products.models import Category, Product
+
+class Command(BaseCommand):
+    help = 'Benchmarks Cart.add_item: queries per call, latency and lost updates under concurrent adds'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--calls', type=int, default=500, help='Sequential add_item calls to time')
+        parser.add_argument('--products', type=int, default=10, help='Distinct products the calls cycle through')
+        parser.add_argument('--threads', type=int, default=8, help='Concurrent clients adding the same product')
+        parser.add_argument('--adds', type=int, default=50, help='add_item calls per concurrent client')
+
+    def handle(self, *args, **options):
+        suffix = uuid.uuid4().hex[:8]
+        user = get_user_model().objects.create_user(username=f'cart-benchmark-{suffix}')
+        category = Category.objects.create(name=f'Cart benchmark {suffix}')
+        products = Product.objects.bulk_create([
+            Product(name=f'Cart benchmark product {i}', description='', price=Decimal('1.50'), stock=0, category=category)
+            for i in range(options['products'])
+        ])
+        cart = Cart.objects.create(user=user)
+
+        try:
+            self._sequential(cart, products, options['calls'])
+            self._concurrent(cart, products[0], options['threads'], options['adds'])
+        finally:
+            user.delete()
+            category.delete()
+
+    def _sequential(self, cart, products, calls):
+        latencies = []
+        with CaptureQueriesContext(connection) as queries:
+            for i in range(calls):
+                start = time.perf_counter()
+                cart.add_item(products[i % len(products)], 1)
+                latencies.append(time.perf_counter() - start)
+
+        latencies.sort()
+        self.stdout.write(
+            f'{calls} calls on {connection.vendor}: queries/call={len(queries) / calls:.2f} '
+            f'p50={latencies[len(latencies) // 2] * 1000:.2f}ms p99={latencies[int(len(latencies) * 0.99) - 1] * 1000:.2f}ms'
+        )
+
+    def _concurrent(self, cart, product, threads, adds):
+        cart.clear()
+        barrier = threading.Barrier(threads)
+
+        def client():
+            try:
+                own = Cart.objects.get(pk=cart.pk)
+                barrier.wait()
+                for _ in range(adds):
+                    own.add_item(product, 1)
+            finally:
+                connections.close_all()
+
+        workers = [threading.Thread(target=client) for _ in range(threads)]
+        started = time.perf_counter()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        wall = time.perf_counter() - started
+
+        expected = threads * adds
+        quantity = cart.items.get(product=product).quantity
+        cart.refresh_from_db()
+        self.stdout.write(
+            f'{threads} clients x {adds} adds: quantity={quantity} item_count={cart.item_count} '
+            f'expected={expected} wall={wall * 1000:.1f}ms'
+        )
+        if quantity == expected and cart.item_count == expected:
+            self.stdout.write(self.style.SUCCESS('No lost updates'))
+        else:
+            self.stdout.write(self.style.ERROR(f'Lost {expected - quantity} update(s)'))
@@ -0,0 +1,29 @@
+import time
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from apps.cart.backends import get_cart_backend
+
+class Command(BaseCommand):
+    help = 'Persists carts changed in the cart backend (e.g. Redis) to the database'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='Carts persisted per batch')
+        parser.add_argument('--interval', type=float, default=60.0, help='Seconds between flushes')
+        parser.add_argument('--once', action='store_true', help='Flush the changed carts and exit')
+
+    def handle(self, *args, **options):
+        backend = get_cart_backend()
+        batch_size = options['batch_size']
+        self.stdout.write(f'Flushing carts from {backend.__class__.__name__}...')
+
+        while True:
+            close_old_connections()
+            flushed = backend.flush(batch_size)
+            if flushed:
+                self.stdout.write(f'Persisted {flushed} cart(s)')
+            if flushed < batch_size:
+                if options['once']:
+                    break
+                time.sleep(options['interval'])
+
+        self.stdout.write(self.style.SUCCESS('Carts flushed'))
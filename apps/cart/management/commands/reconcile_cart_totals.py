@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+from apps.cart.models import Cart
+
+class Command(BaseCommand):
+    help = 'Recomputes stored cart totals from the cart items at current product prices'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--product', type=int, action='append', dest='products', help='Only carts containing this product id (repeatable)')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Carts updated per UPDATE statement')
+
+    def handle(self, *args, **options):
+        carts = Cart.objects.order_by('id')
+        if options['products']:
+            carts = carts.filter(items__product_id__in=options['products']).distinct()
+        ids = list(carts.values_list('id', flat=True))
+
+        updated = 0
+        batch_size = options['batch_size']
+        for start in range(0, len(ids), batch_size):
+            updated += Cart.objects.filter(id__in=ids[start:start + batch_size]).reconcile_totals()
+
+        self.stdout.write(self.style.SUCCESS(f'Reconciled totals for {updated} cart(s)'))
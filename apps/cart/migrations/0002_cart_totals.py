@@ -0,0 +1,38 @@
+# Generated by Django 4.2.7 on 2026-10-18 09:54
+
+from django.db import migrations, models
+from django.db.models import F, Sum, OuterRef, Subquery, DecimalField
+from django.db.models.functions import Coalesce
+
+def backfill_totals(apps, schema_editor):
+    Cart = apps.get_model('cart', 'Cart')
+    CartItem = apps.get_model('cart', 'CartItem')
+    items = CartItem.objects.filter(cart=OuterRef('pk')).order_by().values('cart')
+    money = DecimalField(max_digits=12, decimal_places=2)
+    Cart.objects.update(
+        item_count=Coalesce(Subquery(items.annotate(total=Sum('quantity')).values('total')), 0),
+        subtotal=Coalesce(
+            Subquery(items.annotate(total=Sum(F('quantity') * F('product__price'), output_field=money)).values('total')),
+            0,
+            output_field=money
+        )
+    )
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("cart", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="cart",
+            name="item_count",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="cart",
+            name="subtotal",
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=12),
+        ),
+        migrations.RunPython(backfill_totals, migrations.RunPython.noop),
+    ]
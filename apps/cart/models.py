@@ -1,44 +1,265 @@
-from django.db import models
+from django.db import models, transaction, connection
+from django.db.models import F, Sum, OuterRef, Subquery, DecimalField
+from django.db.models.functions import Coalesce
 from django.conf import settings
+from django.utils import timezone
 from apps.products.models import Product
+from .counter import invalidate_cart_count
 from decimal import Decimal
 
+def _increment_items_sql(count):
+    """
+    An ``INSERT ... ON CONFLICT DO UPDATE`` adding ``count`` (cart, product,
+    quantity) rows to the items, incrementing the quantity of existing ones.
+    """
+    item_table = connection.ops.quote_name(CartItem._meta.db_table)
+    values = ', '.join(['(%s, %s, %s, %s, %s)'] * count)
+    return (
+        f'INSERT INTO {item_table} (cart_id, product_id, quantity, created_at, updated_at) VALUES {values} '
+        'ON CONFLICT (cart_id, product_id) DO UPDATE '
+        f'SET quantity = {item_table}.quantity + EXCLUDED.quantity, updated_at = EXCLUDED.updated_at'
+    )
+
+
+def _increment_items_params(cart, lines, now):
+    now = connection.ops.adapt_datetimefield_value(now)
+    return [value for product, quantity in lines for value in (cart.pk, product.pk, quantity, now, now)]
+
+
+def merge_cart_operations(operations):
+    """
+    Collapse ``(op, product, quantity)`` operations, applied in order, into
+    the net change per product.
+
+    ``op`` is 'add', 'set' or 'remove'. Returns ``(adds, sets, removes)``:
+    quantities to add to whatever the cart holds, quantities to set, and
+    products to remove.
+    """
+    net = {}
+    for op, product, quantity in operations:
+        previous = net.get(product)
+        if op == 'remove' or (op == 'set' and quantity <= 0):
+            net[product] = ('remove', 0)
+        elif op == 'set':
+            net[product] = ('set', quantity)
+        elif previous is None:
+            net[product] = ('add', quantity)
+        elif previous[0] == 'remove':
+            net[product] = ('set', quantity)
+        else:
+            net[product] = (previous[0], previous[1] + quantity)
+
+    adds = {product: quantity for product, (op, quantity) in net.items() if op == 'add'}
+    sets = {product: quantity for product, (op, quantity) in net.items() if op == 'set'}
+    removes = [product for product, (op, quantity) in net.items() if op == 'remove']
+    return adds, sets, removes
+
+
+def _from_db(field, value):
+    """Convert a value read with a raw cursor the way the ORM would"""
+    col = field.get_col(field.model._meta.db_table)
+    for converter in connection.ops.get_db_converters(col) + col.get_db_converters(connection):
+        value = converter(value, col, connection)
+    return value
+
+
+class CartQuerySet(models.QuerySet):
+    def reconcile_totals(self):
+        """
+        Recompute item_count and subtotal from the cart items at current
+        product prices, in a single UPDATE. Returns the number of carts updated.
+        """
+        items = CartItem.objects.filter(cart=OuterRef('pk')).order_by().values('cart')
+        money = DecimalField(max_digits=12, decimal_places=2)
+        return self.update(
+            item_count=Coalesce(Subquery(items.annotate(total=Sum('quantity')).values('total')), 0),
+            subtotal=Coalesce(
+                Subquery(items.annotate(total=Sum(F('quantity') * F('product__price'), output_field=money)).values('total')),
+                0,
+                output_field=money
+            ),
+            updated_at=timezone.now()
+        )
+
+
 class Cart(models.Model):
     user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='cart')
+    # Running totals kept in step with the items by add_item, set_quantity,
+    # remove_item, apply_changes and clear. The subtotal uses the price at the
+    # time each item was added or changed; reconcile_cart_totals brings it back
+    # in line after price changes.
+    item_count = models.PositiveIntegerField(default=0)
+    subtotal = models.DecimalField(max_digits=12, decimal_places=2, default=0)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = CartQuerySet.as_manager()
+
     def __str__(self):
         return f"Cart for {self.user.username}"
 
     @property
     def total_items(self):
         """Returns the total number of items in the cart"""
-        return sum(item.quantity for item in self.items.all())
+        return self.item_count
 
     @property
     def total_price(self):
         """Returns the total price of all items in the cart"""
-        return sum(item.subtotal for item in self.items.all())
+        return self.subtotal
+
+    def lines(self):
+        """Return the cart's items with their products loaded"""
+        return list(self.items.select_related('product'))
+
+    def get_item(self, product_id):
+        """Return the item for ``product_id`` or raise CartItem.DoesNotExist"""
+        return self.items.select_related('product').get(product_id=product_id)
+
+    def get_line(self, line_id):
+        """Return the item with id ``line_id`` or raise CartItem.DoesNotExist"""
+        return self.items.select_related('product').get(pk=line_id)
+
+    def quantities(self, product_ids):
+        """Return ``{product_id: quantity}`` for those of ``product_ids`` in the cart"""
+        return dict(self.items.filter(product_id__in=product_ids).values_list('product_id', 'quantity'))
+
+    def persist(self):
+        """Database carts are always persisted; see apps/cart/backends.py"""
+        return self
+
+    def checkout(self):
+        """Create an order from the cart, which empties it"""
+        from apps.orders.models import Order
+        return Order.create_order_from_cart(self)
+
+    def _adjust_totals(self, quantity, amount):
+        """Apply a change in item count and subtotal to the stored totals"""
+        if not quantity and not amount:
+            return
+        Cart.objects.filter(pk=self.pk).update(
+            item_count=F('item_count') + quantity,
+            subtotal=F('subtotal') + amount,
+            updated_at=timezone.now()
+        )
+        self.item_count += quantity
+        self.subtotal += amount
 
     def add_item(self, product, quantity=1):
-        """Add a product to the cart or update its quantity if it already exists"""
-        cart_item, created = self.items.get_or_create(
+        """
+        Add a product to the cart or increase its quantity if it is already
+        there.
+
+        The item is written with a single ``INSERT ... ON CONFLICT (cart_id,
+        product_id) DO UPDATE`` so concurrent adds of the same product add up
+        instead of overwriting each other. On PostgreSQL the cart totals are
+        updated by the same statement.
+        """
+        amount = product.price * quantity
+        now = timezone.now()
+        upsert = _increment_items_sql(1) + ' RETURNING id, quantity, created_at'
+        params = _increment_items_params(self, [(product, quantity)], now)
+
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                cart_table = connection.ops.quote_name(Cart._meta.db_table)
+                cursor.execute(
+                    f'WITH item AS ({upsert}), totals AS ('
+                    f'UPDATE {cart_table} SET item_count = item_count + %s, subtotal = subtotal + %s, updated_at = %s WHERE id = %s'
+                    ') SELECT id, quantity, created_at FROM item',
+                    params + [quantity, amount, now, self.pk]
+                )
+                row = cursor.fetchone()
+                self.item_count += quantity
+                self.subtotal += amount
+            else:
+                with transaction.atomic():
+                    cursor.execute(upsert, params)
+                    row = cursor.fetchone()
+                    self._adjust_totals(quantity, amount)
+
+        invalidate_cart_count(self.user_id)
+        item_id, item_quantity, created_at = row
+        return CartItem(
+            id=item_id,
+            cart=self,
             product=product,
-            defaults={'quantity': quantity}
+            quantity=item_quantity,
+            created_at=_from_db(CartItem._meta.get_field('created_at'), created_at),
+            updated_at=now
         )
-        if not created:
-            cart_item.quantity += quantity
-            cart_item.save()
+
+    def set_quantity(self, cart_item, quantity):
+        """Change the quantity of one of this cart's items, removing it if quantity is 0"""
+        with transaction.atomic():
+            cart_item = self.items.select_for_update().select_related('product').get(pk=cart_item.pk)
+            delta = quantity - cart_item.quantity
+            if quantity > 0:
+                cart_item.quantity = quantity
+                cart_item.save()
+            else:
+                cart_item.delete()
+            self._adjust_totals(delta, cart_item.product.price * delta)
+        invalidate_cart_count(self.user_id)
         return cart_item
 
     def remove_item(self, product):
         """Remove a product from the cart"""
-        self.items.filter(product=product).delete()
+        with transaction.atomic():
+            quantity = sum(self.items.select_for_update().filter(product=product).values_list('quantity', flat=True))
+            self.items.filter(product=product).delete()
+            self._adjust_totals(-quantity, -product.price * quantity)
+        invalidate_cart_count(self.user_id)
+
+    def apply_changes(self, adds, sets, removes):
+        """
+        Apply the output of merge_cart_operations in one transaction: one
+        DELETE for the removals, one upsert each for the sets and the adds,
+        then one UPDATE applying the change to the totals at the given
+        products' prices, as the single-item methods do.
+        """
+        now = timezone.now()
+        with transaction.atomic():
+            touched = [product.pk for product in removes] + [product.pk for product in sets]
+            current = dict(
+                self.items.select_for_update().filter(product_id__in=touched).values_list('product_id', 'quantity')
+            ) if touched else {}
+            count = amount = 0
+            for product in removes:
+                removed = current.pop(product.pk, 0)
+                count -= removed
+                amount -= product.price * removed
+            for product, quantity in sets.items():
+                delta = quantity - current.get(product.pk, 0)
+                count += delta
+                amount += product.price * delta
+            for product, quantity in adds.items():
+                count += quantity
+                amount += product.price * quantity
+
+            if removes:
+                self.items.filter(product__in=removes).delete()
+            if sets:
+                CartItem.objects.bulk_create(
+                    [CartItem(cart=self, product=product, quantity=quantity) for product, quantity in sets.items()],
+                    update_conflicts=True,
+                    unique_fields=['cart', 'product'],
+                    update_fields=['quantity', 'updated_at']
+                )
+            if adds:
+                with connection.cursor() as cursor:
+                    cursor.execute(_increment_items_sql(len(adds)), _increment_items_params(self, adds.items(), now))
+            self._adjust_totals(count, amount)
+        invalidate_cart_count(self.user_id)
 
     def clear(self):
         """Remove all items from the cart"""
-        self.items.all().delete()
+        with transaction.atomic():
+            self.items.all().delete()
+            Cart.objects.filter(pk=self.pk).update(item_count=0, subtotal=0, updated_at=timezone.now())
+            self.item_count = 0
+            self.subtotal = 0
+        invalidate_cart_count(self.user_id)
 
 class CartItem(models.Model):
     cart = models.ForeignKey(Cart, on_delete=models.CASCADE, related_name='items')
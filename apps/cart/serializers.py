@@ -12,6 +12,8 @@ class CartItemSerializer(serializers.ModelSerializer):
     class Meta:
         model = CartItem
         fields = ['id', 'product', 'quantity', 'subtotal']
+        # subtotal reads product.price, see savannah_ecommerce/shaping.py
+        select_related = ['product']
 
     def get_subtotal(self, obj):
         return obj.subtotal
@@ -30,3 +32,23 @@ class CartSerializer(serializers.ModelSerializer):
 
     def get_total_price(self, obj):
         return obj.total_price
+
+class CartOperationSerializer(serializers.Serializer):
+    op = serializers.ChoiceField(choices=['add', 'set', 'remove'])
+    product_id = serializers.IntegerField()
+    quantity = serializers.IntegerField(required=False, default=1, min_value=0)
+
+    def validate(self, data):
+        if data['op'] == 'add' and data['quantity'] <= 0:
+            raise serializers.ValidationError({'quantity': 'Quantity must be greater than 0'})
+        return data
+
+class CartBulkSerializer(serializers.Serializer):
+    MAX_OPERATIONS = 200
+
+    operations = CartOperationSerializer(many=True, allow_empty=False)
+
+    def validate_operations(self, value):
+        if len(value) > self.MAX_OPERATIONS:
+            raise serializers.ValidationError(f'At most {self.MAX_OPERATIONS} operations per request')
+        return value
@@ -3,7 +3,13 @@ from django.urls import reverse
 from django.contrib.auth import get_user_model
 from apps.products.models import Product, Category
 from apps.cart.models import Cart, CartItem
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from decimal import Decimal
+from io import StringIO
+from tests.utils import QueryCountMixin
 
 User = get_user_model()
 
@@ -14,8 +20,8 @@ class CartModelTests(TestCase):
         self.user = User.objects.create_user(username='testuser', password='password')
         self.cart = Cart.objects.create(user=self.user)
         self.category = Category.objects.create(name='Electronics')
-        self.product1 = Product.objects.create(name='Laptop', price=Decimal('1200.00'), category=self.category)
-        self.product2 = Product.objects.create(name='Mouse', price=Decimal('25.00'), category=self.category)
+        self.product1 = Product.objects.create(name='Laptop', price=Decimal('1200.00'), stock=10, category=self.category)
+        self.product2 = Product.objects.create(name='Mouse', price=Decimal('25.00'), stock=10, category=self.category)
 
     def test_cart_creation(self):
         self.assertIsInstance(self.cart, Cart)
@@ -70,14 +76,91 @@ class CartModelTests(TestCase):
         self.assertEqual(self.cart.items.count(), 0)
         self.assertEqual(self.cart.total_price, Decimal('0.00'))
 
+    def test_add_item_is_one_upsert(self):
+        self.cart.add_item(self.product1, 1)
+        cart = Cart.objects.get(pk=self.cart.pk)
+
+        with CaptureQueriesContext(connection) as queries:
+            cart_item = cart.add_item(self.product1, 2)
+
+        item_writes = [query for query in queries if 'cart_cartitem' in query['sql']]
+        self.assertEqual(len(item_writes), 1)
+        self.assertIn('ON CONFLICT', item_writes[0]['sql'])
+        if connection.vendor == 'postgresql':
+            self.assertEqual(len(queries), 1)
+        self.assertEqual(cart_item.quantity, 3)
+        self.assertIsNotNone(cart_item.created_at)
+        self.assertEqual(cart.total_items, 3)
+
+        # The returned item is a normal, saveable row
+        cart_item.quantity = 4
+        cart_item.save()
+        self.assertEqual(CartItem.objects.get(pk=cart_item.pk).quantity, 4)
+
+    def test_stored_totals_follow_mutations(self):
+        cart_item = self.cart.add_item(self.product1, 2)
+        self.cart.add_item(self.product2, 5)
+        self.cart.set_quantity(cart_item, 1)
+        self.cart.remove_item(self.product2)
+
+        cart = Cart.objects.get(pk=self.cart.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(cart.total_items, 1)
+            self.assertEqual(cart.total_price, Decimal('1200.00'))
+
+        self.cart.set_quantity(cart_item, 0)
+        cart.refresh_from_db()
+        self.assertEqual(cart.total_items, 0)
+        self.assertEqual(cart.total_price, Decimal('0.00'))
+        self.assertFalse(cart.items.exists())
+
+    def test_bulk_changes_price_like_single_item_changes(self):
+        self.cart.add_item(self.product2, 2)
+        self.cart.add_item(self.product1, 1)
+        # Each edit is priced at the product's price when it is made
+        mouse = Product.objects.get(pk=self.product2.pk)
+        mouse.price = Decimal('20.00')
+        self.cart.apply_changes({mouse: 1}, {self.product1: 3}, [])
+
+        cart = Cart.objects.get(pk=self.cart.pk)
+        self.assertEqual((cart.total_items, cart.total_price), (6, Decimal('3670.00')))
+        self.assertEqual((self.cart.total_items, self.cart.total_price), (6, Decimal('3670.00')))
+
+        self.cart.apply_changes({}, {}, [self.product1])
+        self.cart.refresh_from_db()
+        self.assertEqual((self.cart.total_items, self.cart.total_price), (3, Decimal('70.00')))
+
+    def test_reconcile_totals_after_price_change(self):
+        self.cart.add_item(self.product1, 2)
+        self.cart.add_item(self.product2, 4)
+        other = Cart.objects.create(user=User.objects.create_user(username='other', password='password'))
+        other.add_item(self.product2, 1)
+        Product.objects.filter(pk=self.product2.pk).update(price=Decimal('20.00'))
+
+        out = StringIO()
+        call_command('reconcile_cart_totals', '--product', str(self.product2.pk), stdout=out)
+        self.assertIn('Reconciled totals for 2 cart(s)', out.getvalue())
+
+        self.cart.refresh_from_db()
+        other.refresh_from_db()
+        self.assertEqual((self.cart.total_items, self.cart.total_price), (6, Decimal('2480.00')))
+        self.assertEqual((other.total_items, other.total_price), (1, Decimal('20.00')))
+
+        empty = Cart.objects.create(user=User.objects.create_user(username='empty', password='password'))
+        Cart.objects.filter(pk=empty.pk).update(item_count=3, subtotal=Decimal('9.00'))
+        Cart.objects.filter(pk=empty.pk).reconcile_totals()
+        empty.refresh_from_db()
+        self.assertEqual((empty.total_items, empty.total_price), (0, Decimal('0.00')))
+
 class CartViewTests(TestCase):
     def setUp(self):
         self.client = Client()
         self.user = User.objects.create_user(username='testuser', password='password')
         self.client.login(username='testuser', password='password')
         self.category = Category.objects.create(name='Electronics')
-        self.product = Product.objects.create(name='Laptop', price=Decimal('1200.00'), category=self.category)
+        self.product = Product.objects.create(name='Laptop', price=Decimal('1200.00'), stock=10, category=self.category)
         self.cart, created = Cart.objects.get_or_create(user=self.user)
+        cache.clear()
 
     def test_cart_detail_view(self):
         response = self.client.get(reverse('cart:cart_detail'))
@@ -96,6 +179,33 @@ class CartViewTests(TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertEqual(response.json()['count'], 3)
 
+    def test_cart_count_is_cached_and_conditional(self):
+        url = reverse('cart:cart_count')
+        etag = self.client.get(url)['ETag']
+
+        # Only the session and user are loaded; the count comes from the cache
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual([query['sql'] for query in queries if 'cart_' in query['sql']], [])
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+
+        self.client.post(reverse('cart:add_to_cart', args=[self.product.id]), {'quantity': 2})
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['count'], 2)
+        self.assertNotEqual(response['ETag'], etag)
+
+        cart_item = self.cart.items.get()
+        self.client.post(reverse('cart:remove_from_cart', args=[cart_item.id]))
+        self.assertEqual(self.client.get(url).json()['count'], 0)
+
+    def test_cart_count_does_not_create_a_cart(self):
+        self.cart.delete()
+        response = self.client.get(reverse('cart:cart_count'))
+        self.assertEqual(response.json()['count'], 0)
+        self.assertFalse(Cart.objects.filter(user=self.user).exists())
+
     def test_add_to_cart_view(self):
         response = self.client.post(reverse('cart:add_to_cart', args=[self.product.id]), {'quantity': 2})
         self.assertEqual(response.status_code, 302)
@@ -103,6 +213,12 @@ class CartViewTests(TestCase):
         self.assertEqual(self.cart.items.count(), 1)
         self.assertEqual(self.cart.items.first().quantity, 2)
 
+    def test_cart_views_count_the_quantity_already_in_the_cart(self):
+        cart_item = self.cart.add_item(self.product, 8)
+        self.client.post(reverse('cart:add_to_cart', args=[self.product.id]), {'quantity': 3})
+        self.client.post(reverse('cart:update_cart_item', args=[cart_item.id]), {'quantity': 11})
+        self.assertEqual(self.cart.items.get().quantity, 8)
+
     def test_update_cart_item_view(self):
         cart_item = self.cart.add_item(self.product, 2)
         response = self.client.post(reverse('cart:update_cart_item', args=[cart_item.id]), {'quantity': 5})
@@ -110,6 +226,9 @@ class CartViewTests(TestCase):
         self.assertRedirects(response, reverse('cart:cart_detail'))
         cart_item.refresh_from_db()
         self.assertEqual(cart_item.quantity, 5)
+        self.cart.refresh_from_db()
+        self.assertEqual(self.cart.total_items, 5)
+        self.assertEqual(self.cart.total_price, Decimal('6000.00'))
 
     def test_remove_from_cart_view(self):
         cart_item = self.cart.add_item(self.product, 2)
@@ -118,6 +237,8 @@ class CartViewTests(TestCase):
         self.assertEqual(response.status_code, 302)
         self.assertRedirects(response, reverse('cart:cart_detail'))
         self.assertEqual(self.cart.items.count(), 0)
+        self.cart.refresh_from_db()
+        self.assertEqual(self.cart.total_items, 0)
 
     def test_checkout_view_empty_cart(self):
         response = self.client.get(reverse('cart:checkout'))
@@ -132,7 +253,7 @@ class CartSerializerTests(TestCase):
         self.user = User.objects.create_user(username='testuser', password='password')
         self.cart = Cart.objects.create(user=self.user)
         self.category = Category.objects.create(name='Electronics')
-        self.product = Product.objects.create(name='Laptop', price=Decimal('1200.00'), category=self.category)
+        self.product = Product.objects.create(name='Laptop', price=Decimal('1200.00'), stock=10, category=self.category)
 
     def test_cart_serializer(self):
         cart_item = self.cart.add_item(self.product, 2)
@@ -146,17 +267,16 @@ class CartSerializerTests(TestCase):
         self.assertEqual(Decimal(data['total_price']), Decimal('2400.00'))
 
 from rest_framework import status
-from unittest.mock import patch
 from apps.orders.models import Order
 from django.urls import reverse as rest_reverse
 
-class CartViewSetTests(TestCase):
+class CartViewSetTests(QueryCountMixin, TestCase):
     def setUp(self):
         self.client = Client()
         self.user = User.objects.create_user(username='testuser', password='password')
         self.client.force_login(self.user)
         self.category = Category.objects.create(name='Electronics')
-        self.product = Product.objects.create(name='Laptop', price=Decimal('1200.00'), category=self.category)
+        self.product = Product.objects.create(name='Laptop', price=Decimal('1200.00'), stock=10, category=self.category)
         self.cart, created = Cart.objects.get_or_create(user=self.user)
 
     def test_list_cart(self):
@@ -171,6 +291,16 @@ class CartViewSetTests(TestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(response.data['user'], self.user.id)
 
+    def test_cart_endpoints_use_a_fixed_number_of_queries(self):
+        urls = [rest_reverse('cart-list'), rest_reverse('cart-detail', args=[self.cart.pk])]
+        self.cart.add_item(self.product, 1)
+        few = [self.count_queries(url) for url in urls]
+        for i in range(5):
+            self.cart.add_item(Product.objects.create(name=f'Cable {i}', price=Decimal('5.00'), stock=10, category=self.category), 1)
+        self.assertEqual([self.count_queries(url) for url in urls], few)
+        # Session and user, the page count for the list, then the cart and its items with products
+        self.assertEqual(few, [5, 4])
+
     def test_add_item_to_cart(self):
         url = rest_reverse('cart-add-item', args=[self.cart.pk])
         data = {'product_id': self.product.id, 'quantity': 3}
@@ -180,6 +310,75 @@ class CartViewSetTests(TestCase):
         self.assertEqual(self.cart.items.first().quantity, 3)
         self.assertEqual(Decimal(response.data['subtotal']), Decimal('3600.00'))
 
+    def test_stock_limits_the_resulting_line_quantity(self):
+        self.cart.add_item(self.product, 8)
+        response = self.client.post(rest_reverse('cart-add-item', args=[self.cart.pk]), {'product_id': self.product.id, 'quantity': 3})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.put(
+            rest_reverse('cart-update-item', args=[self.cart.pk]), {'product_id': self.product.id, 'quantity': 11},
+            content_type='application/json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.post(rest_reverse('cart-bulk', args=[self.cart.pk]), {'operations': [
+            {'op': 'add', 'product_id': self.product.id, 'quantity': 1},
+            {'op': 'add', 'product_id': self.product.id, 'quantity': 2},
+        ]}, content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data['operations'][0]['index'], 1)
+        self.assertEqual(self.cart.items.get().quantity, 8)
+
+    def test_bulk_operations(self):
+        mouse = Product.objects.create(name='Mouse', price=Decimal('25.00'), stock=10, category=self.category)
+        keyboard = Product.objects.create(name='Keyboard', price=Decimal('50.00'), stock=10, category=self.category)
+        self.cart.add_item(keyboard, 1)
+        self.cart.add_item(self.product, 1)
+
+        operations = [
+            {'op': 'add', 'product_id': self.product.id, 'quantity': 2},
+            {'op': 'add', 'product_id': mouse.id},
+            {'op': 'add', 'product_id': mouse.id, 'quantity': 3},
+            {'op': 'set', 'product_id': keyboard.id, 'quantity': 5},
+            {'op': 'remove', 'product_id': keyboard.id},
+            {'op': 'add', 'product_id': keyboard.id, 'quantity': 2},
+        ]
+        # The stock check reads the lines' current quantities
+        with self.assertNumQueries(12):
+            response = self.client.post(
+                rest_reverse('cart-bulk', args=[self.cart.pk]), {'operations': operations}, content_type='application/json'
+            )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            dict(self.cart.items.values_list('product_id', 'quantity')),
+            {self.product.id: 3, mouse.id: 4, keyboard.id: 2}
+        )
+        self.assertEqual(response.data['total_items'], 9)
+        self.assertEqual(Decimal(response.data['total_price']), Decimal('3800.00'))
+        self.assertEqual(len(response.data['items']), 3)
+
+    def test_bulk_operations_are_all_or_nothing(self):
+        self.cart.add_item(self.product, 1)
+        url = rest_reverse('cart-bulk', args=[self.cart.pk])
+
+        response = self.client.post(url, {'operations': [
+            {'op': 'remove', 'product_id': self.product.id},
+            {'op': 'add', 'product_id': 999999},
+        ]}, content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(response.data['product_ids'], [999999])
+
+        response = self.client.post(url, {'operations': [
+            {'op': 'remove', 'product_id': self.product.id},
+            {'op': 'set', 'product_id': self.product.id, 'quantity': 11},
+        ]}, content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data['operations'][0]['index'], 1)
+
+        response = self.client.post(url, {'operations': [{'op': 'add', 'product_id': self.product.id, 'quantity': 0}]}, content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        self.assertEqual(self.cart.items.get().quantity, 1)
+
     def test_update_cart_item_quantity(self):
         cart_item = self.cart.add_item(self.product, 2)
         url = rest_reverse('cart-update-item', args=[self.cart.pk])
@@ -188,6 +387,9 @@ class CartViewSetTests(TestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         cart_item.refresh_from_db()
         self.assertEqual(cart_item.quantity, 5)
+        self.cart.refresh_from_db()
+        self.assertEqual(self.cart.total_items, 5)
+        self.assertEqual(self.cart.total_price, Decimal('6000.00'))
         self.assertEqual(Decimal(response.data['subtotal']), Decimal('6000.00'))
 
     def test_remove_item_from_cart(self):
@@ -211,17 +413,25 @@ class CartViewSetTests(TestCase):
         self.cart.add_item(self.product, 2)
         self.assertEqual(self.cart.items.count(), 1)
         url = rest_reverse('cart-checkout', args=[self.cart.pk])
-        # Mocking send_order_notifications to prevent external calls during testing
-        with patch('apps.cart.views.send_order_notifications') as mock_send_notification:
-            response = self.client.post(url)
-            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
-            self.assertEqual(self.cart.items.count(), 0) # Cart should be empty after checkout
-            self.assertEqual(Order.objects.count(), 1) # An order should be created
-            created_order = Order.objects.first()
-            self.assertEqual(created_order.user, self.user)
-            self.assertEqual(created_order.total_price, Decimal('2400.00'))
-            self.assertEqual(created_order.items.count(), 1) # Order should have one item
-            mock_send_notification.assert_called_once_with(created_order)
+        response = self.client.post(url)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(self.cart.items.count(), 0) # Cart should be empty after checkout
+        self.assertEqual(Order.objects.count(), 1) # An order should be created
+        created_order = Order.objects.first()
+        self.assertEqual(created_order.user, self.user)
+        self.assertEqual(created_order.total_price, Decimal('2400.00'))
+        self.assertEqual(created_order.items.count(), 1) # Order should have one item
+        # Notifications are queued for the outbox worker, not sent inline
+        self.assertEqual(created_order.notifications.count(), 2)
+
+    def test_checkout_insufficient_stock(self):
+        self.cart.add_item(self.product, 2)
+        Product.objects.filter(pk=self.product.pk).update(stock=1)
+        url = rest_reverse('cart-checkout', args=[self.cart.pk])
+        response = self.client.post(url)
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(response.data['items'], [{'product_id': self.product.id, 'requested': 2, 'available': 1}])
+        self.assertEqual(Order.objects.count(), 0)
 
     def test_checkout_empty_cart(self):
         url = rest_reverse('cart-checkout', args=[self.cart.pk])
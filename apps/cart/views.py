@@ -4,17 +4,26 @@ from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
 from django.shortcuts import get_object_or_404, render, redirect
 from django.contrib.auth.decorators import login_required
-from django.http import JsonResponse
+from django.http import JsonResponse, Http404
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import quote_etag
 from django.contrib import messages
-from .models import Cart, CartItem
-from .serializers import CartSerializer, CartItemSerializer
+from .models import Cart, CartItem, merge_cart_operations
+from .serializers import CartSerializer, CartItemSerializer, CartBulkSerializer
+from .backends import get_cart
+from .counter import get_cart_count
 from apps.products.models import Product
-from apps.orders.models import Order, OrderItem
+from apps.products.stock import InsufficientStock
+from savannah_ecommerce.shaping import SerializerQuerysetMixin, prefetch_for_serializer
 import logging
 
 logger = logging.getLogger(__name__)
 
-class CartViewSet(viewsets.ModelViewSet):
+def _exceeds_stock(cart, product, quantity):
+    """Whether adding ``quantity`` of ``product`` would put more in ``cart`` than is in stock"""
+    return cart.quantities([product.pk]).get(product.pk, 0) + quantity > product.stock
+
+class CartViewSet(SerializerQuerysetMixin, viewsets.ModelViewSet):
     serializer_class = CartSerializer
     permission_classes = [IsAuthenticated]
 
@@ -24,7 +33,9 @@ class CartViewSet(viewsets.ModelViewSet):
 
     def get_object(self):
         """Get or create a cart for the current user"""
-        cart, created = Cart.objects.get_or_create(user=self.request.user)
+        cart = get_cart(self.request.user)
+        if self.action == 'retrieve' and isinstance(cart, Cart):
+            prefetch_for_serializer([cart], CartSerializer)
         return cart
 
     @action(detail=True, methods=['post'])
@@ -48,6 +59,12 @@ class CartViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
 
+        if _exceeds_stock(cart, product, quantity):
+            return Response(
+                {'error': f'Only {product.stock} of {product.name} left in stock'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
         cart_item = cart.add_item(product, quantity)
         serializer = CartItemSerializer(cart_item)
         return Response(serializer.data, status=status.HTTP_200_OK)
@@ -60,7 +77,7 @@ class CartViewSet(viewsets.ModelViewSet):
         quantity = int(request.data.get('quantity', 1))
 
         try:
-            cart_item = cart.items.get(product_id=product_id)
+            cart_item = cart.get_item(product_id)
         except CartItem.DoesNotExist:
             return Response(
                 {'error': 'Item not found in cart'},
@@ -71,8 +88,13 @@ class CartViewSet(viewsets.ModelViewSet):
             cart.remove_item(cart_item.product)
             return Response(status=status.HTTP_204_NO_CONTENT)
 
-        cart_item.quantity = quantity
-        cart_item.save()
+        if quantity > cart_item.product.stock:
+            return Response(
+                {'error': f'Only {cart_item.product.stock} of {cart_item.product.name} left in stock'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        cart_item = cart.set_quantity(cart_item, quantity)
         serializer = CartItemSerializer(cart_item)
         return Response(serializer.data)
 
@@ -93,6 +115,51 @@ class CartViewSet(viewsets.ModelViewSet):
         cart.remove_item(product)
         return Response(status=status.HTTP_204_NO_CONTENT)
 
+    @action(detail=True, methods=['post'])
+    def bulk(self, request, pk=None):
+        """
+        Apply a list of add/set/remove operations in one transaction and
+        return the resulting cart. Nothing is applied if any operation is
+        invalid.
+        """
+        serializer = CartBulkSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        operations = serializer.validated_data['operations']
+
+        products = Product.objects.in_bulk({operation['product_id'] for operation in operations})
+        missing = sorted({operation['product_id'] for operation in operations} - set(products))
+        if missing:
+            return Response(
+                {'error': 'Product not found', 'product_ids': missing},
+                status=status.HTTP_404_NOT_FOUND
+            )
+
+        # The quantity each line ends up with, against the last operation on it
+        cart = self.get_object()
+        quantities = cart.quantities(list(products))
+        last = {}
+        for index, operation in enumerate(operations):
+            product_id = operation['product_id']
+            if operation['op'] == 'add':
+                quantities[product_id] = quantities.get(product_id, 0) + operation['quantity']
+            else:
+                quantities[product_id] = operation['quantity'] if operation['op'] == 'set' else 0
+            last[product_id] = index
+        errors = [
+            {'index': index, 'error': f'Only {products[product_id].stock} of {products[product_id].name} left in stock'}
+            for product_id, index in sorted(last.items(), key=lambda item: item[1])
+            if quantities[product_id] > products[product_id].stock
+        ]
+        if errors:
+            return Response({'error': 'Insufficient stock', 'operations': errors}, status=status.HTTP_400_BAD_REQUEST)
+
+        cart.apply_changes(*merge_cart_operations(
+            (operation['op'], products[operation['product_id']], operation['quantity']) for operation in operations
+        ))
+        if isinstance(cart, Cart):
+            prefetch_for_serializer([cart], CartSerializer)
+        return Response(CartSerializer(cart).data)
+
     @action(detail=True, methods=['post'])
     def clear(self, request, pk=None):
         """Clear all items from the cart"""
@@ -105,30 +172,29 @@ class CartViewSet(viewsets.ModelViewSet):
         """Create an order from the cart"""
         cart = self.get_object()
 
-        if not cart.items.exists():
+        if not cart.total_items:
             return Response(
                 {'error': 'Your cart is empty'},
                 status=status.HTTP_400_BAD_REQUEST
             )
 
         try:
-            # Create order using the create_order_from_cart method
-            order = Order.create_order_from_cart(cart)
-
-            # Optionally send notifications
-            try:
-                from apps.orders.views import send_order_notifications
-                send_order_notifications(order)
-                logger.info(f"Successfully sent notifications for order {order.order_number}")
-            except Exception as e:
-                logger.error(f"Failed to send notifications for order {order.order_number}: {str(e)}")
-                logger.exception("Full traceback:")
+            order = cart.checkout()
 
             # Return the created order details
             from apps.orders.serializers import OrderSerializer
+            prefetch_for_serializer([order], OrderSerializer)
             serializer = OrderSerializer(order)
             return Response(serializer.data, status=status.HTTP_201_CREATED)
 
+        except InsufficientStock as e:
+            return Response(
+                {
+                    'error': 'Insufficient stock',
+                    'items': [shortage._asdict() for shortage in e.shortages]
+                },
+                status=status.HTTP_409_CONFLICT
+            )
         except Exception as e:
             logger.error(f"Error during checkout: {str(e)}")
             logger.exception("Full traceback:")
@@ -137,50 +203,66 @@ class CartViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
 
+# Options of the quantity select on each cart line
+QUANTITY_CHOICES = range(1, 6)
+
 @login_required
 def cart_detail(request):
-    cart, created = Cart.objects.get_or_create(user=request.user)
+    cart = get_cart(request.user)
     context = {
-        'cart_items': cart.items.all(),
-        'cart_total': cart.total_price
+        'cart_items': cart.lines(),
+        'cart_total': cart.total_price,
+        'quantity_choices': QUANTITY_CHOICES,
     }
     return render(request, 'cart/detail.html', context)
 
 @login_required
 def cart_count(request):
-    cart, created = Cart.objects.get_or_create(user=request.user)
-    count = sum(item.quantity for item in cart.items.all())
-    return JsonResponse({'count': count})
+    """
+    Item count for the navbar badge, served from the cache. Clients polling
+    with If-None-Match get an empty 304 while the count is unchanged.
+    """
+    count = get_cart_count(request.user)
+    etag = quote_etag(f'cart-count-{count}')
+    response = JsonResponse({'count': count})
+    response['ETag'] = etag
+    patch_cache_control(response, private=True, no_cache=True)
+    return get_conditional_response(request, etag=etag, response=response)
+
+def _get_cart_line(user, line_id):
+    """Return the user's cart and one of its lines, or raise Http404"""
+    cart = get_cart(user)
+    try:
+        return cart, cart.get_line(line_id)
+    except CartItem.DoesNotExist:
+        raise Http404('Item not found in cart')
 
 @login_required
 def update_cart_item(request, item_id):
     """Update the quantity of a cart item"""
-    cart = get_object_or_404(Cart, user=request.user)
-    cart_item = get_object_or_404(CartItem, id=item_id, cart=cart)
+    cart, cart_item = _get_cart_line(request.user, item_id)
 
     if request.method == 'POST':
         quantity = int(request.POST.get('quantity', 1))
-        if quantity > 0:
-            cart_item.quantity = quantity
-            cart_item.save()
+        if quantity > cart_item.product.stock:
+            messages.error(request, f'Only {cart_item.product.stock} of {cart_item.product.name} left in stock')
         else:
-            cart_item.delete()
+            cart.set_quantity(cart_item, max(quantity, 0))
 
     return redirect('cart:cart_detail')
 
 @login_required
 def remove_from_cart(request, item_id):
     """Remove an item from the cart"""
-    cart = get_object_or_404(Cart, user=request.user)
-    cart_item = get_object_or_404(CartItem, id=item_id, cart=cart)
-    cart_item.delete()
+    cart, cart_item = _get_cart_line(request.user, item_id)
+    cart.remove_item(cart_item.product)
     messages.success(request, 'Item removed from cart')
     return redirect('cart:cart_detail')
 
 @login_required
 def add_to_cart(request, product_id):
     """Add a product to the cart"""
-    cart, created = Cart.objects.get_or_create(user=request.user)
+    cart = get_cart(request.user)
     product = get_object_or_404(Product, id=product_id)
     quantity = int(request.POST.get('quantity', 1))
 
@@ -188,6 +270,10 @@ def add_to_cart(request, product_id):
         messages.error(request, 'Quantity must be greater than 0')
         return redirect('products:detail', pk=product_id)
 
+    if _exceeds_stock(cart, product, quantity):
+        messages.error(request, f'Only {product.stock} of {product.name} left in stock')
+        return redirect('products:detail', pk=product_id)
+
     cart_item = cart.add_item(product, quantity)
     messages.success(request, f'{product.name} added to cart!')
     return redirect('cart:cart_detail')
@@ -195,23 +281,22 @@ def add_to_cart(request, product_id):
 @login_required
 def checkout(request):
     """Handle the checkout process"""
-    cart = get_object_or_404(Cart, user=request.user)
+    cart = get_cart(request.user)
 
-    if not cart.items.exists():
+    if not cart.total_items:
         messages.error(request, 'Your cart is empty')
         return redirect('cart:cart_detail')
 
-    # Create order using the create_order_from_cart method
-    order = Order.create_order_from_cart(cart)
-
-    # Send notifications
     try:
-        from apps.orders.views import send_order_notifications
-        send_order_notifications(order)
-        logger.info(f"Successfully sent notifications for order {order.order_number}")
-    except Exception as e:
-        logger.error(f"Failed to send notifications for order {order.order_number}: {str(e)}")
-        logger.exception("Full traceback:")
+        order = cart.checkout()
+    except InsufficientStock as e:
+        names = dict(Product.objects.filter(pk__in=[s.product_id for s in e.shortages]).values_list('id', 'name'))
+        for shortage in e.shortages:
+            messages.error(
+                request,
+                f'Only {shortage.available} of {names.get(shortage.product_id, "this product")} left in stock'
+            )
+        return redirect('cart:cart_detail')
 
     messages.success(request, 'Order placed successfully!')
     return redirect('orders:order_detail', pk=order.pk)
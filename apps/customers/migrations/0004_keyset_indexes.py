@@ -0,0 +1,22 @@
+# Generated by Django 4.2.7 on 2026-10-18 10:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("customers", "0003_link_customers_to_users"),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name="customer",
+            options={"ordering": ["-created_at", "-id"]},
+        ),
+        migrations.AddIndex(
+            model_name="customer",
+            index=models.Index(
+                fields=["created_at", "id"], name="customers_created_id_idx"
+            ),
+        ),
+    ]
@@ -12,6 +12,13 @@ class Customer(models.Model):
     created_at = models.DateTimeField(default=timezone.now)
     updated_at = models.DateTimeField(default=timezone.now)
 
+    class Meta:
+        ordering = ['-created_at', '-id']
+        indexes = [
+            # Keyset pagination, see savannah_ecommerce/pagination.py
+            models.Index(fields=['created_at', 'id'], name='customers_created_id_idx'),
+        ]
+
     def __str__(self):
         return self.name
 
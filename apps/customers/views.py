@@ -6,16 +6,18 @@ from .serializers import CustomerSerializer
 from rest_framework import status
 from rest_framework.response import Response
 from rest_framework.exceptions import ValidationError
+from savannah_ecommerce.pagination import KeysetPagination, paginate_keyset
 
 # Create your views here.
 
 def customer_list(request):
-    customers = Customer.objects.all()
+    customers = paginate_keyset(request, Customer.objects.all(), page_size=50)
     return render(request, 'customers/customer_list.html', {'customers': customers})
 
 class CustomerViewSet(viewsets.ModelViewSet):
     serializer_class = CustomerSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = KeysetPagination
     http_method_names = ['get', 'post', 'patch', 'put']  # Disable DELETE
 
     def get_queryset(self):
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Order, OrderItem
+from .models import Order, OrderItem, Notification
 
 class OrderItemInline(admin.TabularInline):
     model = OrderItem
@@ -13,6 +13,7 @@ class OrderAdmin(admin.ModelAdmin):
     search_fields = ['order_number', 'user__email', 'shipping_address']
     readonly_fields = ['order_number', 'created_at', 'updated_at']
     inlines = [OrderItemInline]
+    actions = ['cancel_orders']
 
     fieldsets = (
         ('Order Information', {
@@ -26,3 +27,19 @@ class OrderAdmin(admin.ModelAdmin):
             'classes': ('collapse',)
         })
     )
+
+    @admin.action(description='Cancel selected orders and release stock')
+    def cancel_orders(self, request, queryset):
+        cancelled = sum(1 for order in queryset if order.cancel())
+        skipped = len(queryset) - cancelled
+        message = f'{cancelled} order(s) cancelled.'
+        if skipped:
+            message += f' {skipped} already shipped, delivered or cancelled order(s) skipped.'
+        self.message_user(request, message)
+
+@admin.register(Notification)
+class NotificationAdmin(admin.ModelAdmin):
+    list_display = ['order', 'channel', 'status', 'attempts', 'next_attempt_at', 'sent_at']
+    list_filter = ['status', 'channel']
+    search_fields = ['order__order_number']
+    readonly_fields = ['created_at', 'sent_at', 'last_error']
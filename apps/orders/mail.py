@@ -0,0 +1,93 @@
+"""
+Pooled SMTP delivery for outbox workers.
+
+Each worker process keeps one SMTP connection open and pushes every batch of
+messages over it with ``send_messages``, instead of paying a TCP + STARTTLS +
+AUTH handshake per ``send_mail`` call. Connections that have been idle longer
+than the server is likely to keep them are recycled, and a dropped connection
+is reopened and the message retried once.
+"""
+import smtplib
+import threading
+import time
+from django.conf import settings
+from django.core.mail import get_connection
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Errors that mean the connection itself is gone, as opposed to a rejected message
+CONNECTION_ERRORS = (smtplib.SMTPServerDisconnected, ConnectionError, TimeoutError)
+
+
+class MailDelivery:
+    """A persistent mail connection that sends messages in batches"""
+
+    def __init__(self, connection_factory=get_connection, idle_timeout=None):
+        self.connection_factory = connection_factory
+        if idle_timeout is None:
+            idle_timeout = getattr(settings, 'EMAIL_POOL_IDLE_TIMEOUT', 60)
+        self.idle_timeout = idle_timeout
+        self._connection = None
+        self._last_used = 0
+        self._lock = threading.Lock()
+
+    def _get_connection(self):
+        if self._connection is not None and time.monotonic() - self._last_used > self.idle_timeout:
+            self._close()
+        if self._connection is None:
+            self._connection = self.connection_factory(fail_silently=False)
+            self._connection.open()
+        return self._connection
+
+    def _close(self):
+        if self._connection is not None:
+            try:
+                self._connection.close()
+            except Exception:
+                pass
+            self._connection = None
+
+    def close(self):
+        with self._lock:
+            self._close()
+
+    def send(self, messages):
+        """
+        Send EmailMessages over the pooled connection.
+
+        Returns one entry per message: None if it was accepted, otherwise the
+        exception, so callers can retry individual messages.
+        """
+        results = []
+        with self._lock:
+            for message in messages:
+                for attempt in (1, 2):
+                    try:
+                        self._get_connection().send_messages([message])
+                        results.append(None)
+                        break
+                    except CONNECTION_ERRORS as e:
+                        logger.warning(f"Mail connection lost, reconnecting: {e}")
+                        self._close()
+                        if attempt == 2:
+                            results.append(e)
+                    except Exception as e:
+                        results.append(e)
+                        break
+                self._last_used = time.monotonic()
+        return results
+
+
+_delivery = None
+_delivery_lock = threading.Lock()
+
+
+def get_mail_delivery():
+    """Return this process's pooled MailDelivery"""
+    global _delivery
+    if _delivery is None:
+        with _delivery_lock:
+            if _delivery is None:
+                _delivery = MailDelivery()
+    return _delivery
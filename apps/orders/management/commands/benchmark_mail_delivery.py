@@ -0,0 +1,66 @@
+import time
+from functools import partial
+from django.core.mail import EmailMessage, get_connection
+from django.core.management.base import BaseCommand
+from apps.orders.mail import MailDelivery
+
+class Command(BaseCommand):
+    help = (
+        'Measures email throughput of pooled batched delivery against one connection per message. '
+        'Point it at a local SMTP stand-in, e.g. `python -m aiosmtpd -n -l localhost:1025`.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='localhost', help='SMTP host')
+        parser.add_argument('--port', type=int, default=1025, help='SMTP port')
+        parser.add_argument('--use-tls', action='store_true', help='Use STARTTLS')
+        parser.add_argument('--count', type=int, default=500, help='Messages to send per mode')
+        parser.add_argument('--batch-size', type=int, default=50, help='Messages per pooled batch')
+
+    def _messages(self, count):
+        return [
+            EmailMessage(
+                subject=f'Benchmark message {i}',
+                body='Order confirmation benchmark',
+                from_email='bench@example.com',
+                to=[f'customer{i}@example.com']
+            )
+            for i in range(count)
+        ]
+
+    def handle(self, *args, **options):
+        factory = partial(
+            get_connection,
+            'django.core.mail.backends.smtp.EmailBackend',
+            host=options['host'],
+            port=options['port'],
+            username='',
+            password='',
+            use_tls=options['use_tls'],
+            use_ssl=False
+        )
+        count = options['count']
+        batch_size = options['batch_size']
+
+        # One connection per message, as send_mail does
+        messages = self._messages(count)
+        start = time.perf_counter()
+        for message in messages:
+            factory(fail_silently=False).send_messages([message])
+        unpooled = time.perf_counter() - start
+        self.stdout.write(f'connection per message: {count} messages in {unpooled:.2f}s ({count / unpooled:.0f} msg/s)')
+
+        delivery = MailDelivery(connection_factory=factory)
+        messages = self._messages(count)
+        failures = 0
+        start = time.perf_counter()
+        for i in range(0, count, batch_size):
+            failures += sum(1 for error in delivery.send(messages[i:i + batch_size]) if error)
+        pooled = time.perf_counter() - start
+        delivery.close()
+        self.stdout.write(f'pooled, batches of {batch_size}: {count} messages in {pooled:.2f}s ({count / pooled:.0f} msg/s)')
+
+        if failures:
+            self.stdout.write(self.style.ERROR(f'{failures} message(s) failed'))
+        else:
+            self.stdout.write(self.style.SUCCESS(f'Pooled delivery is {unpooled / pooled:.1f}x faster'))
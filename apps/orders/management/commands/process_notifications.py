@@ -0,0 +1,29 @@
+import time
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from apps.orders.notifications import process_notifications, MAX_ATTEMPTS
+
+class Command(BaseCommand):
+    help = 'Delivers queued order notifications (emails and SMS) from the outbox'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=50, help='Notifications claimed per batch')
+        parser.add_argument('--interval', type=float, default=5.0, help='Seconds to sleep when the outbox is empty')
+        parser.add_argument('--max-attempts', type=int, default=MAX_ATTEMPTS, help='Attempts before a notification is marked failed')
+        parser.add_argument('--once', action='store_true', help='Drain the due notifications and exit')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        self.stdout.write('Processing notification outbox...')
+
+        while True:
+            close_old_connections()
+            processed = process_notifications(batch_size, options['max_attempts'])
+            if processed:
+                self.stdout.write(f'Processed {processed} notification(s)')
+            if processed < batch_size:
+                if options['once']:
+                    break
+                time.sleep(options['interval'])
+
+        self.stdout.write(self.style.SUCCESS('Notification outbox drained'))
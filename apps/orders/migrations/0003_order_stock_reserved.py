@@ -0,0 +1,19 @@
+# Generated by Django 4.2.7 on 2026-10-18 09:41
+
+from django.db import migrations, models
+
+class Migration(migrations.Migration):
+    dependencies = [
+        (
+            "orders",
+            "0002_rename_customer_order_user_remove_order_total_amount_and_more",
+        ),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="order",
+            name="stock_reserved",
+            field=models.BooleanField(default=False),
+        ),
+    ]
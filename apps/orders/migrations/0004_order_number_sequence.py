@@ -0,0 +1,30 @@
+from django.db import migrations, models
+
+SEQUENCE_NAME = 'orders_order_number_seq'
+SEQUENCE_BLOCK_SIZE = 100
+
+def create_sequence(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(
+        f'CREATE SEQUENCE IF NOT EXISTS {SEQUENCE_NAME} INCREMENT BY {SEQUENCE_BLOCK_SIZE} START WITH 1'
+    )
+
+def drop_sequence(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(f'DROP SEQUENCE IF EXISTS {SEQUENCE_NAME}')
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("orders", "0003_order_stock_reserved"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="order",
+            name="order_number",
+            field=models.CharField(default="", max_length=32, unique=True),
+        ),
+        migrations.RunPython(create_sequence, drop_sequence),
+    ]
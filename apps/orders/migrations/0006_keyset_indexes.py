@@ -0,0 +1,22 @@
+# Generated by Django 4.2.7 on 2026-10-18 10:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("orders", "0005_notification_outbox"),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name="order",
+            options={"ordering": ["-created_at", "-id"]},
+        ),
+        migrations.AddIndex(
+            model_name="order",
+            index=models.Index(
+                fields=["user", "created_at", "id"], name="orders_user_created_id_idx"
+            ),
+        ),
+    ]
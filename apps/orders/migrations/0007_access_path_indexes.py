@@ -0,0 +1,43 @@
+# Generated by Django 4.2.7 on 2026-10-18 10:45
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ("products", "0009_access_path_indexes"),
+        ("orders", "0006_keyset_indexes"),
+    ]
+
+    operations = [
+        # Add the composite index before dropping the product_id one it replaces
+        migrations.AddIndex(
+            model_name="orderitem",
+            index=models.Index(
+                fields=["product", "order"], name="orders_item_product_order_idx"
+            ),
+        ),
+        migrations.AlterField(
+            model_name="orderitem",
+            name="product",
+            field=models.ForeignKey(
+                db_index=False,
+                on_delete=django.db.models.deletion.CASCADE,
+                to="products.product",
+            ),
+        ),
+        # orders_user_created_id_idx leads with user_id
+        migrations.AlterField(
+            model_name="order",
+            name="user",
+            field=models.ForeignKey(
+                db_index=False,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="orders",
+                to=settings.AUTH_USER_MODEL,
+            ),
+        ),
+    ]
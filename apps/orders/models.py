@@ -1,10 +1,12 @@
-from django.db import models
+from django.db import models, transaction
 from django.conf import settings
 from apps.products.models import Product
 from django.core.validators import MinValueValidator
 from decimal import Decimal
 from django.utils import timezone
 from apps.cart.models import Cart
+from apps.products.stock import reserve_stock, release_stock
+from .numbering import get_order_number_allocator
 
 class Order(models.Model):
     STATUS_CHOICES = [
@@ -14,64 +16,129 @@ class Order(models.Model):
         ('delivered', 'Delivered'),
         ('cancelled', 'Cancelled'),
     ]
+    CANCELLABLE_STATUSES = ('pending', 'processing')
 
-    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='orders')
-    order_number = models.CharField(max_length=20, unique=True, default='')
+    # Indexed by orders_user_created_id_idx
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='orders', db_index=False)
+    order_number = models.CharField(max_length=32, unique=True, default='')
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
     total_price = models.DecimalField(max_digits=10, decimal_places=2, validators=[MinValueValidator(Decimal('0.01'))], default=Decimal('0.00'))
     shipping_address = models.TextField(default='')
     phone_number = models.CharField(max_length=15, default='')
+    stock_reserved = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
-        ordering = ['-created_at']
+        ordering = ['-created_at', '-id']
+        indexes = [
+            # Keyset pagination of a user's orders, see savannah_ecommerce/pagination.py
+            models.Index(fields=['user', 'created_at', 'id'], name='orders_user_created_id_idx'),
+        ]
 
     def __str__(self):
         return f"Order {self.order_number}"
 
     def save(self, *args, **kwargs):
         if not self.order_number:
-            # Generate order number based on timestamp
-            timestamp = timezone.now().strftime('%Y%m%d%H%M%S')
-            self.order_number = f"ORD-{timestamp}"
+            # Unique across workers and replicas, see apps/orders/numbering.py
+            self.order_number = get_order_number_allocator().allocate()
         super().save(*args, **kwargs)
 
     @classmethod
     def create_order_from_cart(cls, cart):
         """
         Create a new order from a cart.
+
+        The cart lines and their products are read once, totals are computed
+        in memory from that snapshot, and the stock reservation, the order,
+        its items and the cart clearing are written in a single transaction.
+        Raises InsufficientStock if any line cannot be reserved.
         """
-        # Create the order
-        order = cls.objects.create(
-            user=cart.user,
-            total_price=cart.total_price,
-            shipping_address='',
-            phone_number=cart.user.customer.phone if hasattr(cart.user, 'customer') and cart.user.customer.phone else ''
-        )
+        with transaction.atomic():
+            cart_items = list(cart.items.select_related('product'))
+            reserve_stock((cart_item.product_id, cart_item.quantity) for cart_item in cart_items)
 
-        # Create order items from cart items
-        for cart_item in cart.items.all():
-            OrderItem.objects.create(
-                order=order,
-                product=cart_item.product,
-                quantity=cart_item.quantity,
-                price=cart_item.product.price,
-                subtotal=cart_item.subtotal
+            order_items = [
+                OrderItem(
+                    product=cart_item.product,
+                    quantity=cart_item.quantity,
+                    price=cart_item.product.price,
+                    subtotal=cart_item.product.price * cart_item.quantity
+                )
+                for cart_item in cart_items
+            ]
+            total_price = sum((item.subtotal for item in order_items), Decimal('0.00'))
+
+            customer = getattr(cart.user, 'customer', None)
+            order = cls.objects.create(
+                user=cart.user,
+                total_price=total_price,
+                shipping_address='',
+                phone_number=customer.phone if customer and customer.phone else '',
+                stock_reserved=True
             )
 
-        # Clear the cart
-        cart.clear()
+            # bulk_create skips OrderItem.save, so subtotals are set above
+            for order_item in order_items:
+                order_item.order = order
+            OrderItem.objects.bulk_create(order_items)
+
+            # Clear the cart
+            cart.clear()
+
+            order.enqueue_notifications()
 
         return order
 
+    def enqueue_notifications(self):
+        """
+        Queue the customer, admin and SMS notifications for this order.
+
+        Call this inside the transaction that writes the order so the outbox
+        rows commit (or roll back) together with it.
+        """
+        channels = ['customer_email', 'admin_email']
+        if self.phone_number:
+            channels.append('sms')
+        return Notification.objects.bulk_create(
+            [Notification(order=self, channel=channel) for channel in channels]
+        )
+
+    def cancel(self):
+        """
+        Cancel the order and give its reserved stock back.
+
+        Returns False unless the order was pending or processing (shipped and
+        delivered orders keep their stock taken). The status change is a
+        conditional UPDATE so concurrent cancels release stock only once.
+        """
+        with transaction.atomic():
+            cancelled = Order.objects.filter(pk=self.pk, status__in=self.CANCELLABLE_STATUSES).update(
+                status='cancelled', updated_at=timezone.now()
+            )
+            if not cancelled:
+                self.refresh_from_db(fields=['status'])
+                return False
+            if self.stock_reserved:
+                release_stock(self.items.values_list('product_id', 'quantity'))
+        self.status = 'cancelled'
+        return True
+
 class OrderItem(models.Model):
     order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='items')
-    product = models.ForeignKey(Product, on_delete=models.CASCADE)
+    # Indexed by orders_item_product_order_idx
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, db_index=False)
     quantity = models.PositiveIntegerField(validators=[MinValueValidator(1)])
     price = models.DecimalField(max_digits=10, decimal_places=2, validators=[MinValueValidator(Decimal('0.01'))])
     subtotal = models.DecimalField(max_digits=10, decimal_places=2, validators=[MinValueValidator(Decimal('0.01'))])
 
+    class Meta:
+        indexes = [
+            # Order lookups by product (related products, analytics), covering order_id
+            models.Index(fields=['product', 'order'], name='orders_item_product_order_idx'),
+        ]
+
     def __str__(self):
         return f"{self.quantity} x {self.product.name}"
 
@@ -79,3 +146,34 @@ class OrderItem(models.Model):
         # Calculate subtotal before saving
         self.subtotal = self.quantity * self.price
         super().save(*args, **kwargs)
+
+class Notification(models.Model):
+    """Outbox row for one message about an order, delivered by process_notifications"""
+    CHANNEL_CHOICES = [
+        ('customer_email', 'Customer email'),
+        ('admin_email', 'Admin email'),
+        ('sms', 'SMS'),
+    ]
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('sent', 'Sent'),
+        ('failed', 'Failed'),
+    ]
+
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='notifications')
+    channel = models.CharField(max_length=20, choices=CHANNEL_CHOICES)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['next_attempt_at', 'id']
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at'], name='orders_notif_due_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.get_channel_display()} for order {self.order_id}"
@@ -0,0 +1,216 @@
+"""
+Order notification outbox.
+
+Orders enqueue one Notification row per channel in the same transaction that
+writes the order (see Order.enqueue_notifications). The process_notifications
+management command drains the outbox in batches, so checkout latency does not
+depend on the SMTP server or the SMS provider. Emails go out over the worker's
+pooled connection (see mail.py), admin notifications are coalesced into a
+digest sent at most every ORDER_ADMIN_DIGEST_INTERVAL seconds, and each
+batch's SMS go to the configured gateway (see sms.py) through send_bulk.
+"""
+from datetime import timedelta
+from django.core.mail import EmailMultiAlternatives
+from django.template.loader import render_to_string
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+import logging
+
+from .models import Notification
+from .mail import get_mail_delivery
+from .sms import get_sms_gateway
+
+logger = logging.getLogger(__name__)
+
+# Rows claimed by a worker are hidden from other workers for this long; if the
+# worker dies mid-send the row becomes due again once the lease expires.
+LEASE = timedelta(minutes=5)
+RETRY_BASE_DELAY = timedelta(seconds=30)
+RETRY_MAX_DELAY = timedelta(hours=1)
+MAX_ATTEMPTS = 8
+
+def _email_context(order):
+    return {
+        'order': order,
+        'items': order.items.all(),
+        'site_url': settings.SITE_URL,
+        'site_name': settings.SITE_NAME
+    }
+
+
+def build_customer_email(order):
+    """Build the order confirmation email for the customer"""
+    message = EmailMultiAlternatives(
+        subject=f'Order Confirmation - #{order.order_number}',
+        body=f"Thank you for your order #{order.order_number}. Total amount: ${order.total_price}",
+        from_email=settings.DEFAULT_FROM_EMAIL,
+        to=[order.user.email]
+    )
+    message.attach_alternative(render_to_string('orders/email/order_confirmation.html', _email_context(order)), 'text/html')
+    return message
+
+
+def build_admin_digest(orders):
+    """Build one email telling the shop admin about all of ``orders``"""
+    total = sum((order.total_price for order in orders), 0)
+    lines = [f"#{order.order_number} from {order.user.email}: ${order.total_price}" for order in orders]
+    message = EmailMultiAlternatives(
+        subject=f'{len(orders)} New Order(s) Received',
+        body='New orders received:\n' + '\n'.join(lines) + f'\nTotal amount: ${total}',
+        from_email=settings.DEFAULT_FROM_EMAIL,
+        to=[settings.ADMIN_EMAIL]
+    )
+    message.attach_alternative(render_to_string('orders/email/admin_order_digest.html', {
+        'orders': orders,
+        'total': total,
+        'site_url': settings.SITE_URL,
+        'site_name': settings.SITE_NAME
+    }), 'text/html')
+    return message
+
+
+def format_phone_number(phone):
+    """Format a phone number in international format, defaulting to Kenya"""
+    phone = phone.strip()
+    if not phone.startswith('+'):
+        # Remove any leading zeros and add country code
+        phone = phone.lstrip('0')
+        if not phone.startswith('254'):
+            phone = f'254{phone}'
+        phone = f'+{phone}'
+
+    # In sandbox mode, we need to use a specific format
+    if settings.AFRICAS_TALKING_USERNAME == 'sandbox':
+        # For sandbox, we can only send to specific numbers
+        # Using a test number for sandbox
+        phone = '+254700000000'
+        logger.info("Using sandbox test number for SMS")
+    return phone
+
+
+def build_customer_sms(order):
+    """Return the ``(message, recipient)`` confirmation SMS for the customer"""
+    message = f"Thank you for your order #{order.order_number}. Total amount: ${order.total_price}. We'll notify you when it ships."
+    return message, format_phone_number(order.phone_number)
+
+
+EMAIL_BUILDERS = {
+    'customer_email': build_customer_email,
+}
+
+
+def admin_digest_interval():
+    return timedelta(seconds=getattr(settings, 'ORDER_ADMIN_DIGEST_INTERVAL', 900))
+
+
+def retry_delay(attempts):
+    """Exponential backoff for the given number of failed attempts"""
+    return min(RETRY_BASE_DELAY * (2 ** (attempts - 1)), RETRY_MAX_DELAY)
+
+
+def _claim(queryset, limit):
+    """
+    Lease up to ``limit`` rows of ``queryset`` to the calling worker.
+
+    Rows locked by another worker are skipped rather than waited on, and the
+    claim is committed before anything is sent so no transaction is held open
+    across SMTP or SMS round-trips.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        ids = list(
+            queryset.select_for_update(skip_locked=True)
+            .filter(status='pending', next_attempt_at__lte=now)
+            .order_by('next_attempt_at', 'id')
+            .values_list('id', flat=True)[:limit]
+        )
+        Notification.objects.filter(id__in=ids).update(
+            attempts=F('attempts') + 1,
+            next_attempt_at=now + LEASE
+        )
+    return list(Notification.objects.filter(id__in=ids).select_related('order__user').order_by('id'))
+
+
+def claim_due_notifications(batch_size):
+    """Lease due customer notifications; admin ones wait for the digest"""
+    return _claim(Notification.objects.exclude(channel='admin_email'), batch_size)
+
+
+def claim_admin_digest(max_size):
+    """Lease pending admin notifications once the oldest has waited a full digest interval"""
+    now = timezone.now()
+    pending = Notification.objects.filter(channel='admin_email', status='pending', next_attempt_at__lte=now)
+    if not pending.filter(created_at__lte=now - admin_digest_interval()).exists():
+        return []
+    return _claim(Notification.objects.filter(channel='admin_email'), max_size)
+
+
+def mark_sent(notification):
+    notification.status = 'sent'
+    notification.sent_at = timezone.now()
+    notification.last_error = ''
+    notification.save(update_fields=['status', 'sent_at', 'last_error'])
+
+
+def mark_failed(notification, error, max_attempts=MAX_ATTEMPTS):
+    """Record a failed delivery and schedule a retry, or give up after max_attempts"""
+    notification.last_error = str(error)
+    if notification.attempts >= max_attempts:
+        notification.status = 'failed'
+        logger.error(f"Giving up on {notification} after {notification.attempts} attempts: {error}")
+    else:
+        notification.next_attempt_at = timezone.now() + retry_delay(notification.attempts)
+        logger.warning(f"Failed to send {notification} (attempt {notification.attempts}), retrying at {notification.next_attempt_at}: {error}")
+    notification.save(update_fields=['status', 'last_error', 'next_attempt_at'])
+
+
+def _record(notification, error, max_attempts):
+    if error is None:
+        mark_sent(notification)
+    else:
+        mark_failed(notification, error, max_attempts)
+
+
+def process_notifications(batch_size=50, max_attempts=MAX_ATTEMPTS, mailer=None):
+    """Deliver one batch of due notifications and return how many were claimed"""
+    mailer = mailer or get_mail_delivery()
+    batch = claim_due_notifications(batch_size)
+
+    emails = []
+    texts = []
+    for notification in batch:
+        try:
+            if notification.channel == 'sms':
+                texts.append((notification, build_customer_sms(notification.order)))
+            else:
+                emails.append((notification, EMAIL_BUILDERS[notification.channel](notification.order)))
+        except Exception as e:
+            _record(notification, e, max_attempts)
+
+    results = mailer.send([message for notification, message in emails])
+    for (notification, message), error in zip(emails, results):
+        _record(notification, error, max_attempts)
+
+    if texts:
+        results = get_sms_gateway().send_bulk([text for notification, text in texts])
+        for (notification, text), error in zip(texts, results):
+            _record(notification, error, max_attempts)
+
+    return len(batch) + process_admin_digest(batch_size, max_attempts, mailer)
+
+
+def process_admin_digest(max_size=50, max_attempts=MAX_ATTEMPTS, mailer=None):
+    """Send one digest email for the pending admin notifications if it is due"""
+    digest = claim_admin_digest(max_size)
+    if not digest:
+        return 0
+    mailer = mailer or get_mail_delivery()
+    try:
+        error, = mailer.send([build_admin_digest([notification.order for notification in digest])])
+    except Exception as e:
+        error = e
+    for notification in digest:
+        _record(notification, error, max_attempts)
+    return len(digest)
@@ -0,0 +1,127 @@
+"""
+Order number allocation.
+
+``settings.ORDER_NUMBER_ALLOCATOR`` is the dotted path of the allocator class
+used by ``Order.save``. Two are provided:
+
+* SequenceBlockAllocator (production default) takes blocks of numbers from a
+  PostgreSQL sequence and hands them out from memory, so every gunicorn worker
+  on every replica gets disjoint ranges with one round-trip per block.
+* SnowflakeAllocator packs a millisecond timestamp, a worker id and a
+  per-millisecond counter into one integer without touching the database. It
+  is only collision-free when each process has its own
+  ``ORDER_NUMBER_WORKER_ID``, which makes it a fit for single-process
+  deployments and SQLite development databases.
+"""
+import os
+import threading
+import time
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+DEFAULT_ALLOCATOR = 'apps.orders.numbering.SequenceBlockAllocator'
+
+# Must match the INCREMENT BY of the sequence created in migration 0004
+SEQUENCE_NAME = 'orders_order_number_seq'
+SEQUENCE_BLOCK_SIZE = 100
+
+
+class OrderNumberAllocator:
+    """Base class for order number allocators"""
+
+    def allocate(self):
+        """Return a new, unique order number"""
+        raise NotImplementedError
+
+
+class SequenceBlockAllocator(OrderNumberAllocator):
+    """
+    Allocates numbers from PostgreSQL sequence blocks.
+
+    Each ``nextval`` reserves SEQUENCE_BLOCK_SIZE consecutive values for this
+    process. Sequences are not transactional, so a rolled back checkout never
+    hands its block to another worker.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pid = None
+        self._next = self._limit = 0
+
+    def _fetch_block(self):
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT nextval(%s)', [SEQUENCE_NAME])
+            return cursor.fetchone()[0]
+
+    def allocate(self):
+        with self._lock:
+            # A block inherited across fork() would be shared with the parent
+            if self._next >= self._limit or self._pid != os.getpid():
+                self._next = self._fetch_block()
+                self._limit = self._next + SEQUENCE_BLOCK_SIZE
+                self._pid = os.getpid()
+            value = self._next
+            self._next += 1
+        return f"ORD-{timezone.localdate().strftime('%Y%m%d')}-{value:06d}"
+
+
+class SnowflakeAllocator(OrderNumberAllocator):
+    """
+    Snowflake-style ids: 41 bits of milliseconds since EPOCH_MS, 10 bits of
+    worker id and a 12 bit counter, i.e. up to 4096 numbers per millisecond
+    per worker, ordered by time.
+    """
+    EPOCH_MS = 1735689600000  # 2025-01-01T00:00:00Z
+    WORKER_BITS = 10
+    SEQUENCE_BITS = 12
+
+    def __init__(self, worker_id=None):
+        if worker_id is None:
+            worker_id = int(getattr(settings, 'ORDER_NUMBER_WORKER_ID', 0))
+        if not 0 <= worker_id < (1 << self.WORKER_BITS):
+            raise ValueError(f'ORDER_NUMBER_WORKER_ID must be between 0 and {(1 << self.WORKER_BITS) - 1}')
+        self.worker_id = worker_id
+        self._lock = threading.Lock()
+        self._last_ms = -1
+        self._sequence = 0
+
+    def _now_ms(self):
+        return time.time_ns() // 1_000_000
+
+    def next_id(self):
+        with self._lock:
+            now = max(self._now_ms(), self._last_ms)  # never go back if the clock does
+            if now == self._last_ms:
+                self._sequence = (self._sequence + 1) & ((1 << self.SEQUENCE_BITS) - 1)
+                if self._sequence == 0:
+                    # Counter exhausted for this millisecond, wait for the next one
+                    while now <= self._last_ms:
+                        now = self._now_ms()
+            else:
+                self._sequence = 0
+            self._last_ms = now
+            return (
+                ((now - self.EPOCH_MS) << (self.WORKER_BITS + self.SEQUENCE_BITS))
+                | (self.worker_id << self.SEQUENCE_BITS)
+                | self._sequence
+            )
+
+    def allocate(self):
+        return f'ORD-{self.next_id():019d}'
+
+
+_allocator = None
+_allocator_lock = threading.Lock()
+
+
+def get_order_number_allocator():
+    """Return the process-wide allocator configured by ORDER_NUMBER_ALLOCATOR"""
+    global _allocator
+    if _allocator is None:
+        with _allocator_lock:
+            if _allocator is None:
+                path = getattr(settings, 'ORDER_NUMBER_ALLOCATOR', DEFAULT_ALLOCATOR)
+                _allocator = import_string(path)()
+    return _allocator
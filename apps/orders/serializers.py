@@ -8,6 +8,8 @@ class OrderItemSerializer(serializers.ModelSerializer):
     class Meta:
         model = OrderItem
         fields = ['id', 'product', 'product_details', 'quantity', 'price', 'subtotal']
+        # Columns read when serializing, see savannah_ecommerce/shaping.py
+        only = ['id', 'product', 'quantity', 'price', 'subtotal']
 
 class OrderSerializer(serializers.ModelSerializer):
     items = OrderItemSerializer(many=True, read_only=True)
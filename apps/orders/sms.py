@@ -0,0 +1,115 @@
+"""
+SMS gateways.
+
+``settings.SMS_GATEWAY`` names the gateway class and get_sms_gateway returns
+one shared instance per process. The Africa's Talking SDK is only imported
+and initialized on the first send, so web workers that never send SMS do not
+pay for it at boot.
+"""
+import threading
+from collections import deque
+from django.conf import settings
+from django.utils.module_loading import import_string
+import logging
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_GATEWAY = 'apps.orders.sms.AfricasTalkingGateway'
+
+
+class SMSGateway:
+    """Base class for SMS gateways"""
+
+    def send(self, message, recipients):
+        """
+        Send ``message`` to every number in ``recipients`` in one provider call.
+
+        Returns a list with None on success or an error message for each
+        recipient, in order; a number may appear more than once.
+        """
+        raise NotImplementedError
+
+    def send_bulk(self, messages):
+        """
+        Send ``(message, recipient)`` pairs, grouping recipients that get the
+        same text into a single provider call.
+
+        Returns a list with None or an error message for each pair, in order,
+        like MailDelivery.send.
+        """
+        groups = {}
+        for index, (message, recipient) in enumerate(messages):
+            groups.setdefault(message, []).append((index, recipient))
+
+        results = [None] * len(messages)
+        for message, entries in groups.items():
+            recipients = [recipient for index, recipient in entries]
+            try:
+                errors = self.send(message, recipients)
+            except Exception as e:
+                logger.error(f"SMS provider call for {len(recipients)} recipient(s) failed: {e}")
+                errors = [str(e)] * len(recipients)
+            for (index, recipient), error in zip(entries, errors):
+                results[index] = error
+        return results
+
+
+class AfricasTalkingGateway(SMSGateway):
+    """Africa's Talking SMS, initialized on first use"""
+
+    def __init__(self, username=None, api_key=None):
+        self.username = username or settings.AFRICAS_TALKING_USERNAME
+        self.api_key = api_key or settings.AFRICAS_TALKING_API_KEY
+        self._client = None
+        self._lock = threading.Lock()
+
+    def _get_client(self):
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    import africastalking
+                    africastalking.initialize(self.username, self.api_key)
+                    self._client = africastalking.SMS
+                    logger.info("Initialized Africa's Talking SMS client")
+        return self._client
+
+    def send(self, message, recipients):
+        response = self._get_client().send(message, list(recipients))
+        # The provider reports by number; a repeated number takes its statuses in order
+        statuses = {}
+        for recipient in response.get('SMSMessageData', {}).get('Recipients', []):
+            statuses.setdefault(recipient['number'], deque()).append(recipient['status'])
+        results = []
+        for recipient in recipients:
+            pending = statuses.get(recipient)
+            status = pending.popleft() if pending else 'Success'
+            results.append(None if status == 'Success' else status)
+        return results
+
+
+class LocalSMSGateway(SMSGateway):
+    """
+    Keeps the last OUTBOX_SIZE sent messages in memory instead of calling a
+    provider, for development and tests
+    """
+    OUTBOX_SIZE = 100
+    outbox = deque(maxlen=OUTBOX_SIZE)
+
+    def send(self, message, recipients):
+        logger.info(f"Local SMS to {', '.join(recipients)}: {message}")
+        self.outbox.append((message, list(recipients)))
+        return [None] * len(recipients)
+
+
+_gateway = None
+_gateway_lock = threading.Lock()
+
+
+def get_sms_gateway():
+    """Return this process's gateway, constructing it on first use"""
+    global _gateway
+    if _gateway is None:
+        with _gateway_lock:
+            if _gateway is None:
+                _gateway = import_string(getattr(settings, 'SMS_GATEWAY', DEFAULT_GATEWAY))()
+    return _gateway
@@ -3,9 +3,27 @@ from django.urls import reverse
 from django.contrib.auth import get_user_model
 from apps.products.models import Product, Category
 from apps.cart.models import Cart, CartItem
-from apps.orders.models import Order, OrderItem
+from apps.orders.models import Order, OrderItem, Notification
+from apps.orders.notifications import process_notifications
+from apps.customers.models import Customer
+from django.core import mail
+from django.utils import timezone
+from datetime import timedelta
 from decimal import Decimal
 from apps.orders.serializers import OrderSerializer
+from apps.products.stock import InsufficientStock
+from apps.orders.numbering import SnowflakeAllocator
+import threading
+from unittest.mock import patch, Mock
+from django.core.mail import EmailMessage, get_connection
+from apps.orders.mail import MailDelivery
+from apps.orders.sms import LocalSMSGateway, AfricasTalkingGateway
+import smtplib
+import time
+from django.db import connection
+from django.core.cache import cache
+from django.test.utils import CaptureQueriesContext
+from tests.utils import QueryCountMixin
 
 from rest_framework import status
 from rest_framework.test import APITestCase
@@ -18,8 +36,8 @@ class OrderModelTests(TestCase):
     def setUp(self):
         self.user = User.objects.create_user(username='testuser', password='password')
         self.category = Category.objects.create(name='Electronics')
-        self.product1 = Product.objects.create(name='Laptop', price=Decimal('1200.00'), category=self.category)
-        self.product2 = Product.objects.create(name='Mouse', price=Decimal('25.00'), category=self.category)
+        self.product1 = Product.objects.create(name='Laptop', price=Decimal('1200.00'), stock=10, category=self.category)
+        self.product2 = Product.objects.create(name='Mouse', price=Decimal('25.00'), stock=10, category=self.category)
         self.cart = Cart.objects.create(user=self.user)
         self.cart_item1 = self.cart.add_item(self.product1, 2)
         self.cart_item2 = self.cart.add_item(self.product2, 5)
@@ -59,14 +77,283 @@ class OrderModelTests(TestCase):
         order = Order.create_order_from_cart(self.cart)
         self.assertEqual(order.total_price, Decimal('2525.00'))
 
+    def test_order_creation_query_count_is_constant(self):
+        with CaptureQueriesContext(connection) as two_lines:
+            Order.create_order_from_cart(Cart.objects.get(pk=self.cart.pk))
+
+        for i in range(5):
+            product = Product.objects.create(name=f'Cable {i}', price=Decimal('5.00'), stock=10, category=self.category)
+            self.cart.add_item(product, 1)
+        with CaptureQueriesContext(connection) as five_lines:
+            Order.create_order_from_cart(Cart.objects.get(pk=self.cart.pk))
+
+        # Only the per-line conditional stock UPDATEs grow with the cart
+        def non_stock_queries(captured):
+            return [q for q in captured if not q['sql'].startswith('UPDATE "products_product"')]
+        self.assertEqual(len(non_stock_queries(two_lines)), len(non_stock_queries(five_lines)))
+        self.assertEqual(len(five_lines) - len(two_lines), 3)
+
+    def test_order_creation_is_atomic(self):
+        with patch.object(OrderItem.objects, 'bulk_create', side_effect=RuntimeError('worker died')):
+            with self.assertRaises(RuntimeError):
+                Order.create_order_from_cart(self.cart)
+
+        self.assertEqual(Order.objects.count(), 0)
+        self.assertEqual(self.cart.items.count(), 2)
+
+    def test_order_creation_reserves_stock(self):
+        Order.create_order_from_cart(self.cart)
+        self.product1.refresh_from_db()
+        self.product2.refresh_from_db()
+        self.assertEqual(self.product1.stock, 8)
+        self.assertEqual(self.product2.stock, 5)
+
+    def test_order_creation_insufficient_stock(self):
+        Product.objects.filter(pk=self.product2.pk).update(stock=3)
+        with self.assertRaises(InsufficientStock) as ctx:
+            Order.create_order_from_cart(self.cart)
+
+        shortage, = ctx.exception.shortages
+        self.assertEqual(shortage.product_id, self.product2.id)
+        self.assertEqual(shortage.requested, 5)
+        self.assertEqual(shortage.available, 3)
+        # Nothing is written and the laptop reservation is rolled back
+        self.assertEqual(Order.objects.count(), 0)
+        self.assertEqual(self.cart.items.count(), 2)
+        self.product1.refresh_from_db()
+        self.assertEqual(self.product1.stock, 10)
+
+    def test_cancel_releases_stock_once(self):
+        order = Order.create_order_from_cart(self.cart)
+        self.assertTrue(order.cancel())
+        self.assertFalse(order.cancel())
+
+        order.refresh_from_db()
+        self.assertEqual(order.status, 'cancelled')
+        self.product1.refresh_from_db()
+        self.assertEqual(self.product1.stock, 10)
+
+    def test_shipped_orders_cannot_be_cancelled(self):
+        order = Order.create_order_from_cart(self.cart)
+        Order.objects.filter(pk=order.pk).update(status='shipped')
+        self.assertFalse(order.cancel())
+        self.assertEqual(order.status, 'shipped')
+        self.product1.refresh_from_db()
+        self.assertEqual(self.product1.stock, 8)
+
+class OrderNumberTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='password')
+
+    def test_orders_created_in_the_same_second_get_distinct_numbers(self):
+        numbers = {Order.objects.create(user=self.user).order_number for _ in range(20)}
+        self.assertEqual(len(numbers), 20)
+
+    def test_snowflake_numbers_increase(self):
+        allocator = SnowflakeAllocator(worker_id=1)
+        ids = [allocator.next_id() for _ in range(5000)]
+        self.assertEqual(ids, sorted(ids))
+        self.assertEqual(len(set(ids)), len(ids))
+
+    def test_snowflake_concurrent_workers_never_collide(self):
+        workers = [SnowflakeAllocator(worker_id=i) for i in range(4)]
+        numbers = []
+        lock = threading.Lock()
+
+        def allocate(allocator):
+            batch = [allocator.allocate() for _ in range(2000)]
+            with lock:
+                numbers.extend(batch)
+
+        threads = [threading.Thread(target=allocate, args=(allocator,)) for allocator in workers for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(numbers), 4 * 4 * 2000)
+        self.assertEqual(len(set(numbers)), len(numbers))
+        self.assertTrue(all(len(number) <= 32 for number in numbers))
+
+    def test_snowflake_rejects_out_of_range_worker_id(self):
+        with self.assertRaises(ValueError):
+            SnowflakeAllocator(worker_id=1024)
+
+class NotificationOutboxTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='password', email='buyer@example.com')
+        Customer.objects.create(user=self.user, name='Buyer', email='buyer@example.com', phone='0712345678')
+        self.category = Category.objects.create(name='Electronics')
+        self.product = Product.objects.create(name='Laptop', price=Decimal('1200.00'), stock=10, category=self.category)
+        self.cart = Cart.objects.create(user=self.user)
+        self.cart.add_item(self.product, 1)
+        LocalSMSGateway.outbox.clear()
+
+    def test_checkout_enqueues_without_sending(self):
+        order = Order.create_order_from_cart(self.cart)
+        channels = set(order.notifications.values_list('channel', flat=True))
+        self.assertEqual(channels, {'customer_email', 'admin_email', 'sms'})
+        self.assertEqual(len(mail.outbox), 0)
+
+    def test_process_notifications_delivers_customer_channels(self):
+        order = Order.create_order_from_cart(self.cart)
+        self.assertEqual(process_notifications(), 2)
+
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, ['buyer@example.com'])
+        self.assertEqual(len(LocalSMSGateway.outbox), 1)
+        self.assertEqual(LocalSMSGateway.outbox[0][1], ['+254712345678'])
+        # The admin email waits for the digest
+        self.assertEqual(order.notifications.get(channel='admin_email').status, 'pending')
+        self.assertEqual(process_notifications(), 0)
+
+    def test_admin_notifications_are_sent_as_one_digest(self):
+        first = Order.create_order_from_cart(self.cart)
+        self.cart.add_item(self.product, 1)
+        second = Order.create_order_from_cart(self.cart)
+
+        with self.settings(ORDER_ADMIN_DIGEST_INTERVAL=0):
+            process_notifications()
+
+        digests = [message for message in mail.outbox if message.to == ['ci_admin@example.com']]
+        self.assertEqual(len(digests), 1)
+        self.assertIn(first.order_number, digests[0].body)
+        self.assertIn(second.order_number, digests[0].body)
+        self.assertFalse(Notification.objects.filter(channel='admin_email').exclude(status='sent').exists())
+
+    def test_failed_delivery_is_retried_with_backoff(self):
+        order = Order.create_order_from_cart(self.cart)
+        with patch.dict('apps.orders.notifications.EMAIL_BUILDERS', {'customer_email': lambda order: 1 / 0}):
+            process_notifications()
+
+        notification = order.notifications.get(channel='customer_email')
+        self.assertEqual(notification.status, 'pending')
+        self.assertEqual(notification.attempts, 1)
+        self.assertIn('division by zero', notification.last_error)
+        self.assertGreater(notification.next_attempt_at, timezone.now() + timedelta(seconds=20))
+        # Not due yet, so the next batch leaves it alone
+        self.assertEqual(process_notifications(), 0)
+
+    def test_gives_up_after_max_attempts(self):
+        order = Order.create_order_from_cart(self.cart)
+        with patch.object(LocalSMSGateway, 'send', side_effect=ConnectionError('provider down')):
+            process_notifications(max_attempts=1)
+
+        notification = order.notifications.get(channel='sms')
+        self.assertEqual(notification.status, 'failed')
+        self.assertEqual(notification.last_error, 'provider down')
+
+    def test_sms_to_the_same_number_are_recorded_separately(self):
+        first = Order.create_order_from_cart(self.cart)
+        self.cart.add_item(self.product, 1)
+        second = Order.create_order_from_cart(self.cart)
+        with patch.object(LocalSMSGateway, 'send_bulk', return_value=['InvalidPhoneNumber', None]) as send_bulk:
+            process_notifications(max_attempts=1)
+
+        self.assertEqual([recipient for text, recipient in send_bulk.call_args.args[0]], ['+254712345678'] * 2)
+        self.assertEqual(first.notifications.get(channel='sms').status, 'failed')
+        self.assertEqual(second.notifications.get(channel='sms').status, 'sent')
+
+
+class SMSGatewayTests(TestCase):
+    def setUp(self):
+        LocalSMSGateway.outbox.clear()
+
+    def test_send_bulk_groups_recipients_by_message(self):
+        results = LocalSMSGateway().send_bulk([
+            ('Your order shipped', '+254700000001'),
+            ('Your order shipped', '+254700000002'),
+            ('Your order was delivered', '+254700000003'),
+        ])
+
+        self.assertEqual(list(LocalSMSGateway.outbox), [
+            ('Your order shipped', ['+254700000001', '+254700000002']),
+            ('Your order was delivered', ['+254700000003']),
+        ])
+        self.assertEqual(results, [None, None, None])
+
+    def test_send_bulk_reports_repeated_numbers_separately(self):
+        gateway = LocalSMSGateway()
+        with patch.object(LocalSMSGateway, 'send', side_effect=[[None, 'InvalidPhoneNumber'], RuntimeError('down')]):
+            results = gateway.send_bulk([
+                ('Order A shipped', '+254700000000'),
+                ('Order A shipped', '+254700000000'),
+                ('Order B shipped', '+254700000000'),
+            ])
+        self.assertEqual(results, [None, 'InvalidPhoneNumber', 'down'])
+
+    def test_local_outbox_is_bounded(self):
+        gateway = LocalSMSGateway()
+        for i in range(LocalSMSGateway.OUTBOX_SIZE + 5):
+            gateway.send(f'Message {i}', ['+254700000001'])
+        self.assertEqual(len(LocalSMSGateway.outbox), LocalSMSGateway.OUTBOX_SIZE)
+        self.assertEqual(LocalSMSGateway.outbox[-1][0], f'Message {LocalSMSGateway.OUTBOX_SIZE + 4}')
+
+    def test_africas_talking_client_is_created_on_first_send(self):
+        gateway = AfricasTalkingGateway(username='sandbox', api_key='key')
+        with patch('africastalking.initialize') as initialize, patch('africastalking.SMS') as client:
+            client.send.return_value = {'SMSMessageData': {'Recipients': [
+                {'number': '+254700000001', 'status': 'Success'},
+                {'number': '+254700000002', 'status': 'InvalidPhoneNumber'},
+            ]}}
+            initialize.assert_not_called()
+            results = gateway.send('Hello', ['+254700000001', '+254700000002'])
+            gateway.send('Hello again', ['+254700000001'])
+
+        initialize.assert_called_once_with('sandbox', 'key')
+        self.assertEqual(results, [None, 'InvalidPhoneNumber'])
+
+
+class MailDeliveryTests(TestCase):
+    def _message(self, to):
+        return EmailMessage(subject='Hi', body='Hello', to=[to])
+
+    def test_connection_is_reused_across_batches(self):
+        factory = Mock(wraps=get_connection)
+        delivery = MailDelivery(connection_factory=factory)
+        delivery.send([self._message('a@example.com'), self._message('b@example.com')])
+        delivery.send([self._message('c@example.com')])
+
+        self.assertEqual(factory.call_count, 1)
+        self.assertEqual(len(mail.outbox), 3)
+
+    def test_reconnects_after_disconnect(self):
+        broken = Mock()
+        broken.send_messages.side_effect = smtplib.SMTPServerDisconnected('gone')
+        factory = Mock(side_effect=[broken, get_connection()])
+        delivery = MailDelivery(connection_factory=factory)
+
+        self.assertEqual(delivery.send([self._message('a@example.com')]), [None])
+        self.assertEqual(factory.call_count, 2)
+        self.assertEqual(len(mail.outbox), 1)
+
+    def test_rejected_message_does_not_fail_the_batch(self):
+        connection = Mock()
+        connection.send_messages.side_effect = [smtplib.SMTPRecipientsRefused({}), 1]
+        delivery = MailDelivery(connection_factory=Mock(return_value=connection))
+
+        results = delivery.send([self._message('bad@example.com'), self._message('good@example.com')])
+        self.assertIsInstance(results[0], smtplib.SMTPRecipientsRefused)
+        self.assertIsNone(results[1])
+
+    def test_idle_connection_is_recycled(self):
+        factory = Mock(wraps=get_connection)
+        delivery = MailDelivery(connection_factory=factory, idle_timeout=0)
+        delivery.send([self._message('a@example.com')])
+        time.sleep(0.01)
+        delivery.send([self._message('b@example.com')])
+        self.assertEqual(factory.call_count, 2)
+
+
 class OrderViewTests(TestCase):
     def setUp(self):
+        cache.clear()
         self.client = Client()
         self.user = User.objects.create_user(username='testuser', password='password')
         self.client.login(username='testuser', password='password')
         self.category = Category.objects.create(name='Electronics')
-        self.product1 = Product.objects.create(name='Laptop', price=Decimal('1200.00'), category=self.category)
-        self.product2 = Product.objects.create(name='Mouse', price=Decimal('25.00'), category=self.category)
+        self.product1 = Product.objects.create(name='Laptop', price=Decimal('1200.00'), stock=10, category=self.category)
+        self.product2 = Product.objects.create(name='Mouse', price=Decimal('25.00'), stock=10, category=self.category)
         self.cart, created = Cart.objects.get_or_create(user=self.user)
         self.cart.add_item(self.product1, 2)
         self.cart.add_item(self.product2, 5)
@@ -87,6 +374,12 @@ class OrderViewTests(TestCase):
         self.assertIn('order', response.context)
         self.assertEqual(response.context['order'], self.order)
 
+    def test_order_detail_rows_follow_product_changes(self):
+        self.assertContains(self.client.get(reverse('orders:order_detail', args=[self.order.id])), 'Electronics')
+        self.product1.name = 'Gaming Laptop'
+        self.product1.save()
+        self.assertContains(self.client.get(reverse('orders:order_detail', args=[self.order.id])), 'Gaming Laptop')
+
     def test_order_detail_view_other_user(self):
         other_user = User.objects.create_user(username='otheruser', password='password')
         other_client = Client()
@@ -99,8 +392,8 @@ class OrderSerializerTests(TestCase):
     def setUp(self):
         self.user = User.objects.create_user(username='testuser', password='password')
         self.category = Category.objects.create(name='Electronics')
-        self.product1 = Product.objects.create(name='Laptop', price=Decimal('1200.00'), category=self.category)
-        self.product2 = Product.objects.create(name='Mouse', price=Decimal('25.00'), category=self.category)
+        self.product1 = Product.objects.create(name='Laptop', price=Decimal('1200.00'), stock=10, category=self.category)
+        self.product2 = Product.objects.create(name='Mouse', price=Decimal('25.00'), stock=10, category=self.category)
         self.cart = Cart.objects.create(user=self.user)
         self.cart.add_item(self.product1, 2)
         self.cart.add_item(self.product2, 5)
@@ -116,13 +409,13 @@ class OrderSerializerTests(TestCase):
         self.assertEqual(Decimal(data['total_price']), Decimal('2525.00'))
         self.assertEqual(len(data['items']), 2)
 
-class OrderAPIViewTests(APITestCase):
+class OrderAPIViewTests(QueryCountMixin, APITestCase):
     def setUp(self):
         self.user = User.objects.create_user(username='testuser', password='password')
         self.client.force_authenticate(user=self.user)
         self.category = Category.objects.create(name='Electronics')
-        self.product1 = Product.objects.create(name='Laptop', price=Decimal('1200.00'), category=self.category)
-        self.product2 = Product.objects.create(name='Mouse', price=Decimal('25.00'), category=self.category)
+        self.product1 = Product.objects.create(name='Laptop', price=Decimal('1200.00'), stock=10, category=self.category)
+        self.product2 = Product.objects.create(name='Mouse', price=Decimal('25.00'), stock=10, category=self.category)
         self.cart = Cart.objects.create(user=self.user)
         self.cart.add_item(self.product1, 2)
         self.cart.add_item(self.product2, 5)
@@ -135,6 +428,21 @@ class OrderAPIViewTests(APITestCase):
         self.assertEqual(len(response.data['results']), 1) # Check results because of pagination
         self.assertEqual(response.data['results'][0]['user'], self.user.id)
 
+    def test_order_endpoints_use_a_fixed_number_of_queries(self):
+        detail_url = reverse('order-detail', args=[self.order.pk])
+        few = [self.count_queries(reverse('order-list')), self.count_queries(detail_url)]
+        for i in range(5):
+            product = Product.objects.create(name=f'Cable {i}', price=Decimal('5.00'), stock=10, category=self.category)
+            OrderItem.objects.create(order=self.order, product=product, quantity=1, price=product.price)
+            cart = Cart.objects.create(user=User.objects.create_user(username=f'buyer{i}', password='password'))
+            cart.add_item(self.product1, 1)
+            cart.add_item(product, 2)
+            order = Order.create_order_from_cart(cart)
+            Order.objects.filter(pk=order.pk).update(user=self.user)
+        # Orders, then their items with products
+        self.assertEqual([self.count_queries(reverse('order-list')), self.count_queries(detail_url)], few)
+        self.assertEqual(few, [2, 2])
+
     def test_retrieve_order(self):
         url = reverse('order-detail', args=[self.order.pk])
         response = self.client.get(url)
@@ -143,6 +451,17 @@ class OrderAPIViewTests(APITestCase):
         self.assertEqual(response.data['user'], self.user.id)
         self.assertEqual(Decimal(response.data['total_price']), self.order.total_price)
 
+    def test_cancel_order(self):
+        url = reverse('order-cancel', args=[self.order.pk])
+        response = self.client.post(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['status'], 'cancelled')
+        self.product2.refresh_from_db()
+        self.assertEqual(self.product2.stock, 10)
+
+        response = self.client.post(url)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
     def test_retrieve_order_other_user(self):
         other_user = User.objects.create_user(username='otheruser', password='password')
         self.client.force_authenticate(user=other_user)
@@ -11,7 +11,7 @@ class CategoryAdmin(MPTTModelAdmin):
 
 @admin.register(Product)
 class ProductAdmin(admin.ModelAdmin):
-    list_display = ('name', 'price', 'category', 'get_category_path', 'stock')
+    list_display = ('name', 'price', 'get_category_name', 'get_category_path', 'stock')
     list_filter = ('category',)
     search_fields = ('name', 'description')
     readonly_fields = ('created_at', 'updated_at')
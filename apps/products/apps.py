@@ -1,5 +1,42 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_delete, post_init, post_save
+from mptt.signals import node_moved
 
 class ProductsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'apps.products'
+
+    def ready(self):
+        from .models import Category, Product
+        from . import responses
+        # Before the stats receivers, which reset the category a product was loaded with
+        post_save.connect(responses.product_saved, sender=Product, dispatch_uid='products_responses_product_save')
+        post_delete.connect(responses.product_deleted, sender=Product, dispatch_uid='products_responses_product_delete')
+        post_init.connect(responses.remember_category_tree, sender=Category, dispatch_uid='products_responses_category_init')
+        post_save.connect(responses.category_changed, sender=Category, dispatch_uid='products_responses_category_save')
+        post_delete.connect(responses.category_changed, sender=Category, dispatch_uid='products_responses_category_delete')
+        node_moved.connect(responses.category_changed, sender=Category, dispatch_uid='products_responses_category_move')
+
+        from .stats import remember_product_category, product_changed, category_changed
+        post_init.connect(remember_product_category, sender=Product, dispatch_uid='products_stats_init')
+        post_save.connect(product_changed, sender=Product, dispatch_uid='products_stats_product_save')
+        post_delete.connect(product_changed, sender=Product, dispatch_uid='products_stats_product_delete')
+        post_save.connect(category_changed, sender=Category, dispatch_uid='products_stats_category_save')
+        post_delete.connect(category_changed, sender=Category, dispatch_uid='products_stats_category_delete')
+        node_moved.connect(category_changed, sender=Category, dispatch_uid='products_stats_category_move')
+
+        from .tree import invalidate_category_tree
+        post_save.connect(invalidate_category_tree, sender=Category, dispatch_uid='products_tree_save')
+        post_delete.connect(invalidate_category_tree, sender=Category, dispatch_uid='products_tree_delete')
+        node_moved.connect(invalidate_category_tree, sender=Category, dispatch_uid='products_tree_move')
+
+        from .paths import invalidate_category_paths
+        post_save.connect(invalidate_category_paths, sender=Category, dispatch_uid='products_paths_save')
+        post_delete.connect(invalidate_category_paths, sender=Category, dispatch_uid='products_paths_delete')
+        node_moved.connect(invalidate_category_paths, sender=Category, dispatch_uid='products_paths_move')
+
+        from .facets import invalidate_product_facets
+        for model in (Category, Product):
+            post_save.connect(invalidate_product_facets, sender=model, dispatch_uid=f'products_facets_{model._meta.model_name}_save')
+            post_delete.connect(invalidate_product_facets, sender=model, dispatch_uid=f'products_facets_{model._meta.model_name}_delete')
+        node_moved.connect(invalidate_product_facets, sender=Category, dispatch_uid='products_facets_category_move')
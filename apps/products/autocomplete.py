@@ -0,0 +1,237 @@
+"""
+Typo-tolerant autocomplete over product and category names.
+
+Two engines are provided and get_autocomplete picks one per process:
+
+* TrigramAutocomplete, used when the database has the ``pg_trgm`` extension,
+  matches with the word-similarity operator against the GIN trigram indexes
+  created in migration 0005, in a single query.
+* TrieAutocomplete keeps the names in an in-process prefix trie that is
+  rebuilt every AUTOCOMPLETE_REFRESH_INTERVAL seconds, and matches query words
+  as prefixes within a small edit distance. It is the fallback for SQLite and
+  for PostgreSQL servers without the extension.
+"""
+import re
+import threading
+import time
+from django.conf import settings
+from django.db import connection, transaction
+import logging
+
+from .models import Product, Category
+
+logger = logging.getLogger(__name__)
+
+WORD_RE = re.compile(r'\w+', re.UNICODE)
+DEFAULT_LIMIT = 8
+MAX_LIMIT = 20
+
+# Trie node keys besides the single-character children
+PREFIX_ENTRIES = ''
+WORD_ENTRIES = '$$'
+
+
+def _suggestion(kind, pk, name, slug):
+    suggestion = {'type': kind, 'id': pk, 'name': name}
+    if kind == 'category':
+        suggestion['slug'] = slug
+    return suggestion
+
+
+class TrigramAutocomplete:
+    """Autocomplete backed by pg_trgm GIN indexes"""
+
+    SQL = """
+        (SELECT 'product', id, name, NULL, word_similarity(%(q)s, name) AS score
+         FROM products_product WHERE %(q)s <%% name
+         ORDER BY score DESC, name LIMIT %(limit)s)
+        UNION ALL
+        (SELECT 'category', id, name, slug, word_similarity(%(q)s, name) AS score
+         FROM products_category WHERE %(q)s <%% name
+         ORDER BY score DESC, name LIMIT %(limit)s)
+        ORDER BY 5 DESC, 3 LIMIT %(limit)s
+    """
+
+    def suggest(self, query, limit=DEFAULT_LIMIT):
+        # The word similarity cut-off used by ``<%``, for this transaction only
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT set_config('pg_trgm.word_similarity_threshold', %s, true)",
+                [str(getattr(settings, 'AUTOCOMPLETE_MIN_SIMILARITY', 0.3))]
+            )
+            cursor.execute(self.SQL, {'q': query, 'limit': limit})
+            return [_suggestion(kind, pk, name, slug) for kind, pk, name, slug, score in cursor.fetchall()]
+
+
+class PrefixTrie:
+    """
+    A trie over the words of a set of entries.
+
+    Every node keeps up to ``node_capacity`` of the entries with a word
+    passing through it, best ranked first, so a prefix lookup never has to
+    walk a whole subtree. Nodes where a word ends also keep every entry
+    containing that word, for matching the complete words of a query.
+    """
+
+    def __init__(self, entries, node_capacity=50):
+        # entries: (kind, id, name, slug) tuples
+        self.entries = sorted(entries, key=lambda entry: (len(entry[2]), entry[2].lower()))
+        self.words = []
+        self.root = {}
+        for index, entry in enumerate(self.entries):
+            words = set(WORD_RE.findall(entry[2].lower()))
+            self.words.append(words)
+            for word in words:
+                node = self.root
+                for char in word:
+                    node = node.setdefault(char, {PREFIX_ENTRIES: []})
+                    if len(node[PREFIX_ENTRIES]) < node_capacity:
+                        node[PREFIX_ENTRIES].append(index)
+                node.setdefault(WORD_ENTRIES, []).append(index)
+
+    def _walk(self, term, max_distance):
+        """
+        Yield ``(prefix, node, distance)`` for every trie prefix within
+        ``max_distance`` edits of ``term`` that starts with its first letter.
+        """
+        def walk(node, prefix, previous_row, earlier_row):
+            # Optimal string alignment distance, so a swapped pair of letters is one typo
+            char = prefix[-1]
+            row = [previous_row[0] + 1]
+            for i in range(1, len(term) + 1):
+                cost = min(
+                    row[i - 1] + 1,
+                    previous_row[i] + 1,
+                    previous_row[i - 1] + (term[i - 1] != char)
+                )
+                if i > 1 and earlier_row is not None and term[i - 1] == prefix[-2] and term[i - 2] == char:
+                    cost = min(cost, earlier_row[i - 2] + 1)
+                row.append(cost)
+            if row[-1] <= max_distance:
+                yield prefix, node, row[-1]
+            if min(row) <= max_distance:
+                for next_char, child in node.items():
+                    if len(next_char) == 1:
+                        yield from walk(child, prefix + next_char, row, previous_row)
+
+        # Typos in the first letter are rare, and pinning it prunes most of the trie
+        if term[0] in self.root:
+            yield from walk(self.root[term[0]], term[0], list(range(len(term) + 1)), None)
+
+    @staticmethod
+    def _words_under(prefix, node):
+        """Yield every indexed word starting with ``prefix``"""
+        if WORD_ENTRIES in node:
+            yield prefix
+        for char, child in node.items():
+            if len(char) == 1:
+                yield from PrefixTrie._words_under(prefix + char, child)
+
+    @staticmethod
+    def _max_distance(term):
+        # Allow one typo from 4 characters and two from 8
+        return 0 if len(term) < 4 else 1 if len(term) < 8 else 2
+
+    def suggest(self, query, limit=DEFAULT_LIMIT):
+        """
+        Rank entries containing a word that starts like the last query word
+        and, for every other query word, a word that matches it in full.
+        """
+        terms = WORD_RE.findall(query.lower())
+        if not terms:
+            return []
+        *complete, partial = terms
+
+        if not complete:
+            scores = {}
+            for prefix, node, distance in self._walk(partial, self._max_distance(partial)):
+                for index in node[PREFIX_ENTRIES]:
+                    if distance < scores.get(index, distance + 1):
+                        scores[index] = distance
+        else:
+            scores = None
+            for term in complete:
+                matches = {}
+                for word, node, distance in self._walk(term, self._max_distance(term)):
+                    for index in node.get(WORD_ENTRIES, ()):
+                        if distance < matches.get(index, distance + 1):
+                            matches[index] = distance
+                scores = matches if scores is None else {
+                    index: scores[index] + distance for index, distance in matches.items() if index in scores
+                }
+            completions = {}
+            for prefix, node, distance in self._walk(partial, self._max_distance(partial)):
+                for word in self._words_under(prefix, node):
+                    if distance < completions.get(word, distance + 1):
+                        completions[word] = distance
+            candidates, scores = scores, {}
+            for index, distance in candidates.items():
+                best = min((completions[word] for word in self.words[index] if word in completions), default=None)
+                if best is not None:
+                    scores[index] = distance + best
+
+        ranked = sorted(scores, key=lambda index: (scores[index], index))[:limit]
+        return [_suggestion(*self.entries[index]) for index in ranked]
+
+
+class TrieAutocomplete:
+    """Autocomplete over an in-process PrefixTrie, refreshed periodically"""
+
+    def __init__(self, refresh_interval=None):
+        if refresh_interval is None:
+            refresh_interval = getattr(settings, 'AUTOCOMPLETE_REFRESH_INTERVAL', 300)
+        self.refresh_interval = refresh_interval
+        self._trie = None
+        self._built_at = 0
+        self._lock = threading.Lock()
+
+    def _load_entries(self):
+        return (
+            [('product', pk, name, None) for pk, name in Product.objects.values_list('id', 'name')]
+            + [('category', pk, name, slug) for pk, name, slug in Category.objects.values_list('id', 'name', 'slug')]
+        )
+
+    def refresh(self):
+        trie = PrefixTrie(self._load_entries())
+        self._trie, self._built_at = trie, time.monotonic()
+        return trie
+
+    def _get_trie(self):
+        if self._trie is None or time.monotonic() - self._built_at > self.refresh_interval:
+            # One thread rebuilds; the others keep serving the previous trie
+            if self._lock.acquire(blocking=self._trie is None):
+                try:
+                    if self._trie is None or time.monotonic() - self._built_at > self.refresh_interval:
+                        self.refresh()
+                finally:
+                    self._lock.release()
+        return self._trie
+
+    def suggest(self, query, limit=DEFAULT_LIMIT):
+        return self._get_trie().suggest(query, limit)
+
+
+def trigram_available():
+    if connection.vendor != 'postgresql':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+        return cursor.fetchone() is not None
+
+
+_autocomplete = None
+_autocomplete_lock = threading.Lock()
+
+
+def get_autocomplete():
+    """Return this process's autocomplete engine"""
+    global _autocomplete
+    if _autocomplete is None:
+        with _autocomplete_lock:
+            if _autocomplete is None:
+                if trigram_available():
+                    _autocomplete = TrigramAutocomplete()
+                else:
+                    logger.info('pg_trgm is not available, using the in-process autocomplete trie')
+                    _autocomplete = TrieAutocomplete()
+    return _autocomplete
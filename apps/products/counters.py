@@ -0,0 +1,179 @@
+"""
+Product view counting.
+
+product_detail records a view with record_view instead of saving the
+product, so a page view no longer rewrites the whole row (and updated_at)
+or loses increments to concurrent saves. Views are collected by the counter
+named in ``settings.PRODUCT_VIEW_COUNTER`` and added to ``Product.views`` in
+batches by add_views:
+
+* BufferedViewCounter (default) keeps a per-process buffer and writes it
+  every PRODUCT_VIEW_FLUSH_INTERVAL seconds, from a background thread so an
+  idle process does not sit on its views, when it grows past
+  PRODUCT_VIEW_MAX_PENDING products, and at exit.
+* RedisViewCounter increments a Redis hash shared by all workers, which the
+  flush_product_views command drains.
+
+``Product.views``, and so ``sort=popular``, lags by at most one flush.
+"""
+import atexit
+import threading
+import time
+from collections import Counter
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import Case, F, PositiveIntegerField, Value, When
+from django.utils.module_loading import import_string
+import logging
+
+from .models import Product
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_COUNTER = 'apps.products.counters.BufferedViewCounter'
+
+
+def add_views(counts, batch_size=500):
+    """
+    Add ``{product_id: views}`` to Product.views, one
+    ``UPDATE ... SET views = views + CASE id ...`` per ``batch_size`` products.
+    """
+    # Sorted so concurrent flushes lock rows in the same order
+    items = sorted(counts.items())
+    for start in range(0, len(items), batch_size):
+        batch = items[start:start + batch_size]
+        Product.objects.filter(id__in=[product_id for product_id, views in batch]).update(
+            views=F('views') + Case(
+                *[When(id=product_id, then=Value(views)) for product_id, views in batch],
+                default=Value(0),
+                output_field=PositiveIntegerField()
+            )
+        )
+
+
+class ViewCounter:
+    """Base class for view counters"""
+
+    def record(self, product_id):
+        """Count one view of ``product_id``"""
+        raise NotImplementedError
+
+    def flush(self):
+        """Write pending views to the database and return how many products were updated"""
+        return 0
+
+
+class BufferedViewCounter(ViewCounter):
+    """Views buffered in this process and written out periodically"""
+
+    def __init__(self, flush_interval=None, max_pending=None):
+        if flush_interval is None:
+            flush_interval = getattr(settings, 'PRODUCT_VIEW_FLUSH_INTERVAL', 10)
+        if max_pending is None:
+            max_pending = getattr(settings, 'PRODUCT_VIEW_MAX_PENDING', 1000)
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self._pending = Counter()
+        self._last_flush = time.monotonic()
+        self._lock = threading.Lock()
+        self._timer = None
+        atexit.register(self.flush)
+
+    def _flush_periodically(self):
+        while True:
+            time.sleep(self.flush_interval)
+            if time.monotonic() - self._last_flush >= self.flush_interval:
+                try:
+                    self.flush()
+                finally:
+                    # This thread's connection, closed unless CONN_MAX_AGE keeps it
+                    close_old_connections()
+
+    def record(self, product_id):
+        with self._lock:
+            if self._timer is None:
+                # Started by the first view, so after a preloading server forks
+                self._timer = threading.Thread(target=self._flush_periodically, name='product-view-flush', daemon=True)
+                self._timer.start()
+            self._pending[product_id] += 1
+            due = (
+                len(self._pending) >= self.max_pending
+                or time.monotonic() - self._last_flush >= self.flush_interval
+            )
+        if due:
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, Counter()
+            self._last_flush = time.monotonic()
+        if not pending:
+            return 0
+        try:
+            add_views(pending)
+        except Exception as e:
+            # Keep the views for the next flush rather than failing the request
+            logger.error(f"Failed to flush views for {len(pending)} product(s): {e}")
+            with self._lock:
+                self._pending.update(pending)
+            return 0
+        return len(pending)
+
+
+class RedisViewCounter(ViewCounter):
+    """Views counted in a Redis hash shared by every worker"""
+    key = 'product:views'
+
+    def __init__(self, url=None):
+        self.url = url or settings.REDIS_URL
+        self._client = None
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    import redis
+                    self._client = redis.Redis.from_url(self.url)
+        return self._client
+
+    @property
+    def flushing_key(self):
+        return f'{self.key}:flushing'
+
+    def record(self, product_id):
+        self.client.hincrby(self.key, product_id, 1)
+
+    def flush(self):
+        """
+        Move the hash aside and write it out, so views recorded meanwhile go
+        to a fresh hash. A batch left by a failed flush is retried first.
+        """
+        if not self.client.exists(self.flushing_key):
+            if not self.client.exists(self.key):
+                return 0
+            self.client.renamenx(self.key, self.flushing_key)
+        counts = {int(product_id): int(views) for product_id, views in self.client.hgetall(self.flushing_key).items()}
+        add_views(counts)
+        self.client.delete(self.flushing_key)
+        return len(counts)
+
+
+_counter = None
+_counter_lock = threading.Lock()
+
+
+def get_view_counter():
+    """Return the process-wide counter configured by PRODUCT_VIEW_COUNTER"""
+    global _counter
+    if _counter is None:
+        with _counter_lock:
+            if _counter is None:
+                _counter = import_string(getattr(settings, 'PRODUCT_VIEW_COUNTER', DEFAULT_COUNTER))()
+    return _counter
+
+
+def record_view(product):
+    """Count a view of ``product``"""
+    get_view_counter().record(product.pk)
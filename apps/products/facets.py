@@ -0,0 +1,203 @@
+"""
+Faceted filtering for product_list.
+
+ProductFilters reads the ``category`` (repeatable), ``min_price``,
+``max_price`` and ``rating`` parameters. Selecting a category matches its
+whole subtree, resolved from the cached category tree without a query.
+
+Each facet is counted with the other facets' filters applied but not its
+own, so the sidebar shows what choosing another option would give:
+
+* price buckets (PRICE_BUCKETS) and "N stars & up" ratings come from one
+  aggregate query of conditional counts;
+* category counts come from one ``GROUP BY category_id`` query, rolled up
+  to every ancestor in Python.
+
+Facets of listings without a search query are cached for PRODUCT_FACETS_TTL
+seconds under a version token that changes whenever a product or category
+is saved or deleted. The same token versions the sidebar fragment of
+products/list.html, so facets are only computed when it has to be rendered.
+"""
+import hashlib
+import uuid
+from dataclasses import dataclass
+from decimal import Decimal, InvalidOperation
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, Q
+
+from .tree import get_category_tree
+
+VERSION_KEY = 'product:facets:version'
+
+# Lower bound inclusive, upper bound exclusive, in KES
+PRICE_BUCKETS = (
+    (None, Decimal('1000')),
+    (Decimal('1000'), Decimal('5000')),
+    (Decimal('5000'), Decimal('20000')),
+    (Decimal('20000'), Decimal('50000')),
+    (Decimal('50000'), None),
+)
+RATING_THRESHOLDS = (4, 3, 2, 1)
+PRICE_STEP = Decimal('0.01')
+
+
+def _decimal(value):
+    try:
+        value = Decimal(value)
+    except (InvalidOperation, TypeError):
+        return None
+    return value if value.is_finite() else None
+
+
+@dataclass(frozen=True)
+class ProductFilters:
+    categories: tuple = ()
+    min_price: Decimal = None
+    max_price: Decimal = None
+    rating: int = None
+    search: str = ''
+
+    @classmethod
+    def from_query(cls, params):
+        """Build filters from a QueryDict, ignoring values that do not parse"""
+        rating = params.get('rating')
+        return cls(
+            categories=tuple(sorted({int(value) for value in params.getlist('category') if value.isdigit()})),
+            min_price=_decimal(params.get('min_price') or None),
+            max_price=_decimal(params.get('max_price') or None),
+            rating=int(rating) if rating and rating.isdigit() else None,
+            search=params.get('search', '').strip(),
+        )
+
+    def condition(self, exclude=None):
+        """Q for every filter but the ``exclude`` facet ('category', 'price' or 'rating')"""
+        condition = Q()
+        if self.categories and exclude != 'category':
+            condition &= Q(category_id__in=category_subtrees(self.categories))
+        if exclude != 'price':
+            if self.min_price is not None:
+                condition &= Q(price__gte=self.min_price)
+            if self.max_price is not None:
+                condition &= Q(price__lte=self.max_price)
+        if self.rating is not None and exclude != 'rating':
+            condition &= Q(rating__gte=self.rating)
+        return condition
+
+    def apply(self, queryset):
+        return queryset.filter(self.condition())
+
+
+def category_subtrees(category_ids):
+    """Return the ids of ``category_ids`` and all their descendants"""
+    selected = set(category_ids)
+    ids = set()
+    for root in get_category_tree():
+        stack = [(root, root['id'] in selected)]
+        while stack:
+            node, inside = stack.pop()
+            if inside:
+                ids.add(node['id'])
+            stack += [(child, inside or child['id'] in selected) for child in node['children']]
+    return ids
+
+
+def _bucket_condition(low, high):
+    condition = Q()
+    if low is not None:
+        condition &= Q(price__gte=low)
+    if high is not None:
+        condition &= Q(price__lt=high)
+    return condition
+
+
+def compute_facets(queryset, filters):
+    """
+    Return ``{'categories', 'price', 'rating'}`` facet lists for
+    ``queryset`` (the listing before facet filters) in two queries.
+    """
+    queryset = queryset.order_by()
+    price_condition = filters.condition(exclude='price')
+    rating_condition = filters.condition(exclude='rating')
+    aggregates = {
+        f'price_{index}': Count('id', filter=price_condition & _bucket_condition(low, high))
+        for index, (low, high) in enumerate(PRICE_BUCKETS)
+    }
+    aggregates.update({
+        f'rating_{threshold}': Count('id', filter=rating_condition & Q(rating__gte=threshold))
+        for threshold in RATING_THRESHOLDS
+    })
+    counts = queryset.aggregate(**aggregates)
+
+    direct = dict(
+        queryset.filter(filters.condition(exclude='category'))
+        .values_list('category_id')
+        .annotate(count=Count('id'))
+    )
+    categories = []
+
+    def subtree_count(node, depth):
+        entry = {'id': node['id'], 'name': node['name'], 'depth': depth, 'selected': node['id'] in filters.categories}
+        categories.append(entry)
+        entry['count'] = direct.get(node['id'], 0) + sum(subtree_count(child, depth + 1) for child in node['children'])
+        return entry['count']
+
+    for root in get_category_tree():
+        subtree_count(root, 0)
+
+    return {
+        'categories': categories,
+        'price': [
+            {
+                'min': low,
+                # Inclusive, for the max_price parameter
+                'max': high - PRICE_STEP if high is not None else None,
+                'count': counts[f'price_{index}'],
+                'selected': filters.min_price == low and filters.max_price == (high - PRICE_STEP if high is not None else None),
+            }
+            for index, (low, high) in enumerate(PRICE_BUCKETS)
+        ],
+        'rating': [
+            {'min': threshold, 'count': counts[f'rating_{threshold}'], 'selected': filters.rating == threshold}
+            for threshold in RATING_THRESHOLDS
+        ],
+    }
+
+
+def _version():
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        version = uuid.uuid4().hex
+        cache.add(VERSION_KEY, version, None)
+        version = cache.get(VERSION_KEY, version)
+    return version
+
+
+def facets_key(filters):
+    """
+    Identifies the facets of ``filters`` as of the current catalog version,
+    which product and category changes replace; also keys the product_list
+    sidebar fragment.
+    """
+    return f'{_version()}:{hashlib.md5(repr(filters).encode()).hexdigest()}'
+
+
+def get_facets(queryset, filters):
+    """compute_facets, cached unless the listing is a search"""
+    if filters.search:
+        return compute_facets(queryset, filters)
+    key = f'product:facets:{facets_key(filters)}'
+    facets = cache.get(key)
+    if facets is None:
+        facets = compute_facets(queryset, filters)
+        cache.set(key, facets, getattr(settings, 'PRODUCT_FACETS_TTL', 300))
+    return facets
+
+
+def invalidate_product_facets(sender=None, **kwargs):
+    """Product and Category post_save/post_delete receiver; retires every cached facet set"""
+    def bump():
+        cache.set(VERSION_KEY, uuid.uuid4().hex, None)
+    bump()
+    transaction.on_commit(bump)
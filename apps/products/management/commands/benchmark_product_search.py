@@ -0,0 +1,77 @@
+import random
+import time
+import uuid
+from decimal import Decimal
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Q
+from apps.products.models import Category, Product
+from apps.products.search import search_products
+
+WORDS = (
+    'wireless bluetooth speaker portable leather wallet cotton shirt running shoes stainless steel '
+    'kitchen knife ceramic mug gaming laptop mechanical keyboard optical mouse smart watch solar '
+    'charger waterproof jacket denim jeans coffee maker blender electric kettle office chair desk '
+    'lamp phone case screen protector headphones noise cancelling backpack travel suitcase'
+).split()
+
+class Command(BaseCommand):
+    help = 'Benchmarks full-text product search against ILIKE on a generated catalog (PostgreSQL)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=100000, help='Products to generate')
+        parser.add_argument('--repeat', type=int, default=20, help='Runs per query')
+        parser.add_argument('--query', action='append', dest='queries', help='Search text (repeatable)')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError('Full-text search needs PostgreSQL')
+
+        queries = options['queries'] or ['wire', 'gaming laptop', 'stainless steel knife', 'zzz']
+        category = Category.objects.create(name=f'Search benchmark {uuid.uuid4().hex[:8]}')
+        rng = random.Random(42)
+
+        self.stdout.write(f"Generating {options['products']} products...")
+        started = time.perf_counter()
+        batch = []
+        for i in range(options['products']):
+            batch.append(Product(
+                name=' '.join(rng.sample(WORDS, 3)).title(),
+                description=' '.join(rng.choices(WORDS, k=25)),
+                price=Decimal('9.99'),
+                category=category
+            ))
+            if len(batch) == 5000:
+                Product.objects.bulk_create(batch)
+                batch = []
+        Product.objects.bulk_create(batch)
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE products_product')
+        self.stdout.write(f'Inserted in {time.perf_counter() - started:.1f}s')
+
+        try:
+            products = Product.objects.filter(category=category)
+            for text in queries:
+                ilike = products.filter(Q(name__icontains=text) | Q(description__icontains=text)).order_by('-created_at')
+                fts = search_products(products, text)
+                ilike_ms, ilike_count = self._time(ilike, options['repeat'])
+                fts_ms, fts_count = self._time(fts, options['repeat'])
+                plan = fts[:20].explain()
+                self.stdout.write(
+                    f'{text!r}: ilike {ilike_ms:.1f}ms ({ilike_count} hits) | '
+                    f'fts {fts_ms:.1f}ms ({fts_count} hits) | '
+                    f"gin index {'used' if 'search_vector_gin' in plan else 'NOT used'}"
+                )
+        finally:
+            category.delete()
+
+    def _time(self, queryset, repeat):
+        """Median time to count the matches and fetch the first page"""
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            count = queryset.count()
+            list(queryset[:20])
+            timings.append((time.perf_counter() - start) * 1000)
+        timings.sort()
+        return timings[len(timings) // 2], count
@@ -0,0 +1,85 @@
+import threading
+import time
+import uuid
+from decimal import Decimal
+from django.core.management.base import BaseCommand
+from django.db import connections
+from apps.products.models import Category, Product
+from apps.products.stock import reserve_stock, InsufficientStock
+
+class Command(BaseCommand):
+    help = 'Benchmarks many concurrent buyers reserving stock of a single product'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--buyers', type=int, default=50, help='Number of concurrent buyers')
+        parser.add_argument('--stock', type=int, default=25, help='Initial stock of the contended product')
+        parser.add_argument('--quantity', type=int, default=1, help='Units each buyer tries to reserve')
+
+    def handle(self, *args, **options):
+        buyers = options['buyers']
+        stock = options['stock']
+        quantity = options['quantity']
+
+        category = Category.objects.create(name=f'Stock benchmark {uuid.uuid4().hex[:8]}')
+        product = Product.objects.create(
+            name='Stock benchmark product',
+            description='',
+            price=Decimal('1.00'),
+            stock=stock,
+            category=category
+        )
+
+        barrier = threading.Barrier(buyers)
+        lock = threading.Lock()
+        outcomes = {'reserved': 0, 'short': 0, 'errors': 0}
+        latencies = []
+
+        def buyer():
+            try:
+                barrier.wait()
+                start = time.perf_counter()
+                try:
+                    reserve_stock([(product.pk, quantity)])
+                    outcome = 'reserved'
+                except InsufficientStock:
+                    outcome = 'short'
+                except Exception as e:
+                    self.stderr.write(f'Buyer failed: {e}')
+                    outcome = 'errors'
+                elapsed = time.perf_counter() - start
+                with lock:
+                    outcomes[outcome] += 1
+                    latencies.append(elapsed)
+            finally:
+                connections.close_all()
+
+        self.stdout.write(f'Running {buyers} buyers against {stock} units ({quantity} per buyer)...')
+        threads = [threading.Thread(target=buyer) for _ in range(buyers)]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        wall = time.perf_counter() - started
+
+        product.refresh_from_db()
+        sold = outcomes['reserved'] * quantity
+        latencies.sort()
+        p50 = latencies[len(latencies) // 2] * 1000 if latencies else 0
+        p99 = latencies[int(len(latencies) * 0.99) - 1] * 1000 if latencies else 0
+
+        self.stdout.write(
+            f"reserved={outcomes['reserved']} short={outcomes['short']} errors={outcomes['errors']} "
+            f"remaining_stock={product.stock}"
+        )
+        self.stdout.write(
+            f'wall={wall * 1000:.1f}ms throughput={buyers / wall:.0f} reservations/s '
+            f'p50={p50:.2f}ms p99={p99:.2f}ms'
+        )
+
+        category.delete()
+
+        if sold > stock or product.stock != stock - sold:
+            self.stdout.write(self.style.ERROR('Oversold: stock accounting is inconsistent'))
+        else:
+            self.stdout.write(self.style.SUCCESS('No overselling detected'))
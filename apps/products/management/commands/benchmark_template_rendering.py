@@ -0,0 +1,88 @@
+import time
+from decimal import Decimal
+from unittest.mock import patch
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test import RequestFactory, override_settings
+from apps.cart.models import Cart
+from apps.cart.views import cart_detail
+from apps.orders.models import Order, OrderItem
+from apps.orders.views import order_detail
+from apps.products import facets
+from apps.products.models import Category, Product
+from apps.products.views import product_list
+
+ISOLATED_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'render-benchmark'}}
+# Fragment cache backend used for the uncached pass; {% cache %} prefers this alias over 'default'
+WITHOUT_FRAGMENTS = {'template_fragments': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}}
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmarks rendering the product list, order detail and cart pages without and with template fragment '
+        'caching, on fixtures that are rolled back and with caches private to the run'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--categories', type=int, default=30, help='Categories in the sidebar')
+        parser.add_argument('--items', type=int, default=20, help='Lines in the order and the cart')
+        parser.add_argument('--repeat', type=int, default=50, help='Renders per page and pass')
+
+    def handle(self, *args, **options):
+        # Private caches, so nothing cached from the rolled-back fixtures outlives them
+        with override_settings(CACHES=ISOLATED_CACHES), transaction.atomic():
+            self._benchmark(options)
+            transaction.set_rollback(True)
+
+    def _benchmark(self, options):
+        user = get_user_model().objects.create_user(username='render-benchmark')
+        root = Category.objects.create(name='Render benchmark')
+        categories = [
+            Category.objects.create(name=f'Render benchmark {i}', parent=root)
+            for i in range(options['categories'])
+        ]
+        products = Product.objects.bulk_create([
+            Product(name=f'Render benchmark product {i}', description='', price=Decimal(100 + i), stock=10,
+                    rating=Decimal(i % 5), category=categories[i % len(categories)])
+            for i in range(max(options['items'], 48))
+        ])
+        order = Order.objects.create(user=user, shipping_address='Benchmark', phone_number='0700000000')
+        OrderItem.objects.bulk_create([
+            OrderItem(order=order, product=product, quantity=1, price=product.price, subtotal=product.price)
+            for product in products[:options['items']]
+        ])
+        cart = Cart.objects.create(user=user)
+        cart.apply_changes({product: 1 for product in products[:options['items']]}, {}, [])
+
+        factory = RequestFactory()
+        pages = [
+            ('product_list', lambda: product_list(self._request(factory, user, f'/products/list/?category={root.pk}'))),
+            ('order_detail', lambda: order_detail(self._request(factory, user, f'/orders/{order.pk}/'), pk=order.pk)),
+            ('cart_detail', lambda: cart_detail(self._request(factory, user, '/cart/detail/'))),
+        ]
+        for name, render in pages:
+            # The sidebar would otherwise still be served its facets from the cache
+            with override_settings(CACHES={**ISOLATED_CACHES, **WITHOUT_FRAGMENTS}), \
+                    patch.object(facets, 'cache', caches['template_fragments']):
+                before = self._time(render, options['repeat'])
+            render()  # fills the fragment cache
+            after = self._time(render, options['repeat'])
+            self.stdout.write(f'{name}: {before:.2f}ms per page without fragment caching, {after:.2f}ms with')
+
+    def _request(self, factory, user, path):
+        request = factory.get(path)
+        request.user = user
+        return request
+
+    def _time(self, render, repeat):
+        """Median milliseconds to run the view and render its template"""
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            response = render()
+            timings.append((time.perf_counter() - start) * 1000)
+            assert response.status_code == 200, response.status_code
+        timings.sort()
+        return timings[len(timings) // 2]
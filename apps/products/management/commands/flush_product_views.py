@@ -0,0 +1,26 @@
+import time
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from apps.products.counters import get_view_counter
+
+class Command(BaseCommand):
+    help = 'Adds product views collected by the view counter (e.g. in Redis) to Product.views'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, default=10.0, help='Seconds between flushes')
+        parser.add_argument('--once', action='store_true', help='Flush the pending views and exit')
+
+    def handle(self, *args, **options):
+        counter = get_view_counter()
+        self.stdout.write(f'Flushing product views from {counter.__class__.__name__}...')
+
+        while True:
+            close_old_connections()
+            flushed = counter.flush()
+            if flushed:
+                self.stdout.write(f'Updated views for {flushed} product(s)')
+            if options['once']:
+                break
+            time.sleep(options['interval'])
+
+        self.stdout.write(self.style.SUCCESS('Product views flushed'))
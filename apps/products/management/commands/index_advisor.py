@@ -0,0 +1,139 @@
+import json
+from decimal import Decimal
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Count
+from apps.cart.models import CartItem
+from apps.orders.models import Order, OrderItem
+from apps.orders.views import ORDERS_PER_PAGE
+from apps.products.facets import category_subtrees
+from apps.products.models import Product, RelatedProduct
+from apps.products.serializers import ProductSerializer
+from apps.products.views import PRODUCTS_PER_PAGE, SORT_ORDERINGS
+from savannah_ecommerce.pagination import DEFAULT_ORDERING
+from savannah_ecommerce.shaping import shape_queryset
+
+API_PAGE_SIZE = settings.REST_FRAMEWORK['PAGE_SIZE']
+
+
+def _sort_query(ordering):
+    return lambda samples: Product.objects.order_by(*ordering)[:PRODUCTS_PER_PAGE + 1]
+
+
+# (name, samples needed, samples -> queryset), mirroring what the views run
+QUERY_CATALOGUE = [
+    ('api products page', (), lambda samples: (
+        shape_queryset(Product.objects.all(), ProductSerializer).order_by(*DEFAULT_ORDERING)[:API_PAGE_SIZE + 1]
+    )),
+    *[(f'product_list sort={sort}', (), _sort_query(ordering)) for sort, ordering in SORT_ORDERINGS.items()],
+    ('product_list category', ('category',), lambda samples: (
+        Product.objects.filter(category_id__in=category_subtrees([samples['category']]))
+        .order_by(*DEFAULT_ORDERING)[:PRODUCTS_PER_PAGE + 1]
+    )),
+    ('product_list rating filter', (), lambda samples: (
+        Product.objects.filter(rating__gte=4).order_by(*SORT_ORDERINGS['rating_desc'])[:PRODUCTS_PER_PAGE + 1]
+    )),
+    ('product_list price filter', (), lambda samples: (
+        Product.objects.filter(price__gte=Decimal('1000'), price__lte=Decimal('4999.99')).order_by(*SORT_ORDERINGS['price_asc'])[:PRODUCTS_PER_PAGE + 1]
+    )),
+    ('product_list category facet counts', ('category',), lambda samples: (
+        Product.objects.filter(category_id__in=category_subtrees([samples['category']]))
+        .values_list('category_id').annotate(count=Count('id')).order_by()
+    )),
+    ('related products', ('product',), lambda samples: (
+        RelatedProduct.objects.filter(product_id=samples['product']).select_related('related').order_by('rank')[:4]
+    )),
+    ('order_list', ('user',), lambda samples: (
+        Order.objects.filter(user_id=samples['user']).order_by(*DEFAULT_ORDERING)[:ORDERS_PER_PAGE + 1]
+    )),
+    ('order items of an order', ('order',), lambda samples: (
+        OrderItem.objects.filter(order_id=samples['order']).select_related('product')
+    )),
+    ('orders of a product', ('product',), lambda samples: (
+        OrderItem.objects.filter(product_id=samples['product']).values_list('order_id', flat=True)
+    )),
+    ('cart items', ('cart',), lambda samples: (
+        CartItem.objects.filter(cart_id=samples['cart']).select_related('product')
+    )),
+]
+
+
+def find_seq_scans(plan):
+    """Return the ``Relation Name`` of every ``Seq Scan`` node in a JSON plan"""
+    relations = []
+    stack = [plan]
+    while stack:
+        node = stack.pop()
+        if node.get('Node Type') == 'Seq Scan':
+            relations.append(node['Relation Name'])
+        stack += node.get('Plans', [])
+    return relations
+
+
+def _samples():
+    """Ids to run the catalogue with, taken from existing rows"""
+    ordered = OrderItem.objects.values_list('product_id', 'order_id', 'order__user_id').first()
+    return {
+        'category': Product.objects.values_list('category_id', flat=True).first(),
+        'product': ordered[0] if ordered else Product.objects.values_list('id', flat=True).first(),
+        'order': ordered[1] if ordered else None,
+        'user': ordered[2] if ordered else None,
+        'cart': CartItem.objects.values_list('cart_id', flat=True).first(),
+    }
+
+
+class Command(BaseCommand):
+    help = (
+        'Runs EXPLAIN (ANALYZE, BUFFERS) over the catalogue of queries the views issue and '
+        'fails if any scans a large table sequentially (PostgreSQL)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--min-rows', type=int, default=1000,
+                            help='Ignore sequential scans of tables estimated to hold fewer rows')
+        parser.add_argument('--force-index', action='store_true',
+                            help='Plan with enable_seqscan off, so any remaining sequential scan means no index fits; '
+                                 'use on small databases such as CI')
+        parser.add_argument('--warn-only', action='store_true', help='Report sequential scans without failing')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError('EXPLAIN (ANALYZE, BUFFERS) needs PostgreSQL')
+
+        samples = _samples()
+        flagged = []
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                if options['force_index']:
+                    cursor.execute('SET LOCAL enable_seqscan = off')
+                cursor.execute('SELECT relname, reltuples FROM pg_class WHERE relkind = %s', ['r'])
+                table_rows = dict(cursor.fetchall())
+
+                for name, needs, build in QUERY_CATALOGUE:
+                    if any(samples[sample] is None for sample in needs):
+                        self.stdout.write(f'{name}: skipped, no {", ".join(needs)} to run it with')
+                        continue
+                    sql, params = build(samples).query.sql_with_params()
+                    cursor.execute(f'EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {sql}', params)
+                    result = cursor.fetchone()[0]
+                    if isinstance(result, str):
+                        result = json.loads(result)
+                    plan = result[0]['Plan']
+                    seq_scans = [
+                        relation for relation in find_seq_scans(plan)
+                        if options['force_index'] or table_rows.get(relation, 0) >= options['min_rows']
+                    ]
+                    buffers = plan.get('Shared Hit Blocks', 0) + plan.get('Shared Read Blocks', 0)
+                    line = f"{name}: {result[0]['Execution Time']:.2f}ms, {buffers} buffers"
+                    if seq_scans:
+                        flagged.append(name)
+                        self.stdout.write(self.style.WARNING(f"{line}, seq scan on {', '.join(seq_scans)}"))
+                    else:
+                        self.stdout.write(f'{line}, indexed')
+            # EXPLAIN ANALYZE runs the queries; leave nothing behind
+            transaction.set_rollback(True)
+
+        if flagged and not options['warn_only']:
+            raise CommandError(f"{len(flagged)} quer{'y' if len(flagged) == 1 else 'ies'} scan sequentially: {', '.join(flagged)}")
+        self.stdout.write(self.style.SUCCESS(f'{len(QUERY_CATALOGUE)} queries checked'))
@@ -0,0 +1,43 @@
+import time
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from apps.products.models import Product
+from apps.products.related import CategoryTree, refresh_related_products, stale_products
+
+class Command(BaseCommand):
+    help = 'Recomputes the precomputed related products of new, edited, recently ordered or outdated products'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=200, help='Products refreshed per batch')
+        parser.add_argument('--max-age', type=float, default=24.0, help='Hours after which related products are recomputed anyway')
+        parser.add_argument('--interval', type=float, default=300.0, help='Seconds to sleep when nothing is stale')
+        parser.add_argument('--all', action='store_true', help='Recompute every product once and exit')
+        parser.add_argument('--once', action='store_true', help='Refresh the stale products and exit')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        max_age = timedelta(hours=options['max_age'])
+        self.stdout.write('Refreshing related products...')
+
+        if options['all']:
+            tree = CategoryTree()
+            ids = list(Product.objects.order_by('id').values_list('id', flat=True))
+            for start in range(0, len(ids), batch_size):
+                refresh_related_products(ids[start:start + batch_size], tree)
+            self.stdout.write(self.style.SUCCESS(f'Refreshed related products for {len(ids)} product(s)'))
+            return
+
+        while True:
+            close_old_connections()
+            # The tree is reloaded every batch so category moves are picked up
+            ids = list(stale_products(max_age).order_by('id').values_list('id', flat=True)[:batch_size])
+            refreshed = refresh_related_products(ids) if ids else 0
+            if refreshed:
+                self.stdout.write(f'Refreshed related products for {refreshed} product(s)')
+            if refreshed < batch_size:
+                if options['once']:
+                    break
+                time.sleep(options['interval'])
+
+        self.stdout.write(self.style.SUCCESS('Related products are up to date'))
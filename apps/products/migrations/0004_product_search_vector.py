@@ -0,0 +1,53 @@
+# Generated by Django 4.2.7 on 2026-10-18 10:07
+
+import django.contrib.postgres.search
+from django.db import migrations
+
+SEARCH_CONFIG = 'english'
+
+def create_search_trigger(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(f"""
+        CREATE OR REPLACE FUNCTION products_product_search_vector_update() RETURNS trigger AS $$
+        BEGIN
+            NEW.search_vector :=
+                setweight(to_tsvector('{SEARCH_CONFIG}', coalesce(NEW.name, '')), 'A') ||
+                setweight(to_tsvector('{SEARCH_CONFIG}', coalesce(NEW.description, '')), 'B');
+            RETURN NEW;
+        END
+        $$ LANGUAGE plpgsql
+    """)
+    schema_editor.execute("""
+        CREATE TRIGGER products_product_search_vector_trigger
+        BEFORE INSERT OR UPDATE OF name, description, search_vector ON products_product
+        FOR EACH ROW EXECUTE FUNCTION products_product_search_vector_update()
+    """)
+    # Fires the trigger for existing rows
+    schema_editor.execute('UPDATE products_product SET search_vector = NULL')
+    schema_editor.execute(
+        'CREATE INDEX IF NOT EXISTS products_product_search_vector_gin ON products_product USING gin (search_vector)'
+    )
+
+def drop_search_trigger(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('DROP INDEX IF EXISTS products_product_search_vector_gin')
+    schema_editor.execute('DROP TRIGGER IF EXISTS products_product_search_vector_trigger ON products_product')
+    schema_editor.execute('DROP FUNCTION IF EXISTS products_product_search_vector_update()')
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("products", "0003_product_rating_product_review_count"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="product",
+            name="search_vector",
+            field=django.contrib.postgres.search.SearchVectorField(
+                editable=False, null=True
+            ),
+        ),
+        migrations.RunPython(create_search_trigger, drop_search_trigger),
+    ]
@@ -0,0 +1,37 @@
+import logging
+from django.db import migrations, transaction
+
+logger = logging.getLogger(__name__)
+
+INDEXES = {
+    'products_product_name_trgm': 'products_product',
+    'products_category_name_trgm': 'products_category',
+}
+
+def create_trigram_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    try:
+        with transaction.atomic():
+            schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    except Exception as e:
+        # Autocomplete falls back to its in-process trie (apps/products/autocomplete.py)
+        logger.warning(f'Could not enable pg_trgm, skipping trigram indexes: {e}')
+        return
+    for name, table in INDEXES.items():
+        schema_editor.execute(f'CREATE INDEX IF NOT EXISTS {name} ON {table} USING gin (name gin_trgm_ops)')
+
+def drop_trigram_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name in INDEXES:
+        schema_editor.execute(f'DROP INDEX IF EXISTS {name}')
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("products", "0004_product_search_vector"),
+    ]
+
+    operations = [
+        migrations.RunPython(create_trigram_indexes, drop_trigram_indexes),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 4.2.7 on 2026-10-18 10:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("products", "0005_trigram_indexes"),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name="product",
+            options={"ordering": ["-created_at", "-id"]},
+        ),
+        migrations.AddIndex(
+            model_name="product",
+            index=models.Index(
+                fields=["created_at", "id"], name="products_created_id_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="product",
+            index=models.Index(
+                fields=["category", "created_at", "id"],
+                name="products_cat_created_id_idx",
+            ),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 4.2.7 on 2026-10-18 10:41
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("products", "0007_related_products"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="product",
+            index=models.Index(
+                fields=["category", "price", "rating"],
+                name="products_cat_price_rating_idx",
+            ),
+        ),
+        # Leads with category_id, like products_cat_created_id_idx, so the
+        # plain category_id index only costs writes
+        migrations.AlterField(
+            model_name="product",
+            name="category",
+            field=models.ForeignKey(
+                db_index=False,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="products",
+                to="products.category",
+            ),
+        ),
+    ]
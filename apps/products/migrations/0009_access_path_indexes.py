@@ -0,0 +1,36 @@
+# Generated by Django 4.2.7 on 2026-10-18 10:45
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("products", "0008_facet_indexes"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="product",
+            index=models.Index(fields=["price", "id"], name="products_price_id_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="product",
+            index=models.Index(fields=["rating", "id"], name="products_rating_id_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="product",
+            index=models.Index(fields=["views", "id"], name="products_views_id_idx"),
+        ),
+        # products_related_product_rank_uniq leads with product_id
+        migrations.AlterField(
+            model_name="relatedproduct",
+            name="product",
+            field=models.ForeignKey(
+                db_index=False,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="related_entries",
+                to="products.product",
+            ),
+        ),
+    ]
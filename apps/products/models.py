@@ -1,4 +1,5 @@
 from django.db import models
+from django.contrib.postgres.search import SearchVectorField
 from django.core.exceptions import ValidationError
 from mptt.models import MPTTModel, TreeForeignKey
 from django.utils.text import slugify
@@ -32,7 +33,8 @@ class Category(MPTTModel):
 
     def get_ancestors_path(self):
         """Returns the full path of ancestors for this category"""
-        return ' > '.join([ancestor.name for ancestor in self.get_ancestors(include_self=True)])
+        from .paths import category_path
+        return category_path(self.pk)
 
     def get_all_products(self):
         """Returns all products in this category and its descendants"""
@@ -40,10 +42,12 @@ class Category(MPTTModel):
 
     def get_average_price(self):
         """Returns the average price of all products in this category and its descendants"""
-        products = self.get_all_products()
-        if not products:
-            return 0
-        return sum(product.price for product in products) / len(products)
+        return self.get_stats()['average_price']
+
+    def get_stats(self):
+        """Returns the cached product count and price statistics of this subtree, see stats.py"""
+        from .stats import category_stats
+        return category_stats(self)
 
     def clean(self):
         """Prevent circular references in the category hierarchy"""
@@ -55,20 +59,60 @@ class Product(models.Model):
     description = models.TextField()
     price = models.DecimalField(max_digits=10, decimal_places=2)
     stock = models.PositiveIntegerField(default=0)
-    category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='products')
+    # Indexed by the composite indexes leading with it below
+    category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='products', db_index=False)
     image = models.ImageField(upload_to='products/', null=True, blank=True)
     views = models.PositiveIntegerField(default=0)
     rating = models.DecimalField(max_digits=3, decimal_places=2, default=0)
     review_count = models.PositiveIntegerField(default=0)
+    # Weighted name (A) + description (B) document, kept current by a
+    # PostgreSQL trigger and GIN indexed (migration 0004); see search.py
+    search_vector = SearchVectorField(null=True, editable=False)
+    # When refresh_related_products last computed this product's RelatedProduct rows
+    related_refreshed_at = models.DateTimeField(null=True, blank=True, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
-        ordering = ['-created_at']
+        ordering = ['-created_at', '-id']
+        indexes = [
+            # Keyset pagination, see savannah_ecommerce/pagination.py
+            models.Index(fields=['created_at', 'id'], name='products_created_id_idx'),
+            models.Index(fields=['category', 'created_at', 'id'], name='products_cat_created_id_idx'),
+            # Faceted filtering and its counts, see facets.py
+            models.Index(fields=['category', 'price', 'rating'], name='products_cat_price_rating_idx'),
+            # product_list sort orders (views.SORT_ORDERINGS); also serve the price and rating filters
+            models.Index(fields=['price', 'id'], name='products_price_id_idx'),
+            models.Index(fields=['rating', 'id'], name='products_rating_id_idx'),
+            models.Index(fields=['views', 'id'], name='products_views_id_idx'),
+        ]
 
     def __str__(self):
         return self.name
 
+    def get_category_name(self):
+        """Returns the category name without loading the category"""
+        from .paths import category_name
+        return category_name(self.category_id)
+
     def get_category_path(self):
         """Returns the full category path for this product"""
-        return self.category.get_ancestors_path()
+        from .paths import category_path
+        return category_path(self.category_id)
+
+class RelatedProduct(models.Model):
+    """One precomputed "You may also like" entry, see apps/products/related.py"""
+    # Indexed by products_related_product_rank_uniq
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='related_entries', db_index=False)
+    related = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='+')
+    rank = models.PositiveSmallIntegerField()
+    score = models.FloatField()
+
+    class Meta:
+        ordering = ['product', 'rank']
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'rank'], name='products_related_product_rank_uniq'),
+        ]
+
+    def __str__(self):
+        return f"{self.related_id} for {self.product_id} (#{self.rank})"
@@ -0,0 +1,110 @@
+"""
+Process-level map of category names and ancestor paths.
+
+Every process keeps ``{category_id: (name, path)}`` for the whole tree, built
+from one query ordered by ``(tree_id, lft)``, so resolving a product's
+category name or "Electronics > Phones" path costs no queries. Category
+changes replace a version token in the shared cache; each process compares
+it with the version its map was built at, at most every
+CATEGORY_PATH_CHECK_INTERVAL seconds, and rebuilds when they differ. The
+process that made the change rebuilds on its next lookup. Responses that
+are cached or validated across processes call check_category_paths before
+rendering, so they never show a path older than their validators.
+"""
+import threading
+import time
+import uuid
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from .models import Category
+
+VERSION_KEY = 'category:paths:version'
+SEPARATOR = ' > '
+
+
+class CategoryPathMap:
+    def __init__(self, check_interval=None):
+        if check_interval is None:
+            check_interval = getattr(settings, 'CATEGORY_PATH_CHECK_INTERVAL', 5)
+        self.check_interval = check_interval
+        self._entries = None
+        self._version = None
+        self._checked_at = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _shared_version():
+        return cache.get(VERSION_KEY)
+
+    def _build(self):
+        entries = {}
+        for pk, parent_id, name in Category.objects.order_by('tree_id', 'lft').values_list('id', 'parent_id', 'name'):
+            # Parents come first in (tree_id, lft) order
+            entries[pk] = (name, f'{entries[parent_id][1]}{SEPARATOR}{name}' if parent_id else name)
+        return entries
+
+    def refresh(self):
+        with self._lock:
+            version = self._shared_version()
+            entries = self._build()
+            self._entries, self._version = entries, version
+            self._checked_at = time.monotonic()
+        return entries
+
+    def check(self):
+        """Rebuild now if the shared version moved, whatever the interval"""
+        entries = self._entries
+        self._checked_at = time.monotonic()
+        if entries is None or self._shared_version() != self._version:
+            return self.refresh()
+        return entries
+
+    def _get_entries(self):
+        entries = self._entries
+        if entries is None or time.monotonic() - self._checked_at >= self.check_interval:
+            return self.check()
+        return entries
+
+    def get(self, category_id):
+        """Return ``(name, path)`` for ``category_id``"""
+        entries = self._get_entries()
+        if category_id not in entries:
+            # Created by another process since the last check
+            entries = self.refresh()
+        return entries[category_id]
+
+    def invalidate(self):
+        """
+        Drop this process's map and have every other process rebuild theirs.
+        The version changes again on commit, so a process that rebuilt from
+        the uncommitted tree in between still picks up the change.
+        """
+        def bump():
+            cache.set(VERSION_KEY, uuid.uuid4().hex, None)
+        bump()
+        transaction.on_commit(bump)
+        self._entries = None
+
+
+category_paths = CategoryPathMap()
+
+
+def check_category_paths():
+    """Bring this process's map up to date with the shared version now"""
+    category_paths.check()
+
+
+def category_name(category_id):
+    return category_paths.get(category_id)[0]
+
+
+def category_path(category_id):
+    """Return the ``' > '``-joined names from the root down to ``category_id``"""
+    return category_paths.get(category_id)[1]
+
+
+def invalidate_category_paths(sender=None, **kwargs):
+    """Category post_save/post_delete/node_moved receiver"""
+    category_paths.invalidate()
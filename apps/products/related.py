@@ -0,0 +1,186 @@
+"""
+Precomputed related products.
+
+refresh_related_products scores candidates for each product and stores the
+best RELATED_PRODUCTS_STORED as RelatedProduct rows, so the detail page reads
+them with one indexed lookup (get_related_products). A candidate's score
+combines:
+
+* how often it was bought in the same (non-cancelled) order,
+* how close its category is in the category tree: 1 for the same category,
+  1/2 for a parent or child, 1/3 for a sibling or grandchild, and
+* its popularity (views), on a log scale.
+
+Candidates come from the most viewed products of the categories within
+MAX_CATEGORY_DISTANCE of the product's own, plus everything it was bought
+with. The refresh_related_products command recomputes products that are
+stale (see stale_products).
+"""
+import math
+from collections import defaultdict
+from datetime import timedelta
+from django.db import connection, transaction
+from django.db.models import Exists, F, OuterRef, Q, Window
+from django.db.models.functions import RowNumber
+from django.utils import timezone
+
+from .models import Category, Product, RelatedProduct
+
+RELATED_PRODUCTS_STORED = 12
+CANDIDATES_PER_CATEGORY = 50
+MAX_CATEGORY_DISTANCE = 2
+
+COPURCHASE_WEIGHT = 3.0
+CATEGORY_WEIGHT = 2.0
+POPULARITY_WEIGHT = 1.0
+
+
+def get_related_products(product, limit=4):
+    """
+    Return up to ``limit`` products related to ``product``, best first.
+
+    Products that have not been through refresh_related_products yet get
+    the most viewed products of their category instead.
+    """
+    if product.related_refreshed_at is None:
+        return list(
+            Product.objects.filter(category_id=product.category_id)
+            .exclude(pk=product.pk)
+            .order_by('-views', '-id')[:limit]
+        )
+    entries = RelatedProduct.objects.filter(product=product).select_related('related').order_by('rank')[:limit]
+    return [entry.related for entry in entries]
+
+
+def stale_products(max_age=timedelta(days=1)):
+    """
+    Products whose related products need recomputing: never computed,
+    edited or ordered since, or older than ``max_age``.
+    """
+    from apps.orders.models import OrderItem
+
+    ordered_since = OrderItem.objects.filter(
+        product=OuterRef('pk'),
+        order__created_at__gt=OuterRef('related_refreshed_at')
+    )
+    return Product.objects.filter(
+        Q(related_refreshed_at__isnull=True)
+        | Q(related_refreshed_at__lt=F('updated_at'))
+        | Q(related_refreshed_at__lt=timezone.now() - max_age)
+        | Exists(ordered_since)
+    )
+
+
+class CategoryTree:
+    """Category parents and children, for distances between categories"""
+
+    def __init__(self):
+        self.parents = {}
+        self.children = defaultdict(list)
+        for pk, parent_id in Category.objects.values_list('id', 'parent_id'):
+            self.parents[pk] = parent_id
+            self.children[parent_id].append(pk)
+
+    def neighbours(self, category_id, max_distance=MAX_CATEGORY_DISTANCE):
+        """Return ``{category_id: distance}`` for categories up to ``max_distance`` edges away"""
+        distances = {category_id: 0}
+        frontier = [category_id]
+        for distance in range(1, max_distance + 1):
+            next_frontier = []
+            for node in frontier:
+                for neighbour in self.children[node] + [self.parents.get(node)]:
+                    if neighbour is not None and neighbour not in distances:
+                        distances[neighbour] = distance
+                        next_frontier.append(neighbour)
+            frontier = next_frontier
+        return distances
+
+
+def copurchase_counts(product_ids):
+    """Return ``{product_id: {other_id: orders}}`` for products bought together"""
+    from apps.orders.models import Order, OrderItem
+
+    item_table = OrderItem._meta.db_table
+    order_table = Order._meta.db_table
+    placeholders = ', '.join(['%s'] * len(product_ids))
+    counts = defaultdict(dict)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'SELECT a.product_id, b.product_id, COUNT(DISTINCT a.order_id) '
+            f'FROM {item_table} a '
+            f'JOIN {item_table} b ON b.order_id = a.order_id AND b.product_id <> a.product_id '
+            f'JOIN {order_table} o ON o.id = a.order_id '
+            f"WHERE a.product_id IN ({placeholders}) AND o.status <> 'cancelled' "
+            f'GROUP BY a.product_id, b.product_id',
+            list(product_ids)
+        )
+        for product_id, other_id, orders in cursor.fetchall():
+            counts[product_id][other_id] = orders
+    return counts
+
+
+def score_candidates(product, candidates, copurchases, distances):
+    """
+    Return ``[(score, candidate_id)]`` best first, for ``candidates``
+    ``{id: (category_id, views)}``.
+    """
+    max_orders = max(copurchases.values(), default=0)
+    max_views = max((views for category_id, views in candidates.values()), default=0)
+    scored = []
+    for candidate_id, (category_id, views) in candidates.items():
+        if candidate_id == product.id:
+            continue
+        distance = distances.get(category_id)
+        score = (
+            COPURCHASE_WEIGHT * (copurchases.get(candidate_id, 0) / max_orders if max_orders else 0)
+            + CATEGORY_WEIGHT * (1 / (1 + distance) if distance is not None else 0)
+            + POPULARITY_WEIGHT * (math.log1p(views) / math.log1p(max_views) if max_views else 0)
+        )
+        scored.append((score, candidate_id))
+    scored.sort(key=lambda item: (-item[0], item[1]))
+    return scored
+
+
+def refresh_related_products(product_ids, tree=None):
+    """Recompute and store the related products of ``product_ids``; returns how many were refreshed"""
+    products = list(Product.objects.filter(id__in=product_ids).only('id', 'category_id'))
+    if not products:
+        return 0
+    tree = tree or CategoryTree()
+    distances = {product.id: tree.neighbours(product.category_id) for product in products}
+    copurchases = copurchase_counts([product.id for product in products])
+
+    # The most viewed products of every nearby category, then anything bought together
+    categories = set().union(*distances.values())
+    candidates = {
+        pk: (category_id, views)
+        for pk, category_id, views in Product.objects.filter(category_id__in=categories)
+        .annotate(position=Window(RowNumber(), partition_by=F('category_id'), order_by=[F('views').desc(), F('id').desc()]))
+        .filter(position__lte=CANDIDATES_PER_CATEGORY)
+        .values_list('id', 'category_id', 'views')
+    }
+    bought_with = set().union(*(counts.keys() for counts in copurchases.values())) - candidates.keys()
+    if bought_with:
+        candidates.update(
+            (pk, (category_id, views))
+            for pk, category_id, views in Product.objects.filter(id__in=bought_with).values_list('id', 'category_id', 'views')
+        )
+
+    rows = []
+    for product in products:
+        own_candidates = {
+            pk: value for pk, value in candidates.items()
+            if value[0] in distances[product.id] or pk in copurchases[product.id]
+        }
+        scored = score_candidates(product, own_candidates, copurchases[product.id], distances[product.id])
+        rows += [
+            RelatedProduct(product_id=product.id, related_id=candidate_id, rank=rank, score=score)
+            for rank, (score, candidate_id) in enumerate(scored[:RELATED_PRODUCTS_STORED])
+        ]
+
+    refreshed_ids = [product.id for product in products]
+    with transaction.atomic():
+        RelatedProduct.objects.filter(product_id__in=refreshed_ids).delete()
+        RelatedProduct.objects.bulk_create(rows)
+        Product.objects.filter(id__in=refreshed_ids).update(related_refreshed_at=timezone.now())
+    return len(products)
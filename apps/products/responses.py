@@ -0,0 +1,86 @@
+"""
+Response cache tags for the product and category API.
+
+* ``product:<id>``: a product's own fields; product pages and every list
+  page showing it carry it.
+* ``product-list``: which products a list page shows; changes when a
+  product is created, deleted or moved to another category.
+* ``category:<id>``: a category's fields, children and ancestry. Products
+  carry the tag of their category, whose name and path they show. A
+  category change invalidates every category of the trees it was and is
+  in, by MPTT ``tree_id``.
+* ``category-stats:<id>``: the average price a category shows, changed by
+  products anywhere below it.
+* ``category-list``: which categories the category list shows.
+
+Stock reservations update products without signals and call
+invalidate_products themselves.
+"""
+from savannah_ecommerce.response_cache import invalidate_tags
+
+from .models import Category
+
+
+def _records(data):
+    """The serialized objects of a list (paginated or not) or detail response"""
+    if isinstance(data, dict):
+        return data['results'] if 'results' in data else [data]
+    return data
+
+
+def product_tags(data, listing=False):
+    tags = {'product-list'} if listing else set()
+    for product in _records(data):
+        tags |= {f"product:{product['id']}", f"category:{product['category']}"}
+    return tags
+
+
+def category_tags(data, listing=False):
+    tags = {'category-list'} if listing else set()
+    stack = list(_records(data))
+    while stack:
+        category = stack.pop()
+        tags |= {f"category:{category['id']}", f"category-stats:{category['id']}"}
+        stack += category.get('children', [])
+    return tags
+
+
+def invalidate_products(product_ids):
+    invalidate_tags([f'product:{product_id}' for product_id in product_ids])
+
+
+def remember_category_tree(sender, instance, **kwargs):
+    """post_init receiver noting the tree a category was loaded in"""
+    if 'tree_id' in instance.__dict__:
+        instance._loaded_tree_id = instance.tree_id
+
+
+def _product_changed(instance, listing):
+    category_ids = {instance.category_id, getattr(instance, '_loaded_category_id', None)} - {None}
+    tags = {f'product:{instance.pk}'}
+    if listing or len(category_ids) > 1:
+        tags.add('product-list')
+    ancestors = Category.objects.filter(id__in=category_ids).get_ancestors(include_self=True).values_list('id', flat=True)
+    invalidate_tags(tags | {f'category-stats:{category_id}' for category_id in ancestors})
+
+
+def product_saved(sender, instance, created, **kwargs):
+    """post_save receiver for Product"""
+    _product_changed(instance, listing=created)
+
+
+def product_deleted(sender, instance, **kwargs):
+    """post_delete receiver for Product"""
+    _product_changed(instance, listing=True)
+
+
+def category_changed(sender, instance, **kwargs):
+    """post_save/post_delete/node_moved receiver for Category"""
+    tree_ids = {instance.tree_id, getattr(instance, '_loaded_tree_id', None)} - {None}
+    category_ids = set(Category.objects.filter(tree_id__in=tree_ids).values_list('id', flat=True)) | {instance.pk}
+    invalidate_tags(
+        {'category-list'}
+        | {f'category:{category_id}' for category_id in category_ids}
+        | {f'category-stats:{category_id}' for category_id in category_ids}
+    )
+    instance._loaded_tree_id = instance.tree_id
@@ -0,0 +1,47 @@
+"""
+Product catalog search.
+
+On PostgreSQL products are matched against ``Product.search_vector``, a
+tsvector of the name (weight A) and description (weight B) maintained by a
+trigger and GIN indexed, so a search is an index lookup instead of an
+``ILIKE '%q%'`` scan. Every term is matched as a prefix, which keeps
+results useful while the user is still typing. Other databases fall back to
+``icontains``.
+"""
+import re
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db import connection
+from django.db.models import F, Q
+
+# Must match the configuration used by the trigger in migration 0004
+SEARCH_CONFIG = 'english'
+
+TERM_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def build_search_query(text):
+    """Return a prefix-matching SearchQuery for ``text``, or None if it has no terms"""
+    terms = TERM_RE.findall(text)
+    if not terms:
+        return None
+    return SearchQuery(' & '.join(f'{term}:*' for term in terms), search_type='raw', config=SEARCH_CONFIG)
+
+
+def search_products(queryset, text):
+    """
+    Filter ``queryset`` to products matching ``text``, best matches first.
+
+    On PostgreSQL the results are annotated with ``rank`` and ordered by it;
+    callers that sort differently can order_by() again.
+    """
+    if connection.vendor != 'postgresql':
+        return queryset.filter(Q(name__icontains=text) | Q(description__icontains=text))
+
+    query = build_search_query(text)
+    if query is None:
+        return queryset.none()
+    return (
+        queryset.filter(search_vector=query)
+        .annotate(rank=SearchRank(F('search_vector'), query))
+        .order_by('-rank', '-created_at')
+    )
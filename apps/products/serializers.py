@@ -14,13 +14,25 @@ class CategorySerializer(serializers.ModelSerializer):
 
     def get_children(self, obj):
         children = obj.get_children()
-        return CategorySerializer(children, many=True).data
+        return CategorySerializer(children, many=True, context=self.context).data
 
     def get_average_price(self, obj):
+        # Fetched for every category shown at once by CategoryViewSet
+        stats = self.context.get('category_stats', {})
+        if obj.pk in stats:
+            return stats[obj.pk]['average_price']
         return obj.get_average_price()
 
+class CategoryNodeSerializer(serializers.ModelSerializer):
+    """A category's own fields, for the nested tree assembled in tree.py"""
+
+    class Meta:
+        model = Category
+        fields = ['id', 'name', 'slug', 'parent', 'description', 'created_at', 'updated_at']
+
 class ProductSerializer(serializers.ModelSerializer):
-    category_name = serializers.CharField(source='category.name', read_only=True)
+    # Both resolved from the process-level map in paths.py, without loading the category
+    category_name = serializers.CharField(source='get_category_name', read_only=True)
     category_path = serializers.CharField(source='get_category_path', read_only=True)
 
     class Meta:
@@ -28,3 +40,5 @@ class ProductSerializer(serializers.ModelSerializer):
         fields = ['id', 'name', 'description', 'price', 'category', 'category_name',
                  'category_path', 'stock', 'created_at', 'updated_at', 'image']
         read_only_fields = ['category_name', 'category_path', 'created_at', 'updated_at']
+        # Columns read when serializing, see savannah_ecommerce/shaping.py
+        only = ['id', 'name', 'description', 'price', 'category', 'stock', 'created_at', 'updated_at', 'image']
@@ -0,0 +1,125 @@
+"""
+Category price statistics.
+
+The product count and average, minimum and maximum price of a category's
+whole subtree come from one aggregate query that joins each category to the
+categories inside its MPTT ``lft``/``rght`` range, instead of loading every
+product into Python. Results are cached per category for CATEGORY_STATS_TTL
+seconds.
+
+Saving or deleting a product drops the cached stats of its category and that
+category's ancestors (the old ones too if it changed category). Saving or
+deleting a category drops them all, since a move can reshape several
+subtrees. Bulk ``update()`` calls send no signals; the TTL bounds how long
+they can go unnoticed.
+"""
+from decimal import Decimal
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+
+from .models import Category, Product
+
+PRICE_QUANTUM = Decimal('0.01')
+
+
+def _key(category_id):
+    return f'category:stats:{category_id}'
+
+
+def _price(value):
+    return Decimal(value).quantize(PRICE_QUANTUM) if value is not None else None
+
+
+def compute_category_stats(category_ids):
+    """Return ``{category_id: stats}`` for ``category_ids``, in a single query"""
+    category_table = Category._meta.db_table
+    product_table = Product._meta.db_table
+    placeholders = ', '.join(['%s'] * len(category_ids))
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'SELECT c.id, COUNT(p.id), AVG(p.price), MIN(p.price), MAX(p.price) '
+            f'FROM {category_table} c '
+            f'JOIN {category_table} d ON d.tree_id = c.tree_id AND d.lft BETWEEN c.lft AND c.rght '
+            f'LEFT JOIN {product_table} p ON p.category_id = d.id '
+            f'WHERE c.id IN ({placeholders}) '
+            f'GROUP BY c.id',
+            list(category_ids)
+        )
+        return {
+            category_id: {
+                'product_count': count,
+                'average_price': _price(average) if count else Decimal('0.00'),
+                'min_price': _price(minimum),
+                'max_price': _price(maximum),
+            }
+            for category_id, count, average, minimum, maximum in cursor.fetchall()
+        }
+
+
+def get_category_stats(category_ids):
+    """Return ``{category_id: stats}``, computing the ones missing from the cache together"""
+    keys = {_key(category_id): category_id for category_id in category_ids}
+    stats = {keys[key]: value for key, value in cache.get_many(keys).items()}
+    missing = [category_id for category_id in category_ids if category_id not in stats]
+    if missing:
+        computed = compute_category_stats(missing)
+        cache.set_many(
+            {_key(category_id): value for category_id, value in computed.items()},
+            getattr(settings, 'CATEGORY_STATS_TTL', 600)
+        )
+        stats.update(computed)
+    return stats
+
+
+def category_stats(category):
+    """
+    Return ``{'product_count', 'average_price', 'min_price', 'max_price'}``
+    for ``category`` and its descendants. Prices are None for an empty
+    subtree, except the average, which is 0.00.
+    """
+    return get_category_stats([category.pk])[category.pk]
+
+
+def invalidate_category_stats(category_ids):
+    """
+    Drop the cached stats of ``category_ids`` and their ancestors, right
+    away and again once the surrounding transaction commits.
+    """
+    ids = set(
+        Category.objects.filter(id__in=category_ids)
+        .get_ancestors(include_self=True)
+        .values_list('id', flat=True)
+    )
+    _delete(ids)
+
+
+def invalidate_all_category_stats():
+    _delete(Category.objects.values_list('id', flat=True))
+
+
+def _delete(category_ids):
+    keys = [_key(category_id) for category_id in category_ids]
+    if keys:
+        cache.delete_many(keys)
+        transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+def remember_product_category(sender, instance, **kwargs):
+    """post_init receiver noting the category a product was loaded with"""
+    # A deferred category_id would cost a query per instance
+    if 'category_id' in instance.__dict__:
+        instance._loaded_category_id = instance.category_id
+
+
+def product_changed(sender, instance, **kwargs):
+    """post_save/post_delete receiver for Product"""
+    ids = {instance.category_id, getattr(instance, '_loaded_category_id', None)} - {None}
+    if ids:
+        invalidate_category_stats(ids)
+    instance._loaded_category_id = instance.category_id
+
+
+def category_changed(sender, instance, **kwargs):
+    """post_save/post_delete receiver for Category"""
+    invalidate_all_category_stats()
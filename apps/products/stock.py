@@ -0,0 +1,77 @@
+"""
+Stock reservation for checkout.
+
+Stock is taken with conditional ``UPDATE ... SET stock = stock - n WHERE
+stock >= n`` statements rather than ``select_for_update`` plus a read and a
+write. Each UPDATE still locks its product row until the enclosing
+transaction commits, which for checkout is the whole of
+Order.create_order_from_cart, so buyers of the same product wait for each
+other's order to be written. All lines of an order are reserved in ascending
+product id order, which gives every checkout the same lock order and rules
+out deadlocks.
+
+Reserving and releasing also set ``updated_at``, which validates product
+API responses (see savannah_ecommerce/conditional.py).
+"""
+from collections import namedtuple, OrderedDict
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from .models import Product
+from .responses import invalidate_products
+
+StockShortage = namedtuple('StockShortage', ['product_id', 'requested', 'available'])
+
+
+class InsufficientStock(Exception):
+    """Raised when one or more lines of an order cannot be reserved"""
+
+    def __init__(self, shortages):
+        self.shortages = shortages
+        super().__init__(
+            'Insufficient stock for product(s): '
+            + ', '.join(str(shortage.product_id) for shortage in shortages)
+        )
+
+
+def _merge_lines(lines):
+    """Sum quantities per product and return them in lock (product id) order"""
+    quantities = {}
+    for product_id, quantity in lines:
+        quantities[product_id] = quantities.get(product_id, 0) + quantity
+    return OrderedDict(sorted(quantities.items()))
+
+
+def reserve_stock(lines):
+    """
+    Decrement stock for ``(product_id, quantity)`` lines.
+
+    Either every line is reserved or none is: if any product is short the
+    decrements already made are rolled back and InsufficientStock is raised
+    with one StockShortage per failing line.
+    """
+    quantities = _merge_lines(lines)
+    now = timezone.now()
+    with transaction.atomic():
+        short = [
+            product_id for product_id, quantity in quantities.items()
+            if not Product.objects.filter(pk=product_id, stock__gte=quantity).update(stock=F('stock') - quantity, updated_at=now)
+        ]
+        if short:
+            available = dict(Product.objects.filter(pk__in=short).values_list('id', 'stock'))
+            raise InsufficientStock([
+                StockShortage(product_id, quantities[product_id], available.get(product_id, 0))
+                for product_id in short
+            ])
+    # The UPDATEs send no signals
+    invalidate_products(quantities)
+
+
+def release_stock(lines):
+    """Return previously reserved ``(product_id, quantity)`` lines to stock"""
+    quantities = _merge_lines(lines)
+    now = timezone.now()
+    with transaction.atomic():
+        for product_id, quantity in quantities.items():
+            Product.objects.filter(pk=product_id).update(stock=F('stock') + quantity, updated_at=now)
+    invalidate_products(quantities)
@@ -1,9 +1,36 @@
-from django.test import TestCase
+import threading
+import unittest
+from collections import Counter
+from io import StringIO
+from django.test import TestCase, SimpleTestCase
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
 from rest_framework.test import APIClient
 from rest_framework import status
 from .models import Product, Category
+from .search import search_products
+from . import autocomplete
+from .autocomplete import PrefixTrie
+from .views import PRODUCTS_PER_PAGE, ProductViewSet
+from . import counters
+from .counters import BufferedViewCounter, add_views
+from .related import get_related_products, refresh_related_products, stale_products
+from django.core.management import call_command
+from django.core.cache import cache
+from .stats import get_category_stats
+from .paths import CategoryPathMap
+from savannah_ecommerce.response_cache import invalidate_tags
+from .facets import ProductFilters, compute_facets, get_facets
+from django.http import QueryDict
+from django.core.management.base import CommandError
+from .management.commands.index_advisor import find_seq_scans
+from .stock import reserve_stock
 from decimal import Decimal
 from django.utils.text import slugify
+from tests.utils import QueryCountMixin
+from unittest.mock import patch
 
 # Create your tests here.
 
@@ -104,8 +131,9 @@ class ProductModelTests(TestCase):
         self.assertEqual(product.rating, Decimal('0.00')) # Assuming default is 0.00
         self.assertEqual(product.review_count, 0) # Assuming default is 0
 
-class CategoryViewSetTests(TestCase):
+class CategoryViewSetTests(QueryCountMixin, TestCase):
     def setUp(self):
+        cache.clear()
         # Clear existing data
         Category.objects.all().delete()
         Product.objects.all().delete()
@@ -129,6 +157,37 @@ class CategoryViewSetTests(TestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(response.data['name'], 'Electronics')
 
+    def before_capture(self, url):
+        invalidate_tags(['category-list', f'category:{self.parent_category.id}'])
+
+    def test_category_endpoints_use_a_fixed_number_of_queries(self):
+        urls = ['/api/categories/', f'/api/categories/{self.parent_category.slug}/']
+        few = [self.count_queries(url) for url in urls]
+        parent = self.child_category
+        for i in range(5):
+            parent = Category.objects.create(name=f'Level {i}', parent=parent)
+            Category.objects.create(name=f'Level {i} sibling', parent=parent.parent)
+        response = self.client.get(urls[1])
+        self.assertEqual(response.json()['children'][0]['children'][0]['name'], 'Level 0')
+        self.assertEqual([self.count_queries(url) for url in urls], few)
+        # The two conditional GET validators, the page (and its count) or the category, then their trees
+        self.assertEqual(few, [5, 4])
+
+    def test_average_prices_are_fetched_together(self):
+        for i in range(5):
+            Category.objects.create(name=f'Accessories {i}', parent=self.child_category)
+        get_category_stats([self.child_category.id])  # cached, the rest are not
+        # The two validators, the page and its count, the trees, then the missing stats
+        with self.assertNumQueries(6):
+            response = self.client.get('/api/categories/')
+        self.assertEqual(response.data['results'][0]['average_price'], Decimal('1000.00'))
+        self.assertEqual(response.data['results'][0]['children'][0]['average_price'], Decimal('800.00'))
+        with patch.object(cache, 'get_many', wraps=cache.get_many) as get_many:
+            invalidate_tags(['category-list'])
+            self.client.get('/api/categories/')
+        # The stale entry's tags, the new entry's tags, then the stats of every category
+        self.assertEqual(get_many.call_count, 3)
+
     def test_get_category_average_price(self):
         response = self.client.get(f'/api/categories/{self.parent_category.slug}/average_price/')
         self.assertEqual(response.status_code, status.HTTP_200_OK)
@@ -171,3 +230,752 @@ class ProductViewSetTests(TestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         # Assert against a Decimal value, matching the expected return type
         self.assertEqual(response.data['average_price'], Decimal('10.00'))
+
+class ProductSearchTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.category = Category.objects.create(name='Computers')
+        self.laptop = Product.objects.create(name='Gaming Laptop', description='Fast machine', price=Decimal('1500.00'), category=self.category)
+        self.bag = Product.objects.create(name='Backpack', description='Fits a 15 inch laptop', price=Decimal('40.00'), category=self.category)
+        self.mouse = Product.objects.create(name='Mouse', description='Wireless', price=Decimal('20.00'), category=self.category)
+
+    def test_search_action_matches_prefixes(self):
+        response = self.client.get('/api/products/search/', {'q': 'lapt'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        ids = [product['id'] for product in response.data['results']]
+        self.assertEqual(set(ids), {self.laptop.id, self.bag.id})
+        if connection.vendor == 'postgresql':
+            # Name matches rank above description matches
+            self.assertEqual(ids, [self.laptop.id, self.bag.id])
+
+    def test_search_action_requires_query(self):
+        response = self.client.get('/api/products/search/')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_product_list_uses_search(self):
+        user = get_user_model().objects.create_user(username='shopper', password='password')
+        self.client.force_login(user)
+        response = self.client.get(reverse('products:product_list'), {'search': 'wireless'})
+        self.assertEqual(list(response.context['products']), [self.mouse])
+
+    @unittest.skipUnless(connection.vendor == 'postgresql', 'Search vectors are maintained by a PostgreSQL trigger')
+    def test_search_vector_is_maintained_for_bulk_inserts_and_updates(self):
+        Product.objects.bulk_create([Product(name='Mechanical Keyboard', description='Clicky', price=Decimal('90.00'), category=self.category)])
+        self.assertEqual(list(search_products(Product.objects.all(), 'keyb').values_list('name', flat=True)), ['Mechanical Keyboard'])
+
+        Product.objects.filter(pk=self.mouse.pk).update(name='Trackball')
+        self.assertFalse(search_products(Product.objects.all(), 'mouse').exists())
+        self.assertTrue(search_products(Product.objects.all(), 'trackball').exists())
+
+class PrefixTrieTests(SimpleTestCase):
+    def setUp(self):
+        self.trie = PrefixTrie([
+            ('product', 1, 'Gaming Laptop', None),
+            ('product', 2, 'Laptop Stand', None),
+            ('product', 3, 'Wireless Mouse', None),
+            ('category', 4, 'Laptops', 'laptops'),
+        ])
+
+    def names(self, query, limit=8):
+        return [suggestion['name'] for suggestion in self.trie.suggest(query, limit)]
+
+    def test_prefix_matches_any_word(self):
+        self.assertEqual(self.names('lap'), ['Laptops', 'Laptop Stand', 'Gaming Laptop'])
+        self.assertEqual(self.names('mou'), ['Wireless Mouse'])
+
+    def test_tolerates_typos(self):
+        self.assertEqual(self.names('wireles mosue'), ['Wireless Mouse'])
+        self.assertEqual(self.names('lpatop', limit=1), ['Laptops'])
+        self.assertEqual(self.names('xyz'), [])
+
+    def test_all_words_must_match(self):
+        self.assertEqual(self.names('gaming lap'), ['Gaming Laptop'])
+        self.assertEqual(self.trie.suggest('laptops')[0], {'type': 'category', 'id': 4, 'name': 'Laptops', 'slug': 'laptops'})
+
+
+class AutocompleteViewTests(TestCase):
+    def setUp(self):
+        autocomplete._autocomplete = None
+        self.addCleanup(setattr, autocomplete, '_autocomplete', None)
+        self.category = Category.objects.create(name='Audio')
+        Product.objects.create(name='Bluetooth Speaker', description='', price=Decimal('50.00'), category=self.category)
+        Product.objects.create(name='Studio Headphones', description='', price=Decimal('80.00'), category=self.category)
+
+    def test_suggestions(self):
+        response = self.client.get(reverse('products:autocomplete'), {'q': 'speakr'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([suggestion['name'] for suggestion in response.json()['suggestions']], ['Bluetooth Speaker'])
+        self.assertIn('max-age=60', response['Cache-Control'])
+
+        response = self.client.get(reverse('products:autocomplete'), {'q': 'aud', 'limit': 1})
+        self.assertEqual(response.json()['suggestions'], [{'type': 'category', 'id': self.category.id, 'name': 'Audio', 'slug': 'audio'}])
+
+    def test_empty_query(self):
+        response = self.client.get(reverse('products:autocomplete'))
+        self.assertEqual(response.json()['suggestions'], [])
+
+    def test_trigram_threshold_is_set_with_the_query(self):
+        if not autocomplete.trigram_available():
+            self.skipTest('Needs PostgreSQL with pg_trgm')
+        engine = autocomplete.TrigramAutocomplete()
+        with self.settings(AUTOCOMPLETE_MIN_SIMILARITY=0.99):
+            self.assertEqual(engine.suggest('speakr'), [])
+        self.assertEqual([suggestion['name'] for suggestion in engine.suggest('speakr')], ['Bluetooth Speaker'])
+
+
+class KeysetPaginationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.category = Category.objects.create(name='Catalog')
+        Product.objects.bulk_create([
+            Product(name=f'Product {i}', description='', price=Decimal(i % 7), category=self.category)
+            for i in range(45)
+        ])
+        # Ties on created_at must still page in a stable order
+        Product.objects.filter(name__in=['Product 3', 'Product 4', 'Product 5']).update(
+            created_at=Product.objects.get(name='Product 6').created_at
+        )
+        self.expected = list(Product.objects.order_by('-created_at', '-id').values_list('id', flat=True))
+
+    def test_api_walks_every_product_once(self):
+        ids, url, pages = [], '/api/products/', []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertNotIn('count', response.data)
+            ids += [product['id'] for product in response.data['results']]
+            pages.append(response.data)
+            url = response.data['next']
+        self.assertEqual(ids, self.expected)
+        self.assertEqual(len(pages), 3)
+        self.assertIsNone(pages[0]['previous'])
+
+        previous = self.client.get(pages[2]['previous']).data
+        self.assertEqual(previous['results'], pages[1]['results'])
+        self.assertEqual(self.client.get(previous['previous']).data['results'], pages[0]['results'])
+
+    def test_pages_are_fetched_without_count_or_offset(self):
+        url = self.client.get('/api/products/').data['next']
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(len(response.data['results']), 20)
+        # Besides the conditional GET validators, see savannah_ecommerce/conditional.py
+        product_queries = [query['sql'] for query in queries if '"products_product"."name"' in query['sql']]
+        self.assertEqual(len(product_queries), 1)
+        self.assertNotIn('COUNT(', product_queries[0])
+        self.assertNotIn('OFFSET', product_queries[0])
+
+    def test_invalid_cursor(self):
+        response = self.client.get('/api/products/', {'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_product_list_pages_by_sort(self):
+        user = get_user_model().objects.create_user(username='shopper', password='password')
+        self.client.force_login(user)
+        url = reverse('products:product_list')
+
+        response = self.client.get(url, {'sort': 'price_asc'})
+        first = response.context['products']
+        self.assertEqual(len(first), PRODUCTS_PER_PAGE)
+        self.assertFalse(first.has_previous)
+        self.assertIn('sort=price_asc', first.next_url)
+
+        second = self.client.get(url + first.next_url).context['products']
+        self.assertFalse(second.has_next)
+        prices = [(product.price, product.id) for product in list(first) + list(second)]
+        self.assertEqual(prices, sorted(prices))
+        self.assertEqual(len(prices), 45)
+
+
+class ProductViewCounterTests(TestCase):
+    def setUp(self):
+        # Separate categories, so the detail pages have no related products
+        self.speaker = Product.objects.create(name='Speaker', price=Decimal('50.00'), category=Category.objects.create(name='Speakers'))
+        self.headphones = Product.objects.create(name='Headphones', price=Decimal('80.00'), category=Category.objects.create(name='Headphones'))
+        self.counter = BufferedViewCounter(flush_interval=3600, max_pending=100)
+        counters._counter = self.counter
+        self.addCleanup(setattr, counters, '_counter', None)
+
+    def test_add_views_is_one_update_per_batch(self):
+        updated_at = self.speaker.updated_at
+        with self.assertNumQueries(1):
+            add_views({self.speaker.id: 3, self.headphones.id: 1})
+        with self.assertNumQueries(2):
+            add_views({self.speaker.id: 1, self.headphones.id: 1}, batch_size=1)
+        self.speaker.refresh_from_db()
+        self.headphones.refresh_from_db()
+        self.assertEqual((self.speaker.views, self.headphones.views), (4, 2))
+        self.assertEqual(self.speaker.updated_at, updated_at)
+
+    def test_detail_views_are_buffered_until_flush(self):
+        user = get_user_model().objects.create_user(username='shopper', password='password')
+        self.client.force_login(user)
+        for _ in range(3):
+            self.assertEqual(self.client.get(reverse('products:detail', args=[self.headphones.id])).status_code, 200)
+        self.client.get(reverse('products:detail', args=[self.speaker.id]))
+        self.headphones.refresh_from_db()
+        self.assertEqual(self.headphones.views, 0)
+
+        self.assertEqual(self.counter.flush(), 2)
+        self.assertEqual(self.counter.flush(), 0)
+        self.headphones.refresh_from_db()
+        self.assertEqual(self.headphones.views, 3)
+
+        response = self.client.get(reverse('products:product_list'), {'sort': 'popular'})
+        self.assertEqual(list(response.context['products']), [self.headphones, self.speaker])
+
+    def test_flushes_when_buffer_is_full(self):
+        counter = BufferedViewCounter(flush_interval=3600, max_pending=2)
+        counter.record(self.speaker.id)
+        counter.record(self.speaker.id)
+        with self.assertNumQueries(1):
+            counter.record(self.headphones.id)
+        self.speaker.refresh_from_db()
+        self.assertEqual(self.speaker.views, 2)
+
+
+    def test_idle_processes_flush_on_a_timer(self):
+        flushed = threading.Event()
+        counter = BufferedViewCounter(flush_interval=0.05, max_pending=100)
+        with patch.object(counters, 'add_views', side_effect=lambda counts: flushed.set()) as add:
+            counter.record(self.speaker.id)
+            self.assertTrue(flushed.wait(5))
+        add.assert_called_once_with(Counter({self.speaker.id: 1}))
+
+
+class RelatedProductsTests(TestCase):
+    def setUp(self):
+        from apps.orders.models import Order, OrderItem
+        self.Order, self.OrderItem = Order, OrderItem
+        self.user = get_user_model().objects.create_user(username='shopper', password='password')
+
+        electronics = Category.objects.create(name='Electronics')
+        phones = Category.objects.create(name='Phones', parent=electronics)
+        laptops = Category.objects.create(name='Laptops', parent=electronics)
+        smartphones = Category.objects.create(name='Smartphones', parent=phones)
+        kitchen = Category.objects.create(name='Kitchen')
+
+        def product(name, category):
+            return Product.objects.create(name=name, description='', price=Decimal('10.00'), category=category)
+        self.phone = product('Feature Phone', phones)
+        self.other_phone = product('Flip Phone', phones)
+        self.laptop = product('Laptop', laptops)
+        self.smartphone = product('Smartphone', smartphones)
+        self.kettle = product('Kettle', kitchen)
+        self.toaster = product('Toaster', kitchen)
+
+    def order(self, *products, status='pending'):
+        order = self.Order.objects.create(user=self.user, status=status)
+        for product in products:
+            self.OrderItem.objects.create(order=order, product=product, quantity=1, price=product.price)
+        return order
+
+    def test_ranks_copurchases_then_category_proximity(self):
+        self.order(self.phone, self.kettle)
+        self.order(self.phone, self.toaster, status='cancelled')
+        refresh_related_products([self.phone.id])
+
+        self.phone.refresh_from_db()
+        with self.assertNumQueries(1):
+            related = get_related_products(self.phone, limit=5)
+        self.assertEqual(related, [self.kettle, self.other_phone, self.smartphone, self.laptop])
+
+    def test_refresh_is_incremental(self):
+        call_command('refresh_related_products', '--all', stdout=StringIO())
+        self.assertFalse(stale_products().exists())
+
+        self.order(self.laptop, self.toaster)
+        self.assertEqual(set(stale_products()), {self.laptop, self.toaster})
+        self.assertEqual(refresh_related_products(list(stale_products().values_list('id', flat=True))), 2)
+        self.assertFalse(stale_products().exists())
+        self.laptop.refresh_from_db()
+        self.assertEqual(get_related_products(self.laptop, limit=1), [self.toaster])
+
+    def test_detail_page_before_first_refresh(self):
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('products:detail', args=[self.phone.id]))
+        self.assertEqual(list(response.context['related_products']), [self.other_phone])
+
+
+class CategoryStatsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.electronics = Category.objects.create(name='Electronics')
+        self.phones = Category.objects.create(name='Phones', parent=self.electronics)
+        self.laptops = Category.objects.create(name='Laptops', parent=self.electronics)
+        self.phone = Product.objects.create(name='Phone', price=Decimal('300.00'), category=self.phones)
+        Product.objects.create(name='Smartphone', price=Decimal('1000.00'), category=self.phones)
+        Product.objects.create(name='Laptop', price=Decimal('2000.00'), category=self.laptops)
+
+    def test_subtree_stats_in_one_query_then_cached(self):
+        empty = Category.objects.create(name='Empty')
+        ids = [self.electronics.id, self.phones.id, empty.id]
+        with self.assertNumQueries(1):
+            stats = get_category_stats(ids)
+        self.assertEqual(stats[self.electronics.id], {
+            'product_count': 3, 'average_price': Decimal('1100.00'),
+            'min_price': Decimal('300.00'), 'max_price': Decimal('2000.00'),
+        })
+        self.assertEqual(stats[self.phones.id]['average_price'], Decimal('650.00'))
+        self.assertEqual(stats[empty.id], {'product_count': 0, 'average_price': Decimal('0.00'), 'min_price': None, 'max_price': None})
+        with self.assertNumQueries(0):
+            self.assertEqual(get_category_stats(ids), stats)
+
+    def test_product_changes_invalidate_the_subtree(self):
+        self.electronics.get_stats()
+        self.laptops.get_stats()
+
+        Product.objects.create(name='Tablet', price=Decimal('500.00'), category=self.phones)
+        self.assertEqual(self.electronics.get_stats()['product_count'], 4)
+
+        self.phone.category = self.laptops
+        self.phone.save()
+        self.assertEqual(self.laptops.get_stats()['min_price'], Decimal('300.00'))
+        self.assertEqual(self.phones.get_stats()['product_count'], 2)
+
+        self.phone.delete()
+        self.assertEqual(self.laptops.get_stats()['product_count'], 1)
+        self.assertEqual(self.electronics.get_stats()['product_count'], 3)
+
+    def test_category_moves_invalidate_stats(self):
+        self.assertEqual(self.electronics.get_stats()['product_count'], 3)
+        self.laptops.parent = None
+        self.laptops.save()
+        self.electronics.refresh_from_db()
+        self.assertEqual(self.electronics.get_stats()['product_count'], 2)
+
+    def test_stats_action(self):
+        response = APIClient().get(f'/api/categories/{self.electronics.slug}/stats/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['product_count'], 3)
+        self.assertEqual(response.data['max_price'], Decimal('2000.00'))
+
+
+class CategoryTreeTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.electronics = Category.objects.create(name='Electronics')
+        self.phones = Category.objects.create(name='Phones', parent=self.electronics)
+        self.smartphones = Category.objects.create(name='Smartphones', parent=self.phones)
+        self.laptops = Category.objects.create(name='Laptops', parent=self.electronics)
+        self.books = Category.objects.create(name='Books')
+
+    def names(self, nodes):
+        return [(node['name'], self.names(node['children'])) for node in nodes]
+
+    def test_tree_is_one_query_then_cached(self):
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/categories/tree/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.names(response.data), [
+            ('Books', []),
+            ('Electronics', [('Laptops', []), ('Phones', [('Smartphones', [])])]),
+        ])
+        phones = response.data[1]['children'][1]
+        self.assertEqual((phones['slug'], phones['parent'], phones['parent_name']), ('phones', self.electronics.id, 'Electronics'))
+
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get('/api/categories/tree/').data, response.data)
+
+    def test_tree_is_rebuilt_after_saves_and_moves(self):
+        self.client.get('/api/categories/tree/')
+        self.books.name = 'Novels'
+        self.books.save()
+        self.assertEqual(self.client.get('/api/categories/tree/').data[1]['name'], 'Novels')
+
+        Category.objects.get(pk=self.smartphones.pk).move_to(Category.objects.get(pk=self.books.pk))
+        self.assertEqual(self.names(self.client.get('/api/categories/tree/').data)[1], ('Novels', [('Smartphones', [])]))
+
+
+class CategoryPathTests(TestCase):
+    def setUp(self):
+        electronics = Category.objects.create(name='Electronics')
+        self.phones = Category.objects.create(name='Phones', parent=electronics)
+        for i in range(5):
+            Product.objects.create(name=f'Phone {i}', price=Decimal('10.00'), category=self.phones)
+
+    def test_product_list_resolves_paths_without_queries(self):
+        Product.objects.first().get_category_path()  # builds this process's map
+        # The two conditional GET validators, then the page
+        with self.assertNumQueries(3):
+            response = APIClient().get('/api/products/')
+        self.assertEqual(
+            {(product['category_name'], product['category_path']) for product in response.data['results']},
+            {('Phones', 'Electronics > Phones')}
+        )
+
+    def test_other_processes_rebuild_after_a_change(self):
+        other_process = CategoryPathMap(check_interval=0)
+        throttled = CategoryPathMap(check_interval=3600)
+        self.assertEqual(other_process.get(self.phones.id), ('Phones', 'Electronics > Phones'))
+        throttled.get(self.phones.id)
+
+        self.phones.name = 'Mobile'
+        self.phones.save()
+        with self.assertNumQueries(1):
+            self.assertEqual(other_process.get(self.phones.id), ('Mobile', 'Electronics > Mobile'))
+        self.assertEqual(throttled.get(self.phones.id)[0], 'Phones')
+
+
+class QuerysetShapingTests(QueryCountMixin, TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.category = Category.objects.create(name='Phones')
+
+    def add_products(self, count):
+        Product.objects.bulk_create([
+            Product(name=f'Phone {i}', description='', price=Decimal('10.00'), category=self.category)
+            for i in range(count)
+        ])
+
+    def before_capture(self, url):
+        invalidate_tags(['product-list'])  # bulk_create sends no signals
+
+    def test_product_endpoints_use_a_fixed_number_of_queries(self):
+        urls = ['/api/products/', f'/api/categories/{self.category.slug}/products/']
+        self.add_products(2)
+        few = [self.count_queries(url) for url in urls]
+        self.add_products(30)
+        self.assertEqual([self.count_queries(url) for url in urls], few)
+        # Each after the two conditional GET validator aggregates
+        self.assertEqual(few, [3, 4])
+
+    def test_products_are_loaded_without_unused_columns(self):
+        self.add_products(1)
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get('/api/products/')
+        page = next(query['sql'] for query in queries if '"products_product"."name"' in query['sql'])
+        self.assertNotIn('search_vector', page)
+        self.assertNotIn('related_refreshed_at', page)
+
+
+class ProductFacetTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        electronics = Category.objects.create(name='Electronics')
+        self.phones = Category.objects.create(name='Phones', parent=electronics)
+        self.laptops = Category.objects.create(name='Laptops', parent=electronics)
+        self.books = Category.objects.create(name='Books')
+        for name, price, rating, category in [
+            ('Budget Phone', '800.00', '3.5', self.phones),
+            ('Flagship Phone', '60000.00', '4.8', self.phones),
+            ('Ultrabook', '45000.00', '4.2', self.laptops),
+            ('Novel', '999.99', '2.0', self.books),
+            ('Atlas', '1000.00', '4.0', self.books),
+        ]:
+            Product.objects.create(name=name, price=Decimal(price), rating=Decimal(rating), category=category)
+        self.user = get_user_model().objects.create_user(username='shopper', password='password')
+        self.client.force_login(self.user)
+
+    def filters(self, query):
+        return ProductFilters.from_query(QueryDict(query))
+
+    def names(self, filters):
+        return sorted(filters.apply(Product.objects.all()).values_list('name', flat=True))
+
+    def test_categories_match_their_subtrees(self):
+        electronics = self.phones.parent_id
+        self.assertEqual(self.names(self.filters(f'category={electronics}')), ['Budget Phone', 'Flagship Phone', 'Ultrabook'])
+        self.assertEqual(
+            self.names(self.filters(f'category={self.laptops.id}&category={self.books.id}&rating=4')),
+            ['Atlas', 'Ultrabook']
+        )
+        self.assertEqual(self.names(self.filters('category=x&min_price=abc&max_price=1000')), ['Atlas', 'Budget Phone', 'Novel'])
+
+    def test_facets_are_counted_without_their_own_filter(self):
+        filters = self.filters(f'category={self.phones.id}&rating=4')
+        filters.condition()  # caches the category tree
+        with self.assertNumQueries(2):
+            facets = compute_facets(Product.objects.all(), filters)
+
+        # Categories: rated 4+ anywhere, rolled up to the parents
+        counts = {entry['name']: entry['count'] for entry in facets['categories']}
+        self.assertEqual(counts, {'Electronics': 2, 'Phones': 1, 'Laptops': 1, 'Books': 1})
+        self.assertEqual([entry['name'] for entry in facets['categories'] if entry['selected']], ['Phones'])
+        # Prices: phones rated 4+; ratings: any phone
+        self.assertEqual([bucket['count'] for bucket in facets['price']], [0, 0, 0, 0, 1])
+        self.assertEqual([(bucket['min'], bucket['count']) for bucket in facets['rating']], [(4, 1), (3, 2), (2, 2), (1, 2)])
+
+    def test_price_buckets_select_their_range(self):
+        facets = compute_facets(Product.objects.all(), ProductFilters())
+        self.assertEqual([bucket['count'] for bucket in facets['price']], [2, 1, 0, 1, 1])
+        first = facets['price'][0]
+        filters = self.filters(f'max_price={first["max"]}')
+        self.assertEqual(self.names(filters), ['Budget Phone', 'Novel'])
+        self.assertTrue(compute_facets(Product.objects.all(), filters)['price'][0]['selected'])
+
+    def test_facets_are_cached_until_a_product_changes(self):
+        filters = ProductFilters()
+        get_facets(Product.objects.all(), filters)
+        with self.assertNumQueries(0):
+            get_facets(Product.objects.all(), filters)
+
+        Product.objects.create(name='Tablet', price=Decimal('30000.00'), category=self.phones)
+        counts = {entry['name']: entry['count'] for entry in get_facets(Product.objects.all(), filters)['categories']}
+        self.assertEqual(counts['Electronics'], 4)
+
+    def test_product_list_applies_facets(self):
+        response = self.client.get(
+            reverse('products:product_list'),
+            {'category': [self.phones.id, self.books.id], 'rating': 4, 'sort': 'price_asc'}
+        )
+        self.assertEqual([product.name for product in response.context['products']], ['Atlas', 'Flagship Phone'])
+        self.assertContains(response, f'value="{self.books.id}"\n                                    checked')
+        self.assertIn('rating=4', response.context['price_query'])
+        self.assertNotIn('sort=', response.context['sort_query'])
+
+
+class TemplateFragmentTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.category = Category.objects.create(name='Phones')
+        self.product = Product.objects.create(name='Budget Phone', price=Decimal('800.00'), stock=3, category=self.category)
+        self.user = get_user_model().objects.create_user(username='shopper', password='password')
+        self.client.force_login(self.user)
+
+    def test_product_card_follows_updated_at(self):
+        self.client.get(reverse('products:product_list'))
+        # A queryset update leaves updated_at alone, so the cached card is served
+        Product.objects.filter(pk=self.product.pk).update(name='Renamed Phone', stock=0)
+        response = self.client.get(reverse('products:product_list'))
+        self.assertContains(response, 'Budget Phone')
+        self.assertContains(response, 'Out of Stock')
+
+        product = Product.objects.get(pk=self.product.pk)
+        product.save()
+        self.assertContains(self.client.get(reverse('products:product_list')), 'Renamed Phone')
+
+    def test_cached_sidebar_skips_facets(self):
+        self.client.get(reverse('products:product_list'))
+        with patch('apps.products.views.get_facets') as get_facets_mock:
+            response = self.client.get(reverse('products:product_list'))
+            self.assertContains(response, 'Phones')
+            get_facets_mock.assert_not_called()
+
+            Category.objects.create(name='Tablets')
+            self.client.get(reverse('products:product_list'))
+            get_facets_mock.assert_called_once()
+
+
+@unittest.skipUnless(connection.vendor == 'postgresql', 'EXPLAIN (ANALYZE, BUFFERS) needs PostgreSQL')
+class IndexAdvisorTests(TestCase):
+    def setUp(self):
+        from apps.cart.models import Cart
+        from apps.orders.models import Order
+
+        user = get_user_model().objects.create_user(username='shopper', password='password')
+        category = Category.objects.create(name='Phones')
+        products = [
+            Product.objects.create(name=f'Phone {i}', price=Decimal('1500.00'), rating=Decimal('4.5'), stock=10, category=category)
+            for i in range(3)
+        ]
+        cart = Cart.objects.create(user=user)
+        cart.add_item(products[0], 1)
+        cart.add_item(products[1], 1)
+        Order.create_order_from_cart(cart)
+        cart.add_item(products[2], 1)
+
+    def test_every_catalogue_query_has_an_index(self):
+        out = StringIO()
+        call_command('index_advisor', '--force-index', stdout=out)
+        self.assertNotIn('skipped', out.getvalue())
+        self.assertNotIn('seq scan', out.getvalue())
+
+    def test_sequential_scans_fail_the_check(self):
+        plan = {'Node Type': 'Nested Loop', 'Plans': [
+            {'Node Type': 'Index Scan', 'Relation Name': 'orders_order'},
+            {'Node Type': 'Hash', 'Plans': [{'Node Type': 'Seq Scan', 'Relation Name': 'orders_orderitem'}]},
+        ]}
+        self.assertEqual(find_seq_scans(plan), ['orders_orderitem'])
+
+        with connection.cursor() as cursor:
+            cursor.execute('DROP INDEX orders_item_product_order_idx')
+        with self.assertRaisesMessage(CommandError, 'orders of a product'):
+            call_command('index_advisor', '--force-index', stdout=StringIO())
+
+
+class ResponseCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        electronics = Category.objects.create(name='Electronics')
+        self.phones = Category.objects.create(name='Phones', parent=electronics)
+        self.books = Category.objects.create(name='Books')
+        self.phone = Product.objects.create(name='Phone', price=Decimal('100.00'), stock=5, category=self.phones)
+        self.novel = Product.objects.create(name='Novel', price=Decimal('10.00'), stock=5, category=self.books)
+
+    def get(self, url, **kwargs):
+        response = self.client.get(url, **kwargs)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.json()
+
+    def assertCached(self, url):
+        with self.assertNumQueries(0):
+            return self.get(url)
+
+    def test_responses_are_served_from_the_cache(self):
+        for url in ['/api/products/', f'/api/products/{self.phone.id}/', '/api/categories/', f'/api/categories/{self.phones.slug}/']:
+            first = self.get(url)
+            self.assertEqual(self.assertCached(url), first)
+
+    def test_keys_separate_query_scope_and_content_type(self):
+        url = f'/api/products/{self.phone.id}/'
+        self.get(url)
+        with CaptureQueriesContext(connection) as queries:
+            indented = self.client.get(url, HTTP_ACCEPT='application/json; indent=4')
+        self.assertTrue(queries)
+        self.assertIn(b'\n    "name"', indented.content)
+        self.assertEqual(self.get(url, data={'format': 'json'})['name'], 'Phone')
+        self.assertNotIn(b'\n', self.client.get(url).content)
+
+        self.client.force_authenticate(get_user_model().objects.create_user(username='shopper', password='password'))
+        with CaptureQueriesContext(connection) as queries:
+            self.get(url)
+        self.assertTrue(queries)
+        self.assertCached(url)
+
+    def test_changes_purge_only_dependent_responses(self):
+        urls = ['/api/products/', f'/api/products/{self.phone.id}/', f'/api/products/{self.novel.id}/', f'/api/categories/{self.phones.slug}/']
+        for url in urls:
+            self.get(url)
+
+        self.phone.price = Decimal('150.00')
+        self.phone.save()
+        self.assertCached(f'/api/products/{self.novel.id}/')
+        self.assertEqual(self.get(f'/api/products/{self.phone.id}/')['price'], '150.00')
+        self.assertEqual(self.get('/api/products/')['results'][1]['price'], '150.00')
+        self.assertEqual(self.get(f'/api/categories/{self.phones.slug}/')['average_price'], 150.0)
+
+        phones = Category.objects.get(pk=self.phones.pk)  # tree ids moved when Books was added
+        phones.name = 'Mobiles'
+        phones.save()
+        self.assertCached(f'/api/products/{self.novel.id}/')
+        self.assertEqual(self.get(f'/api/products/{self.phone.id}/')['category_path'], 'Electronics > Mobiles')
+
+    def test_responses_are_not_cached_from_a_stale_path_map(self):
+        url = f'/api/products/{self.phone.id}/'
+        other_process = CategoryPathMap(check_interval=3600)
+        other_process.get(self.phones.id)  # built before the rename and not due for a check
+        phones = Category.objects.get(pk=self.phones.pk)
+        phones.name = 'Mobiles'
+        phones.save()
+
+        with patch('apps.products.paths.category_paths', other_process):
+            self.assertEqual(self.get(url)['category_path'], 'Electronics > Mobiles')
+        self.assertEqual(self.assertCached(url)['category_path'], 'Electronics > Mobiles')
+
+    def test_list_membership_and_stock_reservations_purge(self):
+        self.get('/api/products/')
+        self.get(f'/api/products/{self.phone.id}/')
+        tablet = Product.objects.create(name='Tablet', price=Decimal('80.00'), category=self.phones)
+        self.assertEqual(self.get('/api/products/')['results'][0]['id'], tablet.id)
+
+        reserve_stock([(self.phone.id, 2)])
+        self.assertEqual(self.get(f'/api/products/{self.phone.id}/')['stock'], 3)
+
+    def test_write_committed_during_a_read_is_not_hidden(self):
+        url = f'/api/products/{self.phone.id}/'
+        self.get(url)  # gives the tags their versions
+        invalidate_tags([f'product:{self.phone.id}'])  # and makes the next read a miss
+        tags = ProductViewSet.response_cache_tags
+
+        def tags_after_a_write(view, data):
+            # The view has read the old price when another request commits a new one
+            Product.objects.filter(pk=self.phone.pk).update(price=Decimal('150.00'))
+            invalidate_tags([f'product:{self.phone.id}'])
+            return tags(view, data)
+
+        with patch.object(ProductViewSet, 'response_cache_tags', tags_after_a_write):
+            self.assertEqual(self.get(url)['price'], '100.00')
+        self.assertEqual(self.get(url)['price'], '150.00')
+
+
+class ConditionalGetTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        electronics = Category.objects.create(name='Electronics')
+        self.phones = Category.objects.create(name='Phones', parent=electronics)
+        self.books = Category.objects.create(name='Books')
+        self.phone = Product.objects.create(name='Phone', price=Decimal('100.00'), stock=5, category=self.phones)
+        self.novel = Product.objects.create(name='Novel', price=Decimal('10.00'), stock=5, category=self.books)
+
+    def etag(self, url, **kwargs):
+        response = self.client.get(url, **kwargs)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('Last-Modified', response)
+        return response['ETag']
+
+    def assertNotModified(self, url, etag):
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response['ETag'], etag)
+        self.assertEqual(response.content, b'')
+
+    def test_unchanged_responses_are_not_modified(self):
+        electronics = self.phones.parent.slug
+        # Uncached, only the validators are queried: one aggregate per queryset, after the
+        # category lookup for its products
+        for url, queries in [('/api/products/', 2), (f'/api/products/{self.phone.id}/', 2), ('/api/categories/', 2),
+                             (f'/api/categories/{self.phones.slug}/', 2), (f'/api/categories/{electronics}/products/', 3)]:
+            etag = self.etag(url)
+            self.assertNotModified(url, etag)
+            cache.clear()
+            with self.assertNumQueries(queries):
+                self.assertNotModified(url, etag)
+
+    def test_cached_responses_answer_without_queries(self):
+        etag = self.etag('/api/products/')
+        with self.assertNumQueries(0):
+            self.assertNotModified('/api/products/', etag)
+
+    def test_validators_follow_changes_and_deletions(self):
+        urls = ['/api/products/', f'/api/categories/{self.phones.slug}/']
+        etags = [self.etag(url) for url in urls]
+
+        self.phone.price = Decimal('150.00')
+        self.phone.save()
+        etags += [self.etag(url) for url in urls]
+        self.assertEqual(len(set(etags)), 4)
+        reserve_stock([(self.phone.id, 2)])
+        self.assertNotIn(self.etag(urls[0]), etags)
+        # Categories do not show stock; the cached response keeps its ETag
+        self.assertEqual(self.etag(urls[1]), etags[-1])
+
+        self.novel.delete()
+        self.assertNotIn(self.etag('/api/products/'), etags)
+        # Books is in another tree
+        self.assertEqual(self.etag(urls[1]), etags[-1])
+
+    def test_etags_match_the_category_paths_shown(self):
+        urls = ['/api/products/', f'/api/products/{self.phone.id}/', f'/api/categories/{self.phones.parent.slug}/products/']
+        # One per URL, each built before the rename and not due for a check
+        other_processes = [CategoryPathMap(check_interval=3600) for url in urls]
+        for other_process in other_processes:
+            other_process.get(self.phones.id)
+        phones = Category.objects.get(pk=self.phones.pk)
+        phones.name = 'Mobiles'
+        phones.save()
+
+        for url, other_process in zip(urls, other_processes):
+            with self.subTest(url=url):
+                with patch('apps.products.paths.category_paths', other_process):
+                    stale = self.client.get(url)
+                cache.clear()
+                fresh = self.client.get(url)
+                self.assertEqual(stale['ETag'], fresh['ETag'])
+                self.assertEqual(stale.content, fresh.content)
+                self.assertIn(b'Electronics > Mobiles', stale.content)
+
+    def test_etag_depends_on_media_type(self):
+        url = f'/api/products/{self.phone.id}/'
+        self.assertNotEqual(self.etag(url), self.etag(url, HTTP_ACCEPT='application/json; indent=4'))
+
+    def test_missing_objects_are_not_found(self):
+        response = self.client.get('/api/products/0/', HTTP_IF_NONE_MATCH='*')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        response = self.client.get('/api/categories/missing/', HTTP_IF_NONE_MATCH='*')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
@@ -0,0 +1,67 @@
+"""
+The nested category trees served by CategoryViewSet.
+
+The whole forest is fetched in one query ordered by ``(tree_id, lft)``, so
+every parent comes before its children, and nested in memory. The
+serialized result is cached until a category is saved, moved or deleted.
+The list and retrieve actions nest children the same way, from one query
+for the trees of the categories they show (attach_subtrees).
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from mptt.utils import get_cached_trees
+
+from .models import Category
+from .serializers import CategoryNodeSerializer
+
+TREE_KEY = 'category:tree'
+
+
+def build_category_tree():
+    """Return the serialized category forest with nested ``children`` lists"""
+    categories = list(Category.objects.order_by('tree_id', 'lft'))
+    names = {category.pk: category.name for category in categories}
+    nodes = {}
+    roots = []
+    for category, data in zip(categories, CategoryNodeSerializer(categories, many=True).data):
+        node = dict(data, parent_name=names.get(category.parent_id), children=[])
+        nodes[category.pk] = node
+        if category.parent_id is None:
+            roots.append(node)
+        else:
+            nodes[category.parent_id]['children'].append(node)
+    return roots
+
+
+def attach_subtrees(categories):
+    """
+    Cache the children of ``categories``, and theirs down to the leaves, so
+    ``get_children`` and ``parent`` need no queries. Returns ``categories``
+    and every category below them.
+    """
+    tree_ids = {category.tree_id for category in categories}
+    nodes = list(Category.objects.filter(tree_id__in=tree_ids).order_by('tree_id', 'lft'))
+    get_cached_trees(nodes)
+    loaded = {node.pk: node for node in nodes}
+    for category in categories:
+        category._cached_children = loaded[category.pk]._cached_children
+    return [
+        node for node in nodes
+        if any(node.tree_id == category.tree_id and category.lft <= node.lft <= category.rght for category in categories)
+    ]
+
+
+def get_category_tree():
+    """Return the cached category forest, building it if needed"""
+    tree = cache.get(TREE_KEY)
+    if tree is None:
+        tree = build_category_tree()
+        cache.set(TREE_KEY, tree, getattr(settings, 'CATEGORY_TREE_TTL', 60 * 60 * 24))
+    return tree
+
+
+def invalidate_category_tree(sender=None, **kwargs):
+    """Category post_save/post_delete/node_moved receiver; drops the tree now and on commit"""
+    cache.delete(TREE_KEY)
+    transaction.on_commit(lambda: cache.delete(TREE_KEY))
@@ -11,6 +11,7 @@ urlpatterns = [
 
     # Template-based views
     path('list/', views.product_list, name='product_list'),
+    path('autocomplete/', views.product_autocomplete, name='autocomplete'),
     path('create/', views.product_create, name='product_create'),
     path('<int:pk>/', views.product_detail, name='detail'),
     path('<int:pk>/update/', views.product_update, name='update'),
@@ -1,37 +1,112 @@
 from django.shortcuts import render, redirect, get_object_or_404
-from rest_framework import viewsets, permissions
+from rest_framework import viewsets, permissions, status
 from rest_framework.decorators import action
+from rest_framework.pagination import PageNumberPagination
 from rest_framework.response import Response
+from savannah_ecommerce.pagination import KeysetPagination, paginate_keyset, DEFAULT_ORDERING
+from savannah_ecommerce.shaping import SerializerQuerysetMixin, shape_queryset
+from savannah_ecommerce.response_cache import ResponseCacheMixin
+from savannah_ecommerce.conditional import ConditionalGetMixin
 from .models import Product, Category
 from .serializers import ProductSerializer, CategorySerializer
 from .forms import ProductForm
+from .search import search_products
+from .facets import ProductFilters, facets_key, get_facets
+from .autocomplete import get_autocomplete, DEFAULT_LIMIT, MAX_LIMIT
+from .counters import record_view
+from .related import get_related_products
+from .tree import attach_subtrees, get_category_tree
+from .stats import get_category_stats
+from .paths import check_category_paths
+from .responses import category_tags, product_tags
 from django.contrib.auth.decorators import login_required
-from django.db.models import Q
 from django.contrib import messages
+from django.http import JsonResponse
+from django.db.models import Subquery
+from django.utils.cache import patch_cache_control
+from django.utils.functional import SimpleLazyObject
+from functools import partial
+from django.views.decorators.http import require_GET
 
 
-class CategoryViewSet(viewsets.ModelViewSet):
-    queryset = Category.objects.all()
+class CategoryViewSet(ResponseCacheMixin, ConditionalGetMixin, viewsets.ModelViewSet):
+    queryset = Category.objects.select_related('parent')
     serializer_class = CategorySerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
     lookup_field = 'slug'
 
+    def response_cache_tags(self, data):
+        return category_tags(data, listing=self.action == 'list')
+
+    def get_serializer(self, *args, **kwargs):
+        if args and self.action in ('list', 'retrieve'):
+            # Nested children from one query instead of one per category
+            categories = list(args[0]) if kwargs.get('many') else [args[0]]
+            shown = attach_subtrees(categories)
+            if kwargs.get('many'):
+                args = (categories,) + args[1:]
+            # and the average prices of them all from one cache lookup
+            kwargs['context'] = dict(
+                self.get_serializer_context(),
+                category_stats=get_category_stats([category.pk for category in shown])
+            )
+        return super().get_serializer(*args, **kwargs)
+
+    def conditional_querysets(self):
+        categories = self.conditional_queryset()
+        if self.action == 'retrieve':
+            # Its parent, its children and the products it averages are all in its tree
+            tree_id = Subquery(categories.values('tree_id')[:1])
+            return [Category.objects.filter(tree_id=tree_id), Product.objects.filter(category__tree_id=tree_id)]
+        # Every category shows the average price of the products below it
+        return [categories, Product.objects.all()]
+
     @action(detail=True, methods=['get'])
     def average_price(self, request, slug=None):
         category = self.get_object()
         return Response({'average_price': category.get_average_price()})
 
+    @action(detail=False, methods=['get'])
+    def tree(self, request):
+        """The whole category forest, nested, built from one query and cached"""
+        return Response(get_category_tree())
+
+    @action(detail=True, methods=['get'])
+    def stats(self, request, slug=None):
+        """Product count and average, min and max price over the category and its descendants"""
+        return Response(self.get_object().get_stats())
+
     @action(detail=True, methods=['get'])
     def products(self, request, slug=None):
         category = self.get_object()
         products = category.get_all_products()
-        serializer = ProductSerializer(products, many=True)
-        return Response(serializer.data)
 
-class ProductViewSet(viewsets.ModelViewSet):
+        def respond(request):
+            check_category_paths()  # after the validators, see ProductViewSet.get_serializer
+            serializer = ProductSerializer(shape_queryset(products, ProductSerializer), many=True)
+            return Response(serializer.data)
+
+        # Product category paths span the category's tree
+        return self.conditional_response([products, Category.objects.filter(tree_id=category.tree_id)], respond, request)
+
+class ProductViewSet(ResponseCacheMixin, ConditionalGetMixin, SerializerQuerysetMixin, viewsets.ModelViewSet):
     queryset = Product.objects.all()
     serializer_class = ProductSerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
+    pagination_class = KeysetPagination
+
+    def response_cache_tags(self, data):
+        return product_tags(data, listing=self.action == 'list')
+
+    def conditional_querysets(self):
+        # Products show their category's name and path
+        return [self.conditional_queryset(), Category.objects.all()]
+
+    def get_serializer(self, *args, **kwargs):
+        # Read after the response cache clock and the validators, so a rename
+        # committed before either shows here too
+        check_category_paths()
+        return super().get_serializer(*args, **kwargs)
 
     def get_queryset(self):
         queryset = Product.objects.all()
@@ -40,53 +115,86 @@ class ProductViewSet(viewsets.ModelViewSet):
             queryset = queryset.filter(category__slug=category)
         return queryset
 
+    # Ranked by relevance, which has no index to page along
+    @action(detail=False, methods=['get'], pagination_class=PageNumberPagination)
+    def search(self, request):
+        """Full-text search over product names and descriptions, best matches first"""
+        query = request.query_params.get('q', '').strip()
+        if not query:
+            return Response({'error': 'The q parameter is required'}, status=status.HTTP_400_BAD_REQUEST)
+
+        products = search_products(self.filter_queryset(self.get_queryset()), query)
+        page = self.paginate_queryset(products)
+        if page is not None:
+            return self.get_paginated_response(self.get_serializer(page, many=True).data)
+        return Response(self.get_serializer(products, many=True).data)
+
+PRODUCTS_PER_PAGE = 24
+
+# Keyset orderings for the product_list sort options, each ending in a unique column
+SORT_ORDERINGS = {
+    'price_asc': ('price', 'id'),
+    'price_desc': ('-price', '-id'),
+    'rating_desc': ('-rating', '-id'),
+    'newest': DEFAULT_ORDERING,
+    'popular': ('-views', '-id'),
+}
+
 @login_required
 def product_list(request):
     products = Product.objects.all()
-    categories = Category.objects.all()
-
-    # Search functionality
-    search_query = request.GET.get('search', '')
-    if search_query:
-        products = products.filter(
-            Q(name__icontains=search_query) |
-            Q(description__icontains=search_query)
-        )
-
-    # Category filter
-    category_id = request.GET.get('category')
-    if category_id:
-        products = products.filter(category_id=category_id)
-
-    # Price range filter
-    min_price = request.GET.get('min_price')
-    max_price = request.GET.get('max_price')
-    if min_price:
-        products = products.filter(price__gte=min_price)
-    if max_price:
-        products = products.filter(price__lte=max_price)
-
-    # Sorting
+    filters = ProductFilters.from_query(request.GET)
+
+    # Search functionality, ranked by relevance unless another sort is chosen
+    if filters.search:
+        products = search_products(products, filters.search)
+
+    # Category (with subcategories), price and rating facets, counted before they
+    # filter; only evaluated when the sidebar fragment is not cached
+    facets = SimpleLazyObject(partial(get_facets, products, filters))
+    products = filters.apply(products)
+
+    # Sorting, then a keyset page along that ordering
     sort = request.GET.get('sort', '')
-    if sort == 'price_asc':
-        products = products.order_by('price')
-    elif sort == 'price_desc':
-        products = products.order_by('-price')
-    elif sort == 'newest':
-        products = products.order_by('-created_at')
-    elif sort == 'popular':
-        products = products.order_by('-views')
+    ordering = SORT_ORDERINGS.get(sort)
+    if ordering is None:
+        ordering = ('-rank', '-id') if 'rank' in products.query.annotations else DEFAULT_ORDERING
+    products = paginate_keyset(request, products, ordering, PRODUCTS_PER_PAGE)
 
     context = {
         'products': products,
-        'categories': categories,
-        'current_category': category_id,
+        'facets': facets,
+        'facets_key': facets_key(filters),
+        'filters': filters,
         'current_sort': sort,
-        'search_query': search_query,
+        'search_query': filters.search,
+        # The current query string without the parameters a link replaces
+        'sort_query': _query_without(request, 'sort'),
+        'price_query': _query_without(request, 'min_price', 'max_price'),
     }
 
     return render(request, 'products/list.html', context)
 
+def _query_without(request, *names):
+    params = request.GET.copy()
+    for name in names + ('cursor',):
+        params.pop(name, None)
+    return params.urlencode()
+
+@require_GET
+def product_autocomplete(request):
+    """JSON suggestions of product and category names for a partial, possibly misspelt, query"""
+    query = request.GET.get('q', '').strip()
+    try:
+        limit = min(max(int(request.GET.get('limit', DEFAULT_LIMIT)), 1), MAX_LIMIT)
+    except ValueError:
+        limit = DEFAULT_LIMIT
+
+    suggestions = get_autocomplete().suggest(query, limit) if query else []
+    response = JsonResponse({'query': query, 'suggestions': suggestions})
+    patch_cache_control(response, public=True, max_age=60)
+    return response
+
 def product_create(request):
     if request.method == 'POST':
         form = ProductForm(request.POST)
@@ -100,14 +208,11 @@ def product_create(request):
 @login_required
 def product_detail(request, pk):
     product = get_object_or_404(Product, pk=pk)
-    # Increment view count
-    product.views += 1
-    product.save()
-
-    # Get related products from the same category
-    related_products = Product.objects.filter(
-        category=product.category
-    ).exclude(pk=pk)[:4]
+    # Counted in a buffer and added to product.views in batches, see counters.py
+    record_view(product)
+
+    # Precomputed by refresh_related_products, see related.py
+    related_products = get_related_products(product)
 
     context = {
         'product': product,
@@ -177,12 +177,28 @@ EMAIL_BACKEND = 'django.core.mail.backends.dummy.EmailBackend'
 # Dummy Africa's Talking settings (if needed by code logic, though we added a check)
 AFRICAS_TALKING_USERNAME = 'dummy_user'
 AFRICAS_TALKING_API_KEY = 'dummy_key'
+SMS_GATEWAY = 'apps.orders.sms.LocalSMSGateway'
 
 # Dummy Twilio settings (if needed by code logic)
 TWILIO_ACCOUNT_SID = 'dummy_sid'
 TWILIO_AUTH_TOKEN = 'dummy_token'
 TWILIO_PHONE_NUMBER = 'dummy_phone'
 
+# SQLite has no sequences, use the in-process allocator
+ORDER_NUMBER_ALLOCATOR = 'apps.orders.numbering.SnowflakeAllocator'
+
+# Redis is optional in CI; the Redis cart tests skip when it is unreachable
+REDIS_URL = os.environ.get('REDIS_URL', 'redis://localhost:6379/0')
+
+# Write product views straight away, rather than from an exit hook after the test database is gone
+PRODUCT_VIEW_FLUSH_INTERVAL = 0
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
 # Dummy Site settings
 SITE_NAME = 'CI Test Site'
 SITE_URL = 'http://localhost/'
@@ -0,0 +1,76 @@
+"""
+Conditional GET for DRF viewsets.
+
+A response is identified by the querysets it is built from: for each, one
+aggregate query of ``max(updated_at)`` and ``count``. The count catches
+deletions, which leave the latest ``updated_at`` alone. The ETag hashes
+those pairs with the negotiated media type. When it matches the request's
+If-None-Match the view returns 304 Not Modified before loading or
+serializing anything.
+
+Responses built from process-level state must not lag their validators:
+product views bring the category path map up to date after computing them.
+
+Last-Modified, the latest ``updated_at``, is sent for information only.
+If-Modified-Since is not honoured because a deletion does not move it.
+
+Listed after ResponseCacheMixin, the validators are only computed when the
+response is not cached; cached responses carry their ETag.
+"""
+import hashlib
+from django.db.models import Count, Max
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+
+
+def queryset_validator(queryset):
+    """Return ``(max(updated_at), count)`` of ``queryset`` in one query"""
+    result = queryset.order_by().aggregate(last_modified=Max('updated_at'), count=Count('pk'))
+    return result['last_modified'], result['count']
+
+
+class ConditionalGetMixin:
+    """
+    ViewSet mixin adding ETag validation to ``list`` and ``retrieve``.
+    Subclasses list what a response depends on in ``conditional_querysets``.
+    """
+
+    def conditional_queryset(self):
+        """The rows a ``list`` or ``retrieve`` response shows"""
+        queryset = self.get_queryset()
+        if self.action == 'retrieve':
+            lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+            queryset = queryset.filter(**{self.lookup_field: self.kwargs[lookup_url_kwarg]})
+        return queryset
+
+    def conditional_querysets(self):
+        """Querysets whose rows make up the response, the rows it shows first"""
+        return [self.conditional_queryset()]
+
+    def conditional_response(self, querysets, handler, request, *args, **kwargs):
+        """
+        Answer 304 if the request's ETag matches ``querysets``, else call
+        ``handler`` and add the validators to its response. A retrieve whose
+        first queryset is empty goes to the handler for its 404.
+        """
+        validators = [queryset_validator(queryset) for queryset in querysets]
+        if self.action == 'retrieve' and not validators[0][1]:
+            return handler(request, *args, **kwargs)
+
+        raw = '|'.join([request.accepted_media_type] + [f'{last}:{count}' for last, count in validators])
+        etag = f'"{hashlib.md5(raw.encode()).hexdigest()}"'
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            response = handler(request, *args, **kwargs)
+        if response.status_code in (200, 304):
+            response['ETag'] = etag
+            timestamps = [last for last, count in validators if last is not None]
+            if timestamps:
+                response['Last-Modified'] = http_date(max(timestamps).timestamp())
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional_response(self.conditional_querysets(), super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional_response(self.conditional_querysets(), super().retrieve, request, *args, **kwargs)
@@ -0,0 +1,241 @@
+"""
+Keyset (cursor) pagination.
+
+Instead of ``COUNT(*)`` plus ``OFFSET``, a page is the first ``page_size``
+rows after the last row of the previous page in a fixed, unique ordering,
+e.g. ``('-created_at', '-id')``. The cursor is an opaque token holding that
+row's ordering values, so fetching page 1000 is the same index range scan as
+fetching page 1. There are no page numbers or totals, only next and previous
+links.
+
+KeysetPagination is the DRF pagination class; template views call
+paginate_keyset.
+"""
+import base64
+import binascii
+import datetime
+import json
+from collections.abc import Sequence
+from decimal import Decimal
+from functools import reduce
+from operator import or_
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db.models import Q
+from django.http import Http404
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+# Newest first; the id breaks ties between rows created in the same instant
+DEFAULT_ORDERING = ('-created_at', '-id')
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def _encode_value(value):
+    # DjangoJSONEncoder drops microseconds, which would skip or repeat rows
+    if isinstance(value, (datetime.datetime, datetime.date, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    return value
+
+
+def encode_cursor(values, reverse=False):
+    payload = json.dumps({'v': [_encode_value(value) for value in values], 'r': reverse}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Return ``(values, reverse)`` from a cursor made by encode_cursor"""
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        return list(payload['v']), bool(payload['r'])
+    except (binascii.Error, UnicodeDecodeError, ValueError, TypeError, KeyError):
+        raise InvalidCursor(cursor)
+
+
+def keyset_filter(ordering, values):
+    """
+    Q selecting the rows that come after ``values`` in ``ordering``.
+
+    For ``('-created_at', '-id')`` that is ``created_at < x OR (created_at = x
+    AND id < y)``; the redundant ``created_at <= x`` bound lets the database
+    turn it into an index range scan.
+    """
+    clauses = []
+    equal = {}
+    for field, value in zip(ordering, values):
+        name = field.lstrip('-')
+        lookup = 'lt' if field.startswith('-') else 'gt'
+        clauses.append(Q(**equal, **{f'{name}__{lookup}': value}))
+        equal[name] = value
+    first = ordering[0]
+    bound = Q(**{f"{first.lstrip('-')}__{'lte' if first.startswith('-') else 'gte'}": values[0]})
+    return bound & reduce(or_, clauses)
+
+
+def _reversed(ordering):
+    return tuple(field[1:] if field.startswith('-') else f'-{field}' for field in ordering)
+
+
+class KeysetPage(Sequence):
+    def __init__(self, object_list, next_cursor, previous_cursor):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+        # Set by paginate_keyset for templates
+        self.next_url = None
+        self.previous_url = None
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    @property
+    def has_other_pages(self):
+        return self.has_next or self.has_previous
+
+
+class KeysetPaginator:
+    """
+    Paginates ``queryset`` by ``ordering``, whose last field must be unique
+    (normally the primary key). Annotations can be ordered on too.
+    """
+
+    def __init__(self, queryset, ordering=DEFAULT_ORDERING, page_size=None):
+        self.queryset = queryset
+        self.ordering = tuple(ordering)
+        self.page_size = page_size or api_settings.PAGE_SIZE
+
+    def _to_python(self, name, value):
+        try:
+            field = self.queryset.model._meta.get_field(name)
+        except FieldDoesNotExist:
+            return value
+        return field.to_python(value)
+
+    def _values(self, obj):
+        return [getattr(obj, field.lstrip('-')) for field in self.ordering]
+
+    def page(self, cursor=None):
+        """Return the KeysetPage at ``cursor``, or the first page. Raises InvalidCursor."""
+        ordering, reverse = self.ordering, False
+        queryset = self.queryset
+        if cursor:
+            values, reverse = decode_cursor(cursor)
+            if len(values) != len(self.ordering):
+                raise InvalidCursor(cursor)
+            try:
+                values = [self._to_python(field.lstrip('-'), value) for field, value in zip(self.ordering, values)]
+            except (ValidationError, TypeError):
+                raise InvalidCursor(cursor)
+            if reverse:
+                ordering = _reversed(ordering)
+            queryset = queryset.filter(keyset_filter(ordering, values))
+
+        rows = list(queryset.order_by(*ordering)[:self.page_size + 1])
+        more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        if reverse:
+            rows.reverse()
+            has_next, has_previous = True, more
+        else:
+            has_next, has_previous = more, bool(cursor)
+
+        if not rows:
+            return KeysetPage(rows, None, None)
+        return KeysetPage(
+            rows,
+            encode_cursor(self._values(rows[-1])) if has_next else None,
+            encode_cursor(self._values(rows[0]), reverse=True) if has_previous else None
+        )
+
+
+def paginate_keyset(request, queryset, ordering=DEFAULT_ORDERING, page_size=None, cursor_param='cursor'):
+    """
+    Return the page of ``queryset`` named by the request's cursor parameter,
+    with ``next_url`` and ``previous_url`` query strings that keep the other
+    parameters. Raises Http404 for a malformed cursor.
+    """
+    try:
+        page = KeysetPaginator(queryset, ordering, page_size).page(request.GET.get(cursor_param))
+    except InvalidCursor:
+        raise Http404('Invalid cursor')
+
+    def url(cursor):
+        query = request.GET.copy()
+        query[cursor_param] = cursor
+        return f'?{query.urlencode()}'
+
+    if page.has_next:
+        page.next_url = url(page.next_cursor)
+    if page.has_previous:
+        page.previous_url = url(page.previous_cursor)
+    return page
+
+
+class KeysetPagination(BasePagination):
+    """
+    DRF keyset pagination. Views can set ``keyset_ordering`` to page by
+    something other than DEFAULT_ORDERING.
+    """
+    page_size = api_settings.PAGE_SIZE
+    cursor_query_param = 'cursor'
+    ordering = DEFAULT_ORDERING
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        ordering = getattr(view, 'keyset_ordering', self.ordering)
+        try:
+            self.page = KeysetPaginator(queryset, ordering, self.page_size).page(
+                request.query_params.get(self.cursor_query_param)
+            )
+        except InvalidCursor:
+            raise NotFound('Invalid cursor')
+        return list(self.page)
+
+    def _link(self, cursor):
+        if cursor is None:
+            return None
+        return replace_query_param(self.request.build_absolute_uri(), self.cursor_query_param, cursor)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self._link(self.page.next_cursor),
+            'previous': self._link(self.page.previous_cursor),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+    def get_schema_operation_parameters(self, view):
+        return [{
+            'name': self.cursor_query_param,
+            'required': False,
+            'in': 'query',
+            'description': 'The pagination cursor value.',
+            'schema': {'type': 'string'},
+        }]
@@ -0,0 +1,156 @@
+"""
+Tagged response caching for DRF viewsets.
+
+ResponseCacheMixin caches the rendered body of successful ``list`` and
+``retrieve`` responses in the default cache (Redis), keyed by path, query
+parameters, user scope and negotiated media type. Each entry is stored with
+the tags its content depends on, such as ``product:42``, together with the
+current version of each tag. invalidate_tags replaces those versions (right
+away and again on commit), so every entry that depends on a changed row
+stops matching on its next read while unrelated entries stay cached.
+RESPONSE_CACHE_TTL only bounds entries whose invalidation was missed.
+
+Versions are ticks of one shared counter. A response is only stored if
+none of its tags was invalidated after the request started: a write that
+commits while the view is reading, before its tags are looked up, would
+otherwise be hidden under a version newer than the data. Views rendering
+from process-level state bring it up to date after the request starts, as
+ProductViewSet does with the category path map.
+Entries keep the ETag the view set (see conditional.py), so a hit answers a
+matching If-None-Match with 304 without touching the database.
+
+The user scope is set per viewset by ``response_cache_scope``:
+
+* ``'public'``: shared by all users, but anonymous and authenticated
+  requests are cached apart, as permissions may shape the output;
+* ``'user'``: cached per user.
+"""
+import hashlib
+from urllib.parse import urlencode
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response
+
+CACHED_HEADERS = ('Content-Type', 'Vary', 'Allow', 'ETag', 'Last-Modified')
+
+
+CLOCK_KEY = 'response:clock'
+
+
+def _tag_key(tag):
+    return f'response:tag:{tag}'
+
+
+def clock():
+    """The latest tag version handed out"""
+    return cache.get(CLOCK_KEY, 0)
+
+
+def _tick():
+    try:
+        return cache.incr(CLOCK_KEY)
+    except ValueError:
+        cache.add(CLOCK_KEY, 0, None)
+        return cache.incr(CLOCK_KEY)
+
+
+def response_key(request, scope='public'):
+    """Cache key for a DRF ``request`` once its renderer has been negotiated"""
+    user = request.user
+    if scope == 'user':
+        audience = f'user:{user.pk}' if user.is_authenticated else 'anon'
+    else:
+        audience = 'auth' if user.is_authenticated else 'anon'
+    query = urlencode(sorted((name, sorted(values)) for name, values in request.query_params.lists()), doseq=True)
+    raw = f'{request.path}?{query}|{audience}|{request.accepted_media_type}'
+    return f'response:{hashlib.md5(raw.encode()).hexdigest()}'
+
+
+def tag_versions(tags):
+    """
+    Return ``({tag: version}, created)``, giving tags that have none a new
+    version; ``created`` holds the tags this call gave one.
+    """
+    keys = {_tag_key(tag): tag for tag in tags}
+    versions = cache.get_many(keys)
+    missing = [key for key in keys if key not in versions]
+    # add, so a version set concurrently wins
+    created = {keys[key] for key in missing if cache.add(key, _tick(), None)}
+    if missing:
+        versions.update(cache.get_many(missing))
+    return {keys[key]: version for key, version in versions.items()}, created
+
+
+def invalidate_tags(tags):
+    """Make every cached response tagged with any of ``tags`` stale"""
+    keys = [_tag_key(tag) for tag in tags]
+
+    def bump():
+        version = _tick()
+        cache.set_many({key: version for key in keys}, None)
+
+    if keys:
+        bump()
+        transaction.on_commit(bump)
+
+
+def get_response(key):
+    """Return the cached HttpResponse for ``key`` if none of its tags changed since"""
+    entry = cache.get(key)
+    if entry is None:
+        return None
+    current = cache.get_many([_tag_key(tag) for tag in entry['tags']])
+    if any(current.get(_tag_key(tag)) != version for tag, version in entry['tags'].items()):
+        return None
+    response = HttpResponse(entry['content'], status=entry['status'])
+    for header, value in entry['headers'].items():
+        response[header] = value
+    return response
+
+
+def store_response(key, response, versions):
+    cache.set(
+        key,
+        {
+            'content': response.content,
+            'status': response.status_code,
+            'headers': {header: response[header] for header in CACHED_HEADERS if response.has_header(header)},
+            'tags': versions,
+        },
+        getattr(settings, 'RESPONSE_CACHE_TTL', 600)
+    )
+
+
+class ResponseCacheMixin:
+    """
+    ViewSet mixin caching ``list`` and ``retrieve``. Subclasses return the
+    tags a response depends on from ``response_cache_tags``.
+    """
+    response_cache_scope = 'public'
+
+    def response_cache_tags(self, data):
+        raise NotImplementedError
+
+    def cached_response(self, handler, request, *args, **kwargs):
+        """Serve ``handler`` from the cache, caching a successful response once rendered"""
+        key = response_key(request, self.response_cache_scope)
+        response = get_response(key)
+        if response is not None:
+            # An entry's ETag holds for as long as the entry does
+            return get_conditional_response(request, etag=response.get('ETag'), response=response)
+        started = clock()
+        response = handler(request, *args, **kwargs)
+        if response.status_code == 200:
+            versions, created = tag_versions(self.response_cache_tags(response.data))
+            # A tag invalidated since the handler started reading may be newer than its data
+            if all(version <= started for tag, version in versions.items() if tag not in created):
+                response.add_post_render_callback(lambda rendered: store_response(key, rendered, versions))
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(super().retrieve, request, *args, **kwargs)
@@ -68,8 +68,15 @@ TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
         'DIRS': [BASE_DIR / 'templates'],
-        'APP_DIRS': True,
         'OPTIONS': {
+            # Compiled templates are kept per process; the dev server's autoreloader
+            # still picks up template edits
+            'loaders': [
+                ('django.template.loaders.cached.Loader', [
+                    'django.template.loaders.filesystem.Loader',
+                    'django.template.loaders.app_directories.Loader',
+                ]),
+            ],
             'context_processors': [
                 'django.template.context_processors.debug',
                 'django.template.context_processors.request',
@@ -215,6 +222,10 @@ EMAIL_HOST_USER = 'murithititus510@gmail.com'
 EMAIL_HOST_PASSWORD = 'fvjr soai ajcx yevs'
 DEFAULT_FROM_EMAIL = EMAIL_HOST_USER
 ADMIN_EMAIL = 'majidhanid25@gmail.com'
+# Outbox workers keep one SMTP connection open and recycle it after this many idle seconds
+EMAIL_POOL_IDLE_TIMEOUT = config('EMAIL_POOL_IDLE_TIMEOUT', default=60, cast=int)
+# New-order emails to ADMIN_EMAIL are batched into one digest per interval (seconds)
+ORDER_ADMIN_DIGEST_INTERVAL = config('ORDER_ADMIN_DIGEST_INTERVAL', default=900, cast=int)
 
 # Site settings
 SITE_NAME = 'Savannah E-commerce'
@@ -335,7 +346,7 @@ SOCIAL_AUTH_EMAIL_VALIDATION_FUNCTION = None
 SOCIAL_AUTH_EMAIL_VALIDATION_URL = None  
 
 # Session settings
-SESSION_ENGINE = 'django.contrib.sessions.backends.db'
+SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
 SESSION_COOKIE_AGE = 1209600  
 SESSION_COOKIE_SECURE = False 
 SESSION_COOKIE_HTTPONLY = True
@@ -347,6 +358,57 @@ LOGIN_REDIRECT_URL = '/'
 LOGOUT_URL = '/logout/'
 LOGOUT_REDIRECT_URL = '/'
 
+# Redis, provisioned by docker-compose and the k8s manifests
+REDIS_URL = config('REDIS_URL', default='redis://localhost:6379/0')
+
+CACHES = {
+    'default': {
+        'BACKEND': config('CACHE_BACKEND', default='django.core.cache.backends.redis.RedisCache'),
+        'LOCATION': REDIS_URL,
+        'KEY_PREFIX': 'savannah',
+    }
+}
+
+# Cart storage (see apps/cart/backends.py); set to apps.cart.backends.RedisCartBackend
+# to keep carts in Redis and run the flush_carts worker
+CART_BACKEND = config('CART_BACKEND', default='apps.cart.backends.DatabaseCartBackend')
+CART_REDIS_TTL = config('CART_REDIS_TTL', default=60 * 60 * 24 * 30, cast=int)
+# Seconds a cached cart badge count may live (see apps/cart/counter.py)
+CART_COUNT_TTL = config('CART_COUNT_TTL', default=300, cast=int)
+
+# Product view counting (see apps/products/counters.py); set to
+# apps.products.counters.RedisViewCounter to share counts between workers
+# and run the flush_product_views worker
+PRODUCT_VIEW_COUNTER = config('PRODUCT_VIEW_COUNTER', default='apps.products.counters.BufferedViewCounter')
+PRODUCT_VIEW_FLUSH_INTERVAL = config('PRODUCT_VIEW_FLUSH_INTERVAL', default=10, cast=int)
+PRODUCT_VIEW_MAX_PENDING = config('PRODUCT_VIEW_MAX_PENDING', default=1000, cast=int)
+
+# Seconds cached category price statistics may live (see apps/products/stats.py)
+CATEGORY_STATS_TTL = config('CATEGORY_STATS_TTL', default=600, cast=int)
+
+# Seconds the serialized category tree may live; it is also dropped on every category change
+CATEGORY_TREE_TTL = config('CATEGORY_TREE_TTL', default=60 * 60 * 24, cast=int)
+
+# Seconds between checks that this process's category path map is current (see apps/products/paths.py)
+CATEGORY_PATH_CHECK_INTERVAL = config('CATEGORY_PATH_CHECK_INTERVAL', default=5, cast=int)
+
+# Seconds cached product_list facet counts may live (see apps/products/facets.py)
+PRODUCT_FACETS_TTL = config('PRODUCT_FACETS_TTL', default=300, cast=int)
+
+# Seconds a cached API response may live; entries are invalidated by tag on
+# model changes, this only bounds missed ones (see savannah_ecommerce/response_cache.py)
+RESPONSE_CACHE_TTL = config('RESPONSE_CACHE_TTL', default=600, cast=int)
+
+# Product autocomplete (see apps/products/autocomplete.py)
+AUTOCOMPLETE_MIN_SIMILARITY = config('AUTOCOMPLETE_MIN_SIMILARITY', default=0.3, cast=float)
+AUTOCOMPLETE_REFRESH_INTERVAL = config('AUTOCOMPLETE_REFRESH_INTERVAL', default=300, cast=int)
+
+# Order number allocation (see apps/orders/numbering.py)
+ORDER_NUMBER_ALLOCATOR = config('ORDER_NUMBER_ALLOCATOR', default='apps.orders.numbering.SequenceBlockAllocator')
+ORDER_NUMBER_WORKER_ID = config('ORDER_NUMBER_WORKER_ID', default=0, cast=int)
+
 # Africa's Talking SMS settings
 AFRICAS_TALKING_USERNAME = config('AT_USERNAME', default='sandbox')
 AFRICAS_TALKING_API_KEY = config('AT_API_KEY', default='')
+# Dotted path of the SMS gateway class, see apps/orders/sms.py
+SMS_GATEWAY = config('SMS_GATEWAY', default='apps.orders.sms.AfricasTalkingGateway')
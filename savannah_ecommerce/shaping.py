@@ -0,0 +1,153 @@
+"""
+Queryset shaping from serializers.
+
+A serializer's Meta can declare what its representation reads beyond its
+own columns::
+
+    class Meta:
+        select_related = ['category']
+        prefetch_related = ['tags']
+        only = ['id', 'name', 'category']
+
+queryset_shape combines those declarations with what the fields imply:
+
+* a nested serializer on a foreign key becomes a select_related, with the
+  nested serializer's own declarations prefixed;
+* a nested ``many=True`` serializer becomes a Prefetch whose queryset is
+  shaped by the child serializer (keeping the foreign key back to the
+  parent);
+* a dotted ``source`` such as ``parent.name`` select_relateds the
+  relations it crosses.
+
+``only`` is applied when the serializer and every serializer joined to it by
+select_related declare it, since one undeclared model would otherwise be
+loaded as bare primary keys. SerializerQuerysetMixin applies the shape in
+viewsets.
+"""
+from dataclasses import dataclass, field
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import Prefetch, prefetch_related_objects
+from rest_framework import serializers
+
+
+@dataclass
+class Shape:
+    select_related: list = field(default_factory=list)
+    prefetch_related: list = field(default_factory=list)
+    # None when the columns cannot be restricted
+    only: list = None
+
+    def apply(self, queryset):
+        if self.select_related:
+            queryset = queryset.select_related(*self.select_related)
+        if self.prefetch_related:
+            queryset = queryset.prefetch_related(*self.prefetch_related)
+        if self.only is not None:
+            queryset = queryset.only(*self.only)
+        return queryset
+
+
+def _prefixed(lookup, prefix):
+    if isinstance(lookup, Prefetch):
+        lookup = Prefetch(lookup.prefetch_through, queryset=lookup.queryset, to_attr=lookup.to_attr)
+        lookup.add_prefix(prefix)
+        return lookup
+    return f'{prefix}__{lookup}'
+
+
+def _build_shape(serializer, model):
+    meta = getattr(serializer, 'Meta', None)
+    shape = Shape(
+        list(getattr(meta, 'select_related', [])),
+        list(getattr(meta, 'prefetch_related', [])),
+        list(meta.only) if hasattr(meta, 'only') else None
+    )
+
+    for serializer_field in serializer.fields.values():
+        if serializer_field.source == '*' or serializer_field.write_only:
+            continue
+        source_attrs = serializer_field.source.split('.')
+
+        if isinstance(serializer_field, serializers.ListSerializer) and isinstance(serializer_field.child, serializers.ModelSerializer):
+            # Reverse foreign key or many-to-many: prefetch, shaped by the child
+            try:
+                relation = model._meta.get_field(source_attrs[0])
+            except FieldDoesNotExist:
+                continue
+            child_model = serializer_field.child.Meta.model
+            child_shape = _build_shape(serializer_field.child, child_model)
+            if child_shape.only is not None and relation.one_to_many:
+                child_shape.only.append(relation.field.name)
+            shape.prefetch_related.append(
+                Prefetch(source_attrs[0], queryset=child_shape.apply(child_model._default_manager.all()))
+            )
+            continue
+
+        if isinstance(serializer_field, serializers.ModelSerializer):
+            try:
+                relation = model._meta.get_field(source_attrs[0])
+            except FieldDoesNotExist:
+                continue
+            if not (relation.many_to_one or relation.one_to_one):
+                continue
+            prefix = source_attrs[0]
+            child_shape = _build_shape(serializer_field, relation.related_model)
+            shape.select_related += [prefix] + [f'{prefix}__{lookup}' for lookup in child_shape.select_related]
+            shape.prefetch_related += [_prefixed(lookup, prefix) for lookup in child_shape.prefetch_related]
+            if shape.only is not None and child_shape.only is not None:
+                shape.only += [prefix] + [f'{prefix}__{name}' for name in child_shape.only]
+            else:
+                shape.only = None
+            continue
+
+        # Plain fields: follow a dotted source across forward relations
+        current, path = model, []
+        for attr in source_attrs[:-1]:
+            try:
+                relation = current._meta.get_field(attr)
+            except FieldDoesNotExist:
+                break
+            if not (relation.many_to_one or relation.one_to_one):
+                break
+            path.append(attr)
+            current = relation.related_model
+        if path:
+            lookup = '__'.join(path)
+            shape.select_related.append(lookup)
+            if shape.only is not None:
+                shape.only += [lookup, '__'.join(source_attrs[:len(path) + 1])]
+
+    shape.select_related = list(dict.fromkeys(shape.select_related))
+    return shape
+
+
+_shapes = {}
+
+
+def queryset_shape(serializer_class):
+    """Return the (cached) Shape needed to serialize ``serializer_class``'s model"""
+    shape = _shapes.get(serializer_class)
+    if shape is None:
+        shape = _shapes[serializer_class] = _build_shape(serializer_class(), serializer_class.Meta.model)
+    return shape
+
+
+def shape_queryset(queryset, serializer_class):
+    return queryset_shape(serializer_class).apply(queryset)
+
+
+def prefetch_for_serializer(instances, serializer_class):
+    """Load what ``serializer_class`` needs onto already fetched model instances"""
+    shape = queryset_shape(serializer_class)
+    prefetch_related_objects(list(instances), *shape.select_related, *shape.prefetch_related)
+
+
+class SerializerQuerysetMixin:
+    """
+    ViewSet mixin shaping querysets for the serializer class, after
+    get_queryset and the filter backends, so lists and detail lookups load
+    related rows with a fixed number of queries.
+    """
+
+    def filter_queryset(self, queryset):
+        return shape_queryset(super().filter_queryset(queryset), self.get_serializer_class())
@@ -0,0 +1,45 @@
+import threading
+import unittest
+from decimal import Decimal
+from django.contrib.auth import get_user_model
+from django.db import connection, connections
+from django.test import TransactionTestCase
+from apps.cart.models import Cart
+from apps.products.models import Category, Product
+
+
+@unittest.skipUnless(connection.vendor == 'postgresql', 'Concurrent writers need PostgreSQL')
+class CartUpsertConcurrencyTests(TransactionTestCase):
+    def setUp(self):
+        user = get_user_model().objects.create_user(username='two-tabs', password='password')
+        category = Category.objects.create(name='Electronics')
+        self.product = Product.objects.create(name='Mouse', price=Decimal('25.00'), stock=10, category=category)
+        self.cart = Cart.objects.create(user=user)
+
+    def test_concurrent_adds_are_not_lost(self):
+        threads, adds = 8, 25
+        barrier = threading.Barrier(threads)
+        errors = []
+
+        def tab():
+            try:
+                cart = Cart.objects.get(pk=self.cart.pk)
+                barrier.wait()
+                for _ in range(adds):
+                    cart.add_item(self.product, 1)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connections.close_all()
+
+        workers = [threading.Thread(target=tab) for _ in range(threads)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(self.cart.items.get().quantity, threads * adds)
+        self.cart.refresh_from_db()
+        self.assertEqual(self.cart.total_items, threads * adds)
+        self.assertEqual(self.cart.total_price, Decimal('25.00') * threads * adds)
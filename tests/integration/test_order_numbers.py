@@ -0,0 +1,37 @@
+import threading
+import unittest
+from django.db import connection, connections
+from django.test import TransactionTestCase
+from apps.orders.numbering import SequenceBlockAllocator, SEQUENCE_BLOCK_SIZE
+
+
+@unittest.skipUnless(connection.vendor == 'postgresql', 'Order number sequence needs PostgreSQL')
+class SequenceBlockAllocatorTests(TransactionTestCase):
+    def test_concurrent_workers_never_collide(self):
+        # Each allocator stands in for one gunicorn worker process
+        workers = [SequenceBlockAllocator() for _ in range(4)]
+        numbers = []
+        lock = threading.Lock()
+
+        def allocate(allocator):
+            try:
+                batch = [allocator.allocate() for _ in range(SEQUENCE_BLOCK_SIZE * 3)]
+                with lock:
+                    numbers.extend(batch)
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=allocate, args=(allocator,)) for allocator in workers for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(numbers), 4 * 3 * SEQUENCE_BLOCK_SIZE * 3)
+        self.assertEqual(len(set(numbers)), len(numbers))
+
+    def test_one_round_trip_per_block(self):
+        allocator = SequenceBlockAllocator()
+        with self.assertNumQueries(2):
+            for _ in range(SEQUENCE_BLOCK_SIZE + 1):
+                allocator.allocate()
@@ -0,0 +1,163 @@
+import unittest
+import uuid
+from decimal import Decimal
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+from django.urls import reverse
+from unittest.mock import patch
+from apps.cart.backends import RedisCart, RedisCartBackend
+from apps.cart.models import Cart, CartItem, merge_cart_operations
+from apps.orders.models import Order
+from apps.products.models import Product, Category
+
+
+def redis_available():
+    try:
+        import redis
+        return redis.Redis.from_url(settings.REDIS_URL, socket_connect_timeout=1).ping()
+    except Exception:
+        return False
+
+
+@unittest.skipUnless(redis_available(), 'Redis cart backend needs a Redis server at REDIS_URL')
+class RedisCartBackendTests(TestCase):
+    def setUp(self):
+        self.backend = RedisCartBackend()
+        # Keep test keys apart from anything else in the Redis database
+        prefix = f'test:{uuid.uuid4().hex}:'
+        self.backend.key_prefix = f'{prefix}cart:'
+        self.backend.dirty_key = f'{prefix}cart:dirty'
+        self.addCleanup(lambda: [self.backend.client.delete(key) for key in self.backend.client.scan_iter(f'{prefix}*')])
+
+        self.user = get_user_model().objects.create_user(username='shopper', password='password', email='shopper@example.com')
+        category = Category.objects.create(name='Electronics')
+        self.laptop = Product.objects.create(name='Laptop', price=Decimal('1200.00'), stock=10, category=category)
+        self.mouse = Product.objects.create(name='Mouse', price=Decimal('25.00'), stock=10, category=category)
+
+    def test_mutations_make_no_sql_queries(self):
+        cart = self.backend.get_cart(self.user)
+        cart.add_item(self.laptop, 1)  # first access loads the (empty) database cart
+
+        with self.assertNumQueries(0):
+            cart = self.backend.get_cart(self.user)
+            cart.add_item(self.laptop, 2)
+            item = cart.add_item(self.mouse, 4)
+            cart.set_quantity(item, 2)
+            self.assertEqual(cart.total_items, 5)
+            self.assertEqual(cart.total_price, Decimal('3650.00'))
+
+        self.assertFalse(Cart.objects.filter(user=self.user, items__isnull=False).exists())
+
+    def test_flush_persists_changed_carts(self):
+        cart = self.backend.get_cart(self.user)
+        cart.add_item(self.laptop, 2)
+        cart.add_item(self.mouse, 1)
+        cart.remove_item(self.mouse)
+
+        # The cart leaves the dirty set once the write commits
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self.backend.flush(), 1)
+        self.assertEqual(self.backend.flush(), 0)
+
+        db_cart = Cart.objects.get(user=self.user)
+        self.assertEqual(list(db_cart.items.values_list('product_id', 'quantity')), [(self.laptop.pk, 2)])
+        self.assertEqual((db_cart.total_items, db_cart.total_price), (2, Decimal('2400.00')))
+
+    def test_missing_items_are_not_found(self):
+        cart = self.backend.get_cart(self.user)
+        cart.add_item(self.laptop, 1)
+        for product_id in (None, '', 'laptop', self.mouse.pk):
+            with self.subTest(product_id=product_id), self.assertRaises(CartItem.DoesNotExist):
+                cart.get_item(product_id)
+
+        self.client.force_login(self.user)
+        with patch('apps.cart.views.get_cart', self.backend.get_cart):
+            response = self.client.put(reverse('cart-update-item', args=[1]), {'quantity': 2}, content_type='application/json')
+        self.assertEqual(response.status_code, 404)
+
+    def test_loads_existing_database_cart(self):
+        Cart.objects.create(user=self.user).add_item(self.mouse, 3)
+
+        cart = self.backend.get_cart(self.user)
+        cart.add_item(self.mouse, 1)
+        self.assertEqual([(line.product, line.quantity) for line in cart.lines()], [(self.mouse, 4)])
+
+    def test_apply_changes(self):
+        cart = self.backend.get_cart(self.user)
+        cart.add_item(self.laptop, 1)
+
+        cart.apply_changes(*merge_cart_operations([
+            ('add', self.mouse, 2),
+            ('set', self.laptop, 3),
+            ('add', self.laptop, 1),
+        ]))
+
+        self.assertEqual([(line.product, line.quantity) for line in cart.lines()], [(self.laptop, 4), (self.mouse, 2)])
+        self.assertEqual(cart.total_price, Decimal('4850.00'))
+
+    def test_checkout_persists_and_clears(self):
+        cart = self.backend.get_cart(self.user)
+        cart.add_item(self.laptop, 1)
+
+        order = cart.checkout()
+
+        self.assertEqual(order.items.get().quantity, 1)
+        self.assertEqual(order.total_price, Decimal('1200.00'))
+        self.assertEqual(self.backend.get_cart(self.user).total_items, 0)
+        self.assertFalse(Cart.objects.get(user=self.user).items.exists())
+
+    def dirty(self):
+        return self.backend.client.sismember(self.backend.dirty_key, self.user.pk)
+
+    def test_failed_persist_keeps_the_cart_dirty(self):
+        self.backend.get_cart(self.user).add_item(self.laptop, 2)
+        with patch.object(CartItem.objects, 'bulk_create', side_effect=RuntimeError('database down')):
+            self.assertEqual(self.backend.flush(), 0)
+        self.assertTrue(self.dirty())
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self.backend.flush(), 1)
+        self.assertFalse(self.dirty())
+        self.assertEqual(Cart.objects.get(user=self.user).total_items, 2)
+
+    def test_change_during_persist_keeps_the_cart_dirty(self):
+        self.backend.get_cart(self.user).add_item(self.laptop, 1)
+        snapshot = RedisCart._snapshot
+
+        def snapshot_then_add(cart):
+            result = snapshot(cart)
+            self.backend.get_cart(self.user).add_item(self.mouse, 1)
+            return result
+
+        with patch.object(RedisCart, '_snapshot', snapshot_then_add), self.captureOnCommitCallbacks(execute=True):
+            self.backend.flush()
+        self.assertTrue(self.dirty())
+        self.backend.flush()
+        self.assertEqual(Cart.objects.get(user=self.user).total_items, 2)
+
+    def test_loading_keeps_concurrent_changes(self):
+        Cart.objects.create(user=self.user).add_item(self.mouse, 3)
+        slow = self.backend.get_cart(self.user)
+        # Another request loads the cart and adds to it before this one seeds it
+        self.backend.get_cart(self.user).add_item(self.mouse, 1)
+        self.assertEqual(slow._load_from_database()[f'q:{self.mouse.pk}'], '4')
+
+    def test_checkout_keeps_items_added_while_ordering(self):
+        cart = self.backend.get_cart(self.user)
+        cart.add_item(self.laptop, 1)
+        create_order_from_cart = Order.create_order_from_cart
+
+        def create_then_add(db_cart):
+            order = create_order_from_cart(db_cart)
+            self.backend.get_cart(self.user).add_item(self.laptop, 2)
+            self.backend.get_cart(self.user).add_item(self.mouse, 1)
+            return order
+
+        with patch.object(Order, 'create_order_from_cart', side_effect=create_then_add):
+            order = cart.checkout()
+
+        self.assertEqual(order.items.get().quantity, 1)
+        remaining = self.backend.get_cart(self.user)
+        self.assertEqual([(line.product, line.quantity) for line in remaining.lines()], [(self.laptop, 2), (self.mouse, 1)])
+        self.assertTrue(self.dirty())
@@ -0,0 +1,36 @@
+import unittest
+import uuid
+from decimal import Decimal
+from django.conf import settings
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from rest_framework.test import APIClient
+from apps.products.models import Product, Category
+from tests.integration.test_redis_cart import redis_available
+
+
+@unittest.skipUnless(redis_available(), 'Response caching needs a Redis server at REDIS_URL')
+class RedisResponseCacheTests(TestCase):
+    def setUp(self):
+        overrides = override_settings(CACHES={'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': settings.REDIS_URL,
+            'KEY_PREFIX': f'test:{uuid.uuid4().hex}',
+        }})
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        self.addCleanup(cache.clear)
+
+        category = Category.objects.create(name='Audio')
+        self.speaker = Product.objects.create(name='Speaker', price=Decimal('50.00'), category=category)
+        self.client = APIClient()
+
+    def test_detail_is_cached_in_redis_until_the_product_changes(self):
+        url = f'/api/products/{self.speaker.id}/'
+        self.client.get(url)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(url).json()['price'], '50.00')
+
+        self.speaker.price = Decimal('45.00')
+        self.speaker.save()
+        self.assertEqual(self.client.get(url).json()['price'], '45.00')
@@ -0,0 +1,44 @@
+import unittest
+import uuid
+from decimal import Decimal
+from django.test import TestCase
+from apps.products.counters import RedisViewCounter
+from apps.products.models import Product, Category
+from tests.integration.test_redis_cart import redis_available
+
+
+@unittest.skipUnless(redis_available(), 'Redis view counter needs a Redis server at REDIS_URL')
+class RedisViewCounterTests(TestCase):
+    def setUp(self):
+        self.counter = RedisViewCounter()
+        self.counter.key = f'test:{uuid.uuid4().hex}:product:views'
+        self.addCleanup(self.counter.client.delete, self.counter.key, self.counter.flushing_key)
+
+        category = Category.objects.create(name='Audio')
+        self.speaker = Product.objects.create(name='Speaker', price=Decimal('50.00'), category=category)
+        self.headphones = Product.objects.create(name='Headphones', price=Decimal('80.00'), category=category)
+
+    def test_views_are_shared_and_flushed_in_one_update(self):
+        with self.assertNumQueries(0):
+            for product in (self.speaker, self.speaker, self.headphones):
+                self.counter.record(product.id)
+
+        with self.assertNumQueries(1):
+            self.assertEqual(self.counter.flush(), 2)
+        self.assertEqual(self.counter.flush(), 0)
+        self.assertEqual(
+            dict(Product.objects.values_list('name', 'views')),
+            {'Speaker': 2, 'Headphones': 1}
+        )
+
+    def test_batch_left_by_failed_flush_is_retried(self):
+        self.counter.record(self.speaker.id)
+        self.counter.client.rename(self.counter.key, self.counter.flushing_key)
+        self.counter.record(self.speaker.id)
+
+        self.assertEqual(self.counter.flush(), 1)
+        self.speaker.refresh_from_db()
+        self.assertEqual(self.speaker.views, 1)
+        self.counter.flush()
+        self.speaker.refresh_from_db()
+        self.assertEqual(self.speaker.views, 2)
@@ -0,0 +1,57 @@
+import threading
+import unittest
+from decimal import Decimal
+from django.db import connection, connections
+from django.test import TransactionTestCase
+from apps.products.models import Category, Product
+from apps.products.stock import reserve_stock, InsufficientStock
+
+
+@unittest.skipUnless(connection.vendor == 'postgresql', 'Concurrent writers need PostgreSQL')
+class StockContentionTests(TransactionTestCase):
+    def setUp(self):
+        self.category = Category.objects.create(name='Flash Sale')
+        self.product = Product.objects.create(name='Hot SKU', price=Decimal('10.00'), stock=5, category=self.category)
+        self.other = Product.objects.create(name='Cold SKU', price=Decimal('10.00'), stock=100, category=self.category)
+
+    def _run_buyers(self, count, lines_for):
+        barrier = threading.Barrier(count)
+        results = []
+
+        def buyer(index):
+            try:
+                barrier.wait()
+                try:
+                    reserve_stock(lines_for(index))
+                    results.append(True)
+                except InsufficientStock:
+                    results.append(False)
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=buyer, args=(i,)) for i in range(count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def test_concurrent_buyers_never_oversell(self):
+        results = self._run_buyers(20, lambda i: [(self.product.pk, 1)])
+
+        self.assertEqual(results.count(True), 5)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 0)
+
+    def test_multi_line_orders_in_opposite_order_do_not_deadlock(self):
+        def lines_for(index):
+            lines = [(self.product.pk, 1), (self.other.pk, 1)]
+            return lines if index % 2 else list(reversed(lines))
+
+        results = self._run_buyers(10, lines_for)
+
+        self.assertEqual(results.count(True), 5)
+        self.product.refresh_from_db()
+        self.other.refresh_from_db()
+        self.assertEqual(self.product.stock, 0)
+        self.assertEqual(self.other.stock, 95)
@@ -0,0 +1,25 @@
+from pathlib import Path
+from django.conf import settings
+from django.test import SimpleTestCase
+import yaml
+
+MANIFESTS = Path(settings.BASE_DIR) / 'k8s'
+
+
+class ManifestTests(SimpleTestCase):
+    def documents(self, name):
+        with open(MANIFESTS / name) as manifest:
+            return [document for document in yaml.safe_load_all(manifest) if document is not None]
+
+    def test_every_document_parses(self):
+        for path in sorted(MANIFESTS.glob('*.yaml')):
+            with self.subTest(manifest=path.name):
+                documents = self.documents(path.name)
+                self.assertTrue(documents)
+                for document in documents:
+                    self.assertIn('kind', document)
+                    self.assertIn('name', document['metadata'])
+
+    def test_web_and_worker_deployments_are_separate(self):
+        names = [document['metadata']['name'] for document in self.documents('deployment.yaml')]
+        self.assertEqual(names, ['savannah-ecommerce', 'savannah-notifications'])
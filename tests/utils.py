@@ -0,0 +1,22 @@
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from rest_framework import status
+
+
+class QueryCountMixin:
+    """
+    For TestCases checking that an endpoint's query count does not grow with
+    the rows it returns.
+    """
+
+    def before_capture(self, url):
+        """Called between the warm-up request and the counted one"""
+
+    def count_queries(self, url):
+        """Return the number of queries a GET of ``url`` makes once warmed up"""
+        self.client.get(url)  # warms process-level state such as the category path map
+        self.before_capture(url)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return len(queries)